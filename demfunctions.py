@@ -0,0 +1,173 @@
+import math, numpy
+import xml.etree.ElementTree as ET
+from old_zipfile import ZipFile, BadZipfile
+from grdfunctions import *
+
+ISCE_DTYPES={'BYTE':numpy.int8,'SHORT':numpy.int16,'INT':numpy.int32,'FLOAT':numpy.float32,'DOUBLE':numpy.float64}
+
+def read_isce_xml(xmlfn):
+    '''
+    Parse an ISCE image .xml into a dict of lower-cased property names;
+    components (e.g. Coordinate1) become nested dicts.
+    '''
+    root=ET.parse(xmlfn).getroot()
+    prop={}
+    for p in root.findall('property'):
+        prop[p.get('name').lower()]=p.findtext('value').strip()
+    for c in root.findall('component'):
+        cprop={}
+        for p in c.findall('property'):
+            cprop[p.get('name').lower()]=p.findtext('value').strip()
+        prop[c.get('name').lower()]=cprop
+    return prop
+
+def isce_band(fn,xmlfn=None,band=0):
+    '''
+    Memory-map one band of an ISCE image (e.g. lat.rdr, lon.rdr, z.rdr) as
+    a (length,width) array, using width, length, data_type, byte_order,
+    number_bands and scheme from its .xml.
+    '''
+    if xmlfn is None:
+        xmlfn=''.join([fn,'.xml'])
+    prop=read_isce_xml(xmlfn)
+    width=int(prop.get('width',prop.get('coordinate1',{}).get('size')))
+    length=int(prop.get('length',prop.get('coordinate2',{}).get('size')))
+    bands=int(prop.get('number_bands',1))
+    scheme=prop.get('scheme','BIL').upper()
+    dtype=numpy.dtype(ISCE_DTYPES[prop.get('data_type','FLOAT').upper()])
+    if prop.get('byte_order','l').lower().startswith('b'):
+        dtype=dtype.newbyteorder('>')
+    else:
+        dtype=dtype.newbyteorder('<')
+    if scheme=='BSQ':
+        return numpy.memmap(fn,dtype=dtype,mode='r',shape=(bands,length,width))[band]
+    elif scheme=='BIP':
+        return numpy.memmap(fn,dtype=dtype,mode='r',shape=(length,width,bands))[:,:,band]
+    else:
+        return numpy.memmap(fn,dtype=dtype,mode='r',shape=(length,bands,width))[:,band,:]
+
+def write_isce_xml(xmlfn,width,length,data_type='FLOAT',bands=1,scheme='BIL'):
+    '''
+    Minimal ISCE image .xml for a little-endian raster written elsewhere.
+    '''
+    root=ET.Element('imageFile')
+    prop={'width':width,'length':length,'data_type':data_type,'number_bands':bands,'scheme':scheme,
+          'byte_order':'l','access_mode':'read','file_name':xmlfn[:-4]}
+    for name in sorted(prop):
+        p=ET.SubElement(root,'property',name=name)
+        ET.SubElement(p,'value').text=str(prop[name])
+    for (name,size) in (('coordinate1',width),('coordinate2',length)):
+        c=ET.SubElement(root,'component',name=name)
+        for (pname,value) in (('startingvalue',0),('delta',1),('size',size)):
+            p=ET.SubElement(c,'property',name=pname)
+            ET.SubElement(p,'value').text=str(value)
+    ET.ElementTree(root).write(xmlfn)
+
+class IsceDem:
+    '''
+    ISCE DEM raster memory-mapped in place; geometry is read from the
+    Coordinate1 (lon) and Coordinate2 (lat) components of its .xml.
+    '''
+    def __init__(self,demfn,xmlfn=None,nodata=-10000):
+        if xmlfn is None:
+            xmlfn=''.join([demfn,'.xml'])
+        prop=read_isce_xml(xmlfn)
+        self.width=int(prop['coordinate1']['size'])
+        self.length=int(prop['coordinate2']['size'])
+        self.lonstart=float(prop['coordinate1']['startingvalue'])
+        self.londelta=float(prop['coordinate1']['delta'])
+        self.latstart=float(prop['coordinate2']['startingvalue'])
+        self.latdelta=float(prop['coordinate2']['delta'])
+        dtype=numpy.dtype(ISCE_DTYPES[prop.get('data_type','SHORT').upper()])
+        if prop.get('byte_order','l').lower().startswith('b'):
+            dtype=dtype.newbyteorder('>')
+        else:
+            dtype=dtype.newbyteorder('<')
+        self.fn=demfn
+        self.nodata=nodata
+        self.data=numpy.memmap(demfn,dtype=dtype,mode='r',shape=(self.length,self.width))
+        self.x=self.lonstart+self.londelta*numpy.arange(self.width)
+        self.y=self.latstart+self.latdelta*numpy.arange(self.length)
+
+    def region(self):
+        return (min(self.x[0],self.x[-1]),max(self.x[0],self.x[-1]),min(self.y[0],self.y[-1]),max(self.y[0],self.y[-1]))
+
+    def window(self,region,inc=None):
+        '''
+        Grid view of the nodes inside region, decimated to the GMT increment
+        inc if it is coarser than the DEM posting.  No data is read.
+        '''
+        (lonmin,lonmax,latmin,latmax)=region
+        xtol=0.5*abs(self.londelta)
+        ytol=0.5*abs(self.latdelta)
+        cols=numpy.nonzero((self.x>=lonmin-xtol)&(self.x<=lonmax+xtol))[0]
+        rows=numpy.nonzero((self.y>=latmin-ytol)&(self.y<=latmax+ytol))[0]
+        if len(cols)==0 or len(rows)==0:
+            raise ValueError(' '.join(['region does not overlap',self.fn]))
+        xstep=1
+        ystep=1
+        if inc is not None:
+            (dx,dy)=parse_inc(inc,region)
+            xstep=max(1,int(round(dx/abs(self.londelta))))
+            ystep=max(1,int(round(dy/abs(self.latdelta))))
+        xs=slice(cols[0],cols[-1]+1,xstep)
+        ys=slice(rows[0],rows[-1]+1,ystep)
+        return Grid(self.x[xs],self.y[ys],self.data[ys,xs],nodata=self.nodata)
+
+def read_hgt_zip(zipfn,out=None):
+    '''
+    Inflate the .hgt member of an SRTM .hgt.zip straight into a big-endian
+    int16 array; out is reused when it already has the tile shape.
+    Nothing is extracted to disk.
+    '''
+    fh=open(zipfn,'rb')
+    try:
+        zf=ZipFile(fh)
+        members=[zi for zi in zf.infolist() if zi.filename.endswith('.hgt')]
+        if len(members)==0:
+            raise BadZipfile(' '.join(['no .hgt member in',zipfn]))
+        member=members[0]
+        n=int(round(math.sqrt(member.file_size/2)))
+        if out is None or out.shape!=(n,n):
+            out=numpy.empty((n,n),dtype='>i2')
+        nread=zf.open(member).readinto(out.reshape(-1).view(numpy.uint8))
+    finally:
+        fh.close()
+    if nread!=member.file_size:
+        raise BadZipfile(' '.join(['short read from',zipfn]))
+    return out
+
+def srtm_mosaic(tiles,region,grdfn,d=1/3600.):
+    '''
+    Mosaic SRTM tiles {(lat,lon): .hgt.zip} onto region at posting d and
+    write it as a GMT grid, one 1-degree latitude band at a time.  Missing
+    tiles, voids and heights below -100 m are NaN.
+    '''
+    (lonmin,lonmax,latmin,latmax)=region
+    nx=int(round((lonmax-lonmin)/d))+1
+    ny=int(round((latmax-latmin)/d))+1
+    x=lonmin+d*numpy.arange(nx)
+    y=latmax-d*numpy.arange(ny)
+    # band (SW corner latitude of the tile) that owns each mosaic row
+    band=numpy.maximum(numpy.ceil(y-1e-9).astype(int)-1,int(math.floor(latmin)))
+    out=GrdWriter(grdfn,x,y)
+    tile=None
+    for lat in sorted(set(band),reverse=True):
+        rows=numpy.nonzero(band==lat)[0]
+        block=numpy.empty((len(rows),nx),dtype=numpy.float32)
+        block.fill(numpy.nan)
+        for (tlat,tlon) in sorted(tiles):
+            if tlat!=lat:
+                continue
+            tile=read_hgt_zip(tiles[(tlat,tlon)],tile)
+            n=tile.shape[0]
+            r=numpy.clip(numpy.round((lat+1-y[rows])*(n-1)).astype(int),0,n-1)
+            c=numpy.round((x-tlon)*(n-1)).astype(int)
+            cols=numpy.nonzero((c>=0)&(c<n))[0]
+            if len(cols)==0:
+                continue
+            block[:,cols]=tile[numpy.ix_(r,c[cols])]
+        with numpy.errstate(invalid='ignore'):
+            block[~(block>-100)]=numpy.nan
+        out.write_rows(rows[0],block)
+    out.close()
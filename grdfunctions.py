@@ -0,0 +1,175 @@
+import os, numpy
+from PyNIO import Nio
+from precision import work_dtype
+
+# Helpers for GMT (COARDS netCDF) grids and grid-like arrays.
+# Grids are described by 1-D node coordinates x (lon) and y (lat) and a
+# 2-D array z[y,x]; rows may be stored south-up (GMT) or north-up (ISCE).
+
+def write_atomic(fn,write):
+    '''
+    Create fn by write(tmpfn) under a name private to this process (with
+    fn's extension, which numpy savers insist on) and rename it into place,
+    so concurrent runs sharing a cache never read a partial file.
+    '''
+    (root,ext)=os.path.splitext(fn)
+    tmpfn=''.join(['.'.join([root,str(os.getpid())]),ext])
+    try:
+        write(tmpfn)
+    except:
+        if os.path.exists(tmpfn):
+            os.remove(tmpfn)
+        raise
+    os.rename(tmpfn,fn)
+    return fn
+
+def parse_inc(inc,region):
+    '''
+    Convert a GMT -I increment string (e.g. 6c, 0.01, 1m/2m, 3600+/2400+)
+    into (dx,dy) in degrees for region (lonmin,lonmax,latmin,latmax).
+    '''
+    (lonmin,lonmax,latmin,latmax)=region
+    parts=str(inc).split('/')
+    if len(parts)==1:
+        parts=parts*2
+    span=[float(lonmax-lonmin),float(latmax-latmin)]
+    d=[]
+    for i in range(2):
+        s=parts[i].rstrip('=')
+        if s.endswith('+'):
+            n=int(s[:-1])
+            d.append(span[i]/(n-1))
+        elif s.endswith('m'):
+            d.append(float(s[:-1])/60.)
+        elif s.endswith('c') or s.endswith('s'):
+            d.append(float(s[:-1])/3600.)
+        elif s.endswith('e'):
+            d.append(float(s[:-1])/111195.)
+        else:
+            d.append(float(s))
+    return (d[0],d[1])
+
+class Grid:
+    '''
+    Grid nodes x, y and a row-indexable z (ndarray, memmap or Nio variable).
+    Rows come back in the working precision, values equal to nodata as NaN.
+    '''
+    def __init__(self,x,y,z,nodata=None,fh=None):
+        self.x=numpy.asarray(x,dtype=float)
+        self.y=numpy.asarray(y,dtype=float)
+        self.z=z
+        self.nodata=nodata
+        self.fh=fh
+        self.shape=(len(self.y),len(self.x))
+
+    def rows(self,i0,i1):
+        block=numpy.array(self.z[i0:i1],dtype=work_dtype())
+        if self.nodata is not None:
+            block[block==self.nodata]=numpy.nan
+        return block
+
+    def read(self):
+        return self.rows(0,self.shape[0])
+
+    def sample(self,step):
+        '''
+        Every step-th node in both directions, with NaN nodata.
+        '''
+        block=numpy.array(self.z[::step,::step],dtype=work_dtype())
+        if self.nodata is not None:
+            block[block==self.nodata]=numpy.nan
+        return block
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh=None
+
+def open_grd(fn,var='z'):
+    '''
+    Open a GMT netCDF grid without reading z (or the band var); rows are
+    read on demand.
+    '''
+    fh=Nio.open_file(fn,"r",format='netcdf')
+    z=fh.variables[var]
+    (ydim,xdim)=z.dimensions
+    x=fh.variables[xdim][:]
+    y=fh.variables[ydim][:]
+    return Grid(x,y,z,fh=fh)
+
+def read_grd(fn):
+    grid=open_grd(fn)
+    z=grid.read()
+    grid.close()
+    return (grid.x,grid.y,z)
+
+class GrdWriter:
+    '''
+    Incremental writer for a GMT-compatible (COARDS) netCDF grid with nodes
+    x, y.  Row blocks are passed in the order of y and stored south-up.
+    With chunk (nx,ny) or complevel (1-9) the file is netCDF-4 classic,
+    tiled in nx by ny chunks and deflated, so blocks stream to disk and
+    readers can fetch a window without decoding the whole grid.  names
+    lists the (y,x) variables, z by default; extra bands are read by GMT
+    as fn?name.
+    '''
+    def __init__(self,fn,x,y,title='',chunk=None,complevel=0,names=('z',)):
+        x=numpy.asarray(x,dtype=float)
+        y=numpy.asarray(y,dtype=float)
+        self.flip=y[0]>y[-1]
+        if self.flip:
+            y=y[::-1]
+        self.fn=fn
+        self.ny=len(y)
+        self.zrange=dict((name,[numpy.inf,-numpy.inf]) for name in names)
+        opt=None
+        if chunk is not None or complevel:
+            opt=Nio.options()
+            opt.Format='NetCDF4Classic'
+            if complevel:
+                opt.CompressionLevel=int(complevel)
+        out=Nio.open_file(fn,"c",options=opt,format='netcdf')
+        out.Conventions='COARDS'
+        out.title=title
+        out.node_offset=numpy.int32(0)
+        out.create_dimension('x',len(x))
+        out.create_dimension('y',len(y))
+        if chunk is not None:
+            out.create_chunk_dimension('x',min(int(chunk[0]),len(x)))
+            out.create_chunk_dimension('y',min(int(chunk[1]),len(y)))
+        out.create_variable('x','d',('x',))
+        out.create_variable('y','d',('y',))
+        for name in names:
+            out.create_variable(name,'f',('y','x'))
+        out.variables['x'].actual_range=numpy.array([x[0],x[-1]])
+        out.variables['y'].actual_range=numpy.array([y[0],y[-1]])
+        out.variables['x'][:]=x
+        out.variables['y'][:]=y
+        self.out=out
+
+    def write_rows(self,i0,block,name='z'):
+        block=numpy.asarray(block,dtype=numpy.float32)
+        i1=i0+block.shape[0]
+        if self.flip:
+            self.out.variables[name][self.ny-i1:self.ny-i0,:]=block[::-1]
+        else:
+            self.out.variables[name][i0:i1,:]=block
+        good=block[numpy.isfinite(block)]
+        if good.size:
+            zrange=self.zrange[name]
+            zrange[0]=min(zrange[0],good.min())
+            zrange[1]=max(zrange[1],good.max())
+
+    def close(self):
+        for (name,zrange) in self.zrange.items():
+            if zrange[0]<=zrange[1]:
+                self.out.variables[name].actual_range=numpy.array(zrange)
+        self.out.close()
+
+def write_grd(fn,x,y,z,title='',chunk=None,complevel=0):
+    '''
+    Write z[y,x] as a GMT-compatible (COARDS) netCDF grid.
+    '''
+    out=GrdWriter(fn,x,y,title,chunk,complevel)
+    out.write_rows(0,z)
+    out.close()
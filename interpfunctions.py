@@ -0,0 +1,335 @@
+import os, hashlib, collections, numpy
+from scipy import sparse
+from scipy.spatial import cKDTree, Delaunay
+from scipy.optimize import curve_fit
+from grdfunctions import write_atomic
+from precision import work_dtype
+
+# Interpolation of station residuals onto the working grid.  Stations and
+# grid nodes are given as lon/lat in degrees; distances are great-circle km.
+
+Rearth=6371.
+
+# the operators last used in this process (at most MAX_OPERATORS), keyed
+# as on disk
+MAX_OPERATORS=4
+_operators=collections.OrderedDict()
+
+def unit_xyz(lon,lat):
+    '''
+    Points on the unit sphere; chord length between them is monotonic in
+    great-circle distance, so a Euclidean k-d tree gives exact haversine
+    nearest neighbours.
+    '''
+    lon=numpy.radians(numpy.asarray(lon,dtype=float))
+    lat=numpy.radians(numpy.asarray(lat,dtype=float))
+    return numpy.column_stack((numpy.cos(lat)*numpy.cos(lon),numpy.cos(lat)*numpy.sin(lon),numpy.sin(lat)))
+
+def chord2km(c):
+    return 2*Rearth*numpy.arcsin(numpy.clip(0.5*c,0.,1.))
+
+def knn(stnlon,stnlat,lon,lat,k):
+    '''
+    Indices (M,k) of and distances (M,k) in km to the k nearest stations
+    of each of the M points lon, lat.
+    '''
+    k=min(k,len(stnlon))
+    tree=cKDTree(unit_xyz(stnlon,stnlat))
+    (c,idx)=tree.query(unit_xyz(lon,lat),k=k)
+    if k==1:
+        c=c[:,numpy.newaxis]
+        idx=idx[:,numpy.newaxis]
+    return (idx,chord2km(c))
+
+def idw_weights(stnlon,stnlat,lon,lat,k=10,dMax=200.,power=2):
+    '''
+    Inverse-distance weights of the k nearest stations within dMax km of
+    each point, normalised to sum to one.  Returns (idx,w), both (M,k);
+    points with no station within dMax get NaN weights.
+    '''
+    (idx,d)=knn(stnlon,stnlat,lon,lat,k)
+    # a station sitting on a node takes all of its weight
+    d=numpy.maximum(d,1e-6)
+    w=numpy.where(d<dMax,1./d**power,0.)
+    fsum=w.sum(axis=1)
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+        w/=fsum[:,numpy.newaxis]
+    return (idx,w)
+
+def triang_weights(stnlon,stnlat,lon,lat):
+    '''
+    Linear interpolation weights on the Delaunay triangulation of the
+    stations in lon/lat (as GMT triangulate): the barycentric coordinates
+    of each point in its enclosing triangle.  Returns (idx,w), both (M,3);
+    points outside the convex hull get NaN weights.
+    '''
+    tri=Delaunay(numpy.column_stack((stnlon,stnlat)))
+    xi=numpy.column_stack((lon,lat))
+    s=tri.find_simplex(xi)
+    T=tri.transform[s]
+    b=numpy.einsum('ijk,ik->ij',T[:,:2,:],xi-T[:,2,:])
+    w=numpy.column_stack((b,1.-b.sum(axis=1)))
+    w[s<0]=numpy.nan
+    return (tri.simplices[s],w)
+
+def bilinear_weights(x,y,lon,lat):
+    '''
+    Bilinear weights of the regular grid with nodes x, y at the points
+    lon, lat; indices are into the row-major (y,x) ravel of the grid, so
+    apply_weights samples a 2-D field z[y,x] with z.ravel().  Points off
+    the grid get NaN weights.
+    '''
+    x=numpy.asarray(x,dtype=float)
+    y=numpy.asarray(y,dtype=float)
+    fx=(numpy.asarray(lon,dtype=float)-x[0])/(x[1]-x[0])
+    fy=(numpy.asarray(lat,dtype=float)-y[0])/(y[1]-y[0])
+    nx=len(x)
+    ny=len(y)
+    i=numpy.clip(numpy.floor(fx).astype(int),0,nx-2)
+    j=numpy.clip(numpy.floor(fy).astype(int),0,ny-2)
+    tx=fx-i
+    ty=fy-j
+    idx=numpy.column_stack((j*nx+i,j*nx+i+1,(j+1)*nx+i,(j+1)*nx+i+1))
+    w=numpy.column_stack(((1-tx)*(1-ty),tx*(1-ty),(1-tx)*ty,tx*ty))
+    eps=1e-9
+    w[(fx<-eps)|(fx>nx-1+eps)|(fy<-eps)|(fy>ny-1+eps)]=numpy.nan
+    return (idx,w)
+
+def hull_support(tri,lon,lat):
+    '''
+    Mask of the points of Delaunay triangulation tri that are vertices of
+    triangles overlapping the bbox of lon, lat.  Those triangles survive
+    in the triangulation of the masked subset, so triang_weights from the
+    subset equal the full ones anywhere in the bbox.
+    '''
+    corners=tri.points[tri.simplices]
+    lo=corners.min(axis=1)
+    hi=corners.max(axis=1)
+    overlap=(hi[:,0]>=numpy.min(lon))&(lo[:,0]<=numpy.max(lon))&(hi[:,1]>=numpy.min(lat))&(lo[:,1]<=numpy.max(lat))
+    mask=numpy.zeros(len(tri.points),dtype=bool)
+    mask[tri.simplices[overlap].ravel()]=True
+    return mask
+
+def knn_support(stnlon,stnlat,lon,lat,k):
+    '''
+    Mask of the stations that can be among the k nearest of any node of
+    the grid with nodes lon, lat: those within d_k(c)+2r of the grid
+    centre c, where r is the largest distance from c to the grid edge.
+    '''
+    lon=numpy.asarray(lon,dtype=float)
+    lat=numpy.asarray(lat,dtype=float)
+    c=(numpy.array([0.5*(lon[0]+lon[-1])]),numpy.array([0.5*(lat[0]+lat[-1])]))
+    edge=(numpy.concatenate((lon,lon,numpy.repeat(lon[[0,-1]],len(lat)))),
+          numpy.concatenate((numpy.repeat(lat[0],len(lon)),numpy.repeat(lat[-1],len(lon)),numpy.tile(lat,2))))
+    r=chord2km(numpy.sqrt(((unit_xyz(*edge)-unit_xyz(*c))**2).sum(axis=1))).max()
+    (idx,d)=knn(stnlon,stnlat,c[0],c[1],k)
+    dstn=chord2km(numpy.sqrt(((unit_xyz(stnlon,stnlat)-unit_xyz(*c))**2).sum(axis=1)))
+    return dstn<=d[0,-1]+2*r+1e-6
+
+def variogram(h,nugget,sill,rng):
+    '''
+    Exponential semivariogram model; zero at zero lag.
+    '''
+    return numpy.where(h>0,nugget+sill*(1.-numpy.exp(-h/rng)),0.)
+
+def fit_variogram(stnlon,stnlat,values,maxdist=500.,nbins=20):
+    '''
+    Fit (nugget,sill,range) of an exponential variogram to the binned
+    semivariance of station pairs closer than maxdist km.  values may be
+    (N,) or (N,T); semivariances are then pooled over the T epochs.
+    '''
+    P=unit_xyz(stnlon,stnlat)
+    values=numpy.asarray(values,dtype=float).reshape(len(P),-1)
+    var=values.var()
+    if var<=0:
+        var=1.
+    default=(0.,var,maxdist/3.)
+    pairs=cKDTree(P).query_pairs(2*numpy.sin(0.5*maxdist/Rearth),output_type='ndarray')
+    if len(pairs)<nbins:
+        return default
+    h=chord2km(numpy.sqrt(((P[pairs[:,0]]-P[pairs[:,1]])**2).sum(axis=1)))
+    g=0.5*((values[pairs[:,0]]-values[pairs[:,1]])**2).mean(axis=1)
+    b=numpy.minimum((h/maxdist*nbins).astype(int),nbins-1)
+    n=numpy.bincount(b,minlength=nbins)
+    ok=n>0
+    hb=numpy.bincount(b,weights=h,minlength=nbins)[ok]/n[ok]
+    gb=numpy.bincount(b,weights=g,minlength=nbins)[ok]/n[ok]
+    try:
+        (p,cov)=curve_fit(lambda x,nugget,sill,rng: nugget+sill*(1.-numpy.exp(-x/rng)),hb,gb,p0=default,sigma=1./numpy.sqrt(n[ok]),bounds=([0.,1e-12*var,1e-3],[numpy.inf,numpy.inf,10*maxdist]))
+    except (RuntimeError,ValueError):
+        return default
+    return tuple(float(x) for x in p)
+
+def krige_weights(stnlon,stnlat,lon,lat,vario,k=16,block=20000):
+    '''
+    Local ordinary kriging weights from the k nearest stations of each
+    point with variogram parameters vario=(nugget,sill,range).  The
+    (k+1)x(k+1) neighbourhood systems are solved in vectorized batches of
+    block points, so cost is linear in points and stations.  Returns
+    (idx,w), both (M,k).
+    '''
+    (idx,d)=knn(stnlon,stnlat,lon,lat,k)
+    (M,k)=idx.shape
+    P=unit_xyz(stnlon,stnlat)
+    w=numpy.empty((M,k))
+    for i0 in range(0,M,block):
+        i1=min(M,i0+block)
+        Q=P[idx[i0:i1]]
+        dss=chord2km(numpy.sqrt(((Q[:,:,numpy.newaxis,:]-Q[:,numpy.newaxis,:,:])**2).sum(axis=-1)))
+        A=numpy.ones((i1-i0,k+1,k+1))
+        A[:,:k,:k]=variogram(dss,*vario)
+        A[:,k,k]=0.
+        b=numpy.ones((i1-i0,k+1,1))
+        b[:,:k,0]=variogram(d[i0:i1],*vario)
+        try:
+            sol=numpy.linalg.solve(A,b)
+        except numpy.linalg.LinAlgError:
+            # coincident stations make some systems singular
+            sol=numpy.matmul(numpy.linalg.pinv(A),b)
+        w[i0:i1]=sol[:,:k,0]
+    return (idx,w)
+
+def apply_weights(idx,w,values):
+    '''
+    Weighted sum of station values for each point, from idw_weights,
+    triang_weights, krige_weights or bilinear_weights.
+    '''
+    return (w*numpy.asarray(values,dtype=float)[idx]).sum(axis=1)
+
+def operator_key(mode,stnlon,stnlat,lon,lat,opts):
+    '''
+    Hash of the interpolation mode and options, the station set and the grid.
+    '''
+    h=hashlib.sha1()
+    h.update(' '.join([mode]+['='.join([k,repr(opts[k])]) for k in sorted(opts)]).encode('ascii'))
+    for a in (stnlon,stnlat,lon,lat):
+        h.update(numpy.round(numpy.asarray(a,dtype=float),6).tobytes())
+    return h.hexdigest()
+
+def keep_operator(mode,key,W):
+#   remember W as the most recently used operator; kriging operators depend
+#   on each epoch's fitted variogram and are never reused, so are not kept
+    if mode!='krige':
+        _operators.pop(key,None)
+        _operators[key]=W
+        while len(_operators)>MAX_OPERATORS:
+            _operators.popitem(last=False)
+    return W
+
+def interp_operator(mode,stnlon,stnlat,lon,lat,cachedir=None,**opts):
+    '''
+    Sparse (grid x station) interpolation operator of mode ('triang', 'IDW'
+    or 'krige') onto the grid with nodes lon, lat; rows are in row-major
+    (lat,lon) order.  Residuals for T epochs stacked as an (N,T) matrix
+    interpolate in one product, see apply_operator.  Operators depend only
+    on station and grid geometry, so the last few are kept per process (see
+    keep_operator) and, with cachedir, all on disk as weights.<key>.npz.
+    '''
+    stnlon=numpy.asarray(stnlon,dtype=float)
+    stnlat=numpy.asarray(stnlat,dtype=float)
+    key=operator_key(mode,stnlon,stnlat,lon,lat,opts)
+    if key in _operators:
+        return keep_operator(mode,key,_operators[key])
+    if cachedir is not None:
+        fn=os.path.join(cachedir,'.'.join(['weights',key,'npz']))
+        if os.path.exists(fn):
+            return keep_operator(mode,key,sparse.load_npz(fn))
+
+    (glon,glat)=numpy.meshgrid(lon,lat)
+    if mode=='triang':
+        (idx,w)=triang_weights(stnlon,stnlat,glon.ravel(),glat.ravel())
+    elif mode=='IDW':
+        (idx,w)=idw_weights(stnlon,stnlat,glon.ravel(),glat.ravel(),**opts)
+    elif mode=='krige':
+        (idx,w)=krige_weights(stnlon,stnlat,glon.ravel(),glat.ravel(),**opts)
+    else:
+        raise ValueError(' '.join(['unknown interpolation mode',mode]))
+    rows=numpy.repeat(numpy.arange(glon.size),idx.shape[1])
+    W=sparse.csr_matrix((w.ravel(),(rows,idx.ravel())),shape=(glon.size,len(stnlon)))
+
+    if cachedir is not None:
+        write_atomic(fn,lambda tmpfn: sparse.save_npz(tmpfn,W,compressed=False))
+    return keep_operator(mode,key,W)
+
+def apply_operator(W,values):
+    '''
+    Interpolate station values (N,) or (N,T) with operator W, in the
+    working precision (operators are built and cached in double).
+    '''
+    dtype=work_dtype()
+    if W.dtype!=dtype:
+        W=W.astype(dtype)
+    return W.dot(numpy.asarray(values,dtype=dtype))
+
+def loo_operator(mode,stnlon,stnlat,**opts):
+    '''
+    Sparse (station x station) leave-one-out operator of mode: row i holds
+    the weights that predict station i from all the others, so prediction
+    errors for residuals R (N,T) are R-L*R.  Nothing is refitted per
+    station: IDW drops the station from its own neighbour list, triang
+    retriangulates only the star of the removed vertex, and krige uses
+    the downdating identity on each (k+1)-station neighbourhood system,
+    prediction_i = -sum_j Kinv[i,j]/Kinv[i,i] z_j.  Stations that cannot
+    be predicted (outside the hull of the others) get NaN rows.
+    '''
+    stnlon=numpy.asarray(stnlon,dtype=float)
+    stnlat=numpy.asarray(stnlat,dtype=float)
+    N=len(stnlon)
+    if mode=='IDW':
+        k=opts.get('k',10)
+        dMax=opts.get('dMax',200.)
+        power=opts.get('power',2)
+        (idx,d)=knn(stnlon,stnlat,stnlon,stnlat,k+1)
+        own=idx==numpy.arange(N)[:,numpy.newaxis]
+        # coincident stations may push a station out of its own list
+        own[~own.any(axis=1),-1]=True
+        idx=idx[~own].reshape(N,-1)
+        d=numpy.maximum(d[~own].reshape(N,-1),1e-6)
+        w=numpy.where(d<dMax,1./d**power,0.)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            w/=w.sum(axis=1)[:,numpy.newaxis]
+    elif mode=='triang':
+        tri=Delaunay(numpy.column_stack((stnlon,stnlat)))
+        (indptr,nbrs)=tri.vertex_neighbor_vertices
+        idx=numpy.zeros((N,3),dtype=int)
+        w=numpy.empty((N,3))
+        w.fill(numpy.nan)
+        for i in range(N):
+            link=nbrs[indptr[i]:indptr[i+1]]
+            if len(link)<3:
+                continue
+            try:
+                star=Delaunay(numpy.column_stack((stnlon[link],stnlat[link])))
+            except Exception:
+                continue
+            s=star.find_simplex([stnlon[i],stnlat[i]])
+            if s<0:
+                continue
+            T=star.transform[s]
+            b=numpy.dot(T[:2],[stnlon[i]-T[2,0],stnlat[i]-T[2,1]])
+            idx[i]=link[star.simplices[s]]
+            w[i]=[b[0],b[1],1.-b.sum()]
+    elif mode=='krige':
+        k=opts.get('k',16)
+        vario=opts['vario']
+        (nbr,d)=knn(stnlon,stnlat,stnlon,stnlat,k+1)
+        m=nbr.shape[1]
+        P=unit_xyz(stnlon,stnlat)[nbr]
+        dss=chord2km(numpy.sqrt(((P[:,:,numpy.newaxis,:]-P[:,numpy.newaxis,:,:])**2).sum(axis=-1)))
+        K=numpy.ones((N,m+1,m+1))
+        K[:,:m,:m]=variogram(dss,*vario)
+        K[:,m,m]=0.
+        try:
+            Kinv=numpy.linalg.inv(K)
+        except numpy.linalg.LinAlgError:
+            Kinv=numpy.linalg.pinv(K)
+        # locate each station in its own neighbourhood (normally column 0)
+        own=numpy.argmax(nbr==numpy.arange(N)[:,numpy.newaxis],axis=1)
+        rows=numpy.arange(N)
+        w=-Kinv[rows,own,:m]/Kinv[rows,own,own][:,numpy.newaxis]
+        w[rows,own]=0.
+        idx=nbr
+    else:
+        raise ValueError(' '.join(['unknown interpolation mode',mode]))
+    rows=numpy.repeat(numpy.arange(N),idx.shape[1])
+    return sparse.csr_matrix((w.ravel(),(rows,idx.ravel())),shape=(N,N))
@@ -632,6 +632,62 @@ class ZipExtFile:
 
         return bytes
 
+    def readinto(self, b):
+        """Read up to len(b) bytes into the writable byte buffer b (a
+           bytearray, or a uint8 view of a numpy array) and return the
+           number of bytes read.  Compressed data are inflated one block
+           at a time straight into b rather than accumulated as strings.
+        """
+        out = memoryview(b)
+        size = len(out)
+        pos = 0
+
+        # hand over anything already buffered by read()/readline()
+        for attr in ('linebuffer', 'readbuffer'):
+            data = getattr(self, attr)
+            if data and pos < size:
+                n = min(len(data), size - pos)
+                out[pos:pos + n] = data[:n]
+                setattr(self, attr, data[n:])
+                pos += n
+
+        while pos < size:
+            newdata = self.rawbuffer
+            self.rawbuffer = ''
+            if not newdata:
+                bytesToRead = self.compress_size - self.bytes_read
+                if self.decrypter is not None:
+                    bytesToRead -= 12
+                bytesToRead = min(bytesToRead, self.compreadsize)
+                if bytesToRead > 0:
+                    newdata = self.fileobj.read(bytesToRead)
+                    self.bytes_read += len(newdata)
+                    if newdata and self.decrypter is not None:
+                        newdata = ''.join(map(self.decrypter, newdata))
+
+            if self.compress_type == ZIP_DEFLATED and self.dc is not None:
+                if newdata:
+                    # never inflate more than fits in what is left of b
+                    data = self.dc.decompress(newdata, size - pos)
+                    self.rawbuffer = self.dc.unconsumed_tail
+                else:
+                    data = self.dc.flush()
+                    self.dc = None
+            else:
+                data = newdata
+
+            if not data:
+                if not newdata:
+                    break
+                continue
+            n = min(len(data), size - pos)
+            out[pos:pos + n] = data[:n]
+            if n < len(data):
+                self.readbuffer = data[n:]
+            pos += n
+
+        return pos
+
 
 class ZipFile:
     """ Class with methods to open, read, write, close, list zip files.
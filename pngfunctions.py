@@ -0,0 +1,214 @@
+import os, subprocess, struct, zlib, numpy
+from grdfunctions import write_atomic
+
+# Preview images of grids without GMT/PostScript: colour-map a decimated
+# view of the grid through a GMT CPT, draw coastlines clipped from one
+# cached global shoreline file and a colour bar, and write an RGB PNG
+# directly.
+
+_cpts={}
+
+def read_cpt(cptfn):
+    '''
+    Parse a continuous RGB GMT CPT (z0 r g b z1 r g b lines, B/F/N colours).
+    Returns a dict with z0, z1 (n,) and rgb0, rgb1 (n,3); parsed files are
+    kept per process.
+    '''
+    if cptfn in _cpts:
+        return _cpts[cptfn]
+    z0=[]
+    z1=[]
+    rgb0=[]
+    rgb1=[]
+    cpt={'B':(0,0,0),'F':(255,255,255),'N':(128,128,128)}
+    for line in open(cptfn):
+        fields=line.split('#')[0].split()
+        if len(fields)==0:
+            continue
+        if fields[0] in ('B','F','N'):
+            cpt[fields[0]]=tuple(int(float(v)) for v in fields[1:4])
+        elif len(fields)>=8:
+            z0.append(float(fields[0]))
+            rgb0.append([float(v) for v in fields[1:4]])
+            z1.append(float(fields[4]))
+            rgb1.append([float(v) for v in fields[5:8]])
+    cpt['z0']=numpy.array(z0)
+    cpt['z1']=numpy.array(z1)
+    cpt['rgb0']=numpy.array(rgb0)
+    cpt['rgb1']=numpy.array(rgb1)
+    _cpts[cptfn]=cpt
+    return cpt
+
+def scale_cpt(cpt,zmin,zmax):
+#   cpt with its slices stretched linearly onto zmin..zmax
+    (lo,hi)=(cpt['z0'][0],cpt['z1'][-1])
+    scaled=dict(cpt)
+    for key in ('z0','z1'):
+        scaled[key]=zmin+(cpt[key]-lo)*(zmax-zmin)/(hi-lo)
+    return scaled
+
+def data_range(z,low=2,high=98):
+#   the low and high percentiles of the finite values of z, or None
+    v=z[numpy.isfinite(z)]
+    if v.size==0:
+        return None
+    (zmin,zmax)=numpy.percentile(v,[low,high])
+    if zmax<=zmin:
+        (zmin,zmax)=(zmin-0.5*abs(zmin)-1e-3,zmax+0.5*abs(zmax)+1e-3)
+    return (zmin,zmax)
+
+def colorize(z,cpt):
+    '''
+    RGB uint8 image (ny,nx,3) of z through cpt, interpolating colours
+    within each slice; B/F below/above the range, N for NaN.
+    '''
+    z=numpy.asarray(z,dtype=float)
+    k=numpy.clip(numpy.searchsorted(cpt['z0'],z,side='right')-1,0,len(cpt['z0'])-1)
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+        t=numpy.clip((z-cpt['z0'][k])/(cpt['z1'][k]-cpt['z0'][k]),0,1)
+        rgb=cpt['rgb0'][k]+t[...,numpy.newaxis]*(cpt['rgb1'][k]-cpt['rgb0'][k])
+        rgb[z<cpt['z0'][0]]=cpt['B']
+        rgb[z>cpt['z1'][-1]]=cpt['F']
+    rgb[numpy.isnan(z)]=cpt['N']
+    return numpy.round(rgb).astype(numpy.uint8)
+
+def write_png(pngfn,rgb):
+    '''
+    Write an RGB uint8 image (ny,nx,3) as an 8-bit truecolour PNG.
+    '''
+    rgb=numpy.ascontiguousarray(rgb,dtype=numpy.uint8)
+    (ny,nx)=rgb.shape[:2]
+    # filter type 0 (none) in front of every scanline
+    raw=numpy.zeros((ny,1+3*nx),dtype=numpy.uint8)
+    raw[:,1:]=rgb.reshape(ny,3*nx)
+    def chunk(tag,data):
+        return ''.join([struct.pack('>I',len(data)),tag,data,struct.pack('>I',zlib.crc32(tag+data)&0xffffffff)])
+    out=open(pngfn,'wb')
+    out.write('\x89PNG\r\n\x1a\n')
+    out.write(chunk('IHDR',struct.pack('>IIBBBBB',nx,ny,8,2,0,0,0)))
+    out.write(chunk('IDAT',zlib.compress(raw.tostring(),6)))
+    out.write(chunk('IEND',''))
+    out.close()
+
+COASTFILE=os.environ.get('TROPMAP_COAST',os.path.join(os.path.expanduser('~'),'.tropmap','coast.i.npz'))
+_coast=[]
+
+def build_coast(fn):
+    '''
+    Dump GMT's intermediate (GSHHS) shorelines of the whole globe once with
+    pscoast -M into fn: the points xy (float32 lon,lat, lon in -180..180),
+    the start of each segment in xy (and the end of the last) and each
+    segment's bounding box lonmin,lonmax,latmin,latmax.
+    '''
+    txt=subprocess.Popen(['pscoast','-Rd','-Jx1d','-Di','-W','-M'],stdout=subprocess.PIPE,stderr=open(os.devnull,'w')).communicate()[0]
+    segments=[]
+    seg=[]
+    for line in txt.split('\n'):
+        fields=line.split()
+        if len(fields)==0 or line.startswith('>') or line.startswith('#'):
+            if len(seg)>1:
+                segments.append(numpy.array(seg,dtype=numpy.float32))
+            seg=[]
+            continue
+        seg.append([float(fields[0]),float(fields[1])])
+    if len(seg)>1:
+        segments.append(numpy.array(seg,dtype=numpy.float32))
+    if len(segments)==0:
+        raise IOError('pscoast gave no shorelines')
+    starts=numpy.concatenate(([0],numpy.cumsum([len(seg) for seg in segments])))
+    bbox=numpy.array([[seg[:,0].min(),seg[:,0].max(),seg[:,1].min(),seg[:,1].max()] for seg in segments])
+    if not os.path.isdir(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    write_atomic(fn,lambda tmpfn: numpy.savez(tmpfn,xy=numpy.concatenate(segments),starts=starts,bbox=bbox))
+
+def load_coast():
+#   the global shorelines of COASTFILE (built on first use), kept per
+#   process; None without the file or GMT to build it
+    if not _coast:
+        try:
+            if not os.path.exists(COASTFILE):
+                build_coast(COASTFILE)
+            f=numpy.load(COASTFILE)
+            _coast.append(dict((key,f[key]) for key in ('xy','starts','bbox')))
+        except (OSError,IOError):
+            _coast.append(None)
+    return _coast[0]
+
+def clip_segment(seg,region):
+#   runs of the points of seg inside region, each with its neighbours
+#   outside so lines are drawn up to the border
+    (lonmin,lonmax,latmin,latmax)=region
+    inside=(seg[:,0]>=lonmin)&(seg[:,0]<=lonmax)&(seg[:,1]>=latmin)&(seg[:,1]<=latmax)
+    keep=inside.copy()
+    keep[1:]|=inside[:-1]
+    keep[:-1]|=inside[1:]
+    idx=numpy.nonzero(keep)[0]
+    runs=numpy.split(idx,numpy.nonzero(numpy.diff(idx)>1)[0]+1)
+    return [seg[run].astype(float) for run in runs if len(run)>1]
+
+def coast_segments(region):
+    '''
+    Coastline segments [(lon,lat),...] over region (lonmin,lonmax,latmin,
+    latmax), clipped in numpy from the one global shoreline file (see
+    build_coast); no subprocess once that exists.  Without it and without
+    GMT there are no segments.
+    '''
+    coast=load_coast()
+    if coast is None:
+        return []
+    (lonmin,lonmax,latmin,latmax)=region
+    bbox=coast['bbox']
+    hit=numpy.nonzero((bbox[:,0]<=lonmax)&(bbox[:,1]>=lonmin)&(bbox[:,2]<=latmax)&(bbox[:,3]>=latmin))[0]
+    segments=[]
+    for k in hit:
+        segments+=clip_segment(coast['xy'][coast['starts'][k]:coast['starts'][k+1]],region)
+    return segments
+
+def draw_lines(rgb,segments,x,y,color=(0,0,0)):
+    '''
+    Draw lon/lat polylines on the image rgb whose pixel centres are x
+    (columns) and y (rows, either order), sampling each edge at half a pixel.
+    '''
+    (ny,nx)=rgb.shape[:2]
+    dx=(x[-1]-x[0])/(nx-1)
+    dy=(y[-1]-y[0])/(ny-1)
+    for seg in segments:
+        c=(seg[:,0]-x[0])/dx
+        r=(seg[:,1]-y[0])/dy
+        n=numpy.maximum(numpy.ceil(2*numpy.hypot(numpy.diff(c),numpy.diff(r))).astype(int),1)
+        t=numpy.concatenate([numpy.arange(k)/float(k) for k in n]+[[0.]])
+        i=numpy.concatenate([numpy.repeat(numpy.arange(len(n)),n),[len(n)]])
+        i1=numpy.minimum(i+1,len(c)-1)
+        cc=numpy.round(c[i]+t*(c[i1]-c[i])).astype(int)
+        rr=numpy.round(r[i]+t*(r[i1]-r[i])).astype(int)
+        ok=(cc>=0)&(cc<nx)&(rr>=0)&(rr<ny)
+        rgb[rr[ok],cc[ok]]=color
+
+def render_png(pngfn,grid,cptfn,coast=True,maxdim=1200,barheight=16,zrange=None):
+    '''
+    Render grid (a Grid) as pngfn: every step-th node so the longer side is
+    at most maxdim pixels, north up, coloured through cptfn, with optional
+    coastlines and a colour bar along the bottom.  zrange (zmin,zmax)
+    stretches the CPT onto that range, 'data' onto the 2-98th percentiles
+    of the rendered nodes; None keeps the CPT's own.
+    '''
+    step=max(1,int(numpy.ceil(max(grid.shape)/float(maxdim))))
+    z=grid.sample(step)
+    x=grid.x[::step]
+    y=grid.y[::step]
+    if y[0]<y[-1]:
+        z=z[::-1]
+        y=y[::-1]
+    cpt=read_cpt(cptfn)
+    if zrange=='data':
+        zrange=data_range(z)
+    if zrange is not None:
+        cpt=scale_cpt(cpt,zrange[0],zrange[1])
+    rgb=colorize(z,cpt)
+    if coast and len(x)>1 and len(y)>1:
+        draw_lines(rgb,coast_segments((x.min(),x.max(),y.min(),y.max())),x,y)
+    if barheight:
+        bar=numpy.linspace(cpt['z0'][0],cpt['z1'][-1],rgb.shape[1])
+        rgb=numpy.concatenate((rgb,numpy.zeros((2,rgb.shape[1],3),dtype=numpy.uint8)+255,
+                               numpy.repeat(colorize(bar[numpy.newaxis,:],cpt),barheight,axis=0)))
+    write_png(pngfn,rgb)
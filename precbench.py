@@ -0,0 +1,101 @@
+#!/usr/bin/python
+'''
+PROGRAM:
+    precbench.py
+
+PURPOSE:
+    Time and compare tropmap's single and double working precision.
+
+DESCRIPTION:
+    A synthetic case (random stations with smooth hydrostatic and wet
+    residual fields over a sea-level working grid, and a rough DEM) is run
+    through the interpolation operators and the block-wise topographic
+    scaling of every product, once per precision.  For each stage the time,
+    the bytes of the arrays it produces and the largest and RMS difference
+    of the single-precision result from the double one (in micrometres, or
+    micrometres of water for pwv) are printed.
+
+USAGE:
+    precbench.py [-stations n] [-grid n] [-dem n] [-block n] [-seed n]
+'''
+
+import sys, time, argparse, numpy
+from precision import *
+from interpfunctions import *
+from topofunctions import *
+
+def synthetic(nstn,ngrid,ndem,seed):
+    rng=numpy.random.RandomState(seed)
+    region=(-121.,-116.,32.,36.)
+    stnlon=rng.uniform(region[0],region[1],nstn)
+    stnlat=rng.uniform(region[2],region[3],nstn)
+    resH=0.002*numpy.sin(stnlon)*numpy.cos(stnlat)+0.0005*rng.randn(nstn)
+    resW=0.03*numpy.cos(2*stnlon)*numpy.sin(stnlat)+0.005*rng.randn(nstn)
+    wlon=numpy.linspace(region[0],region[1],ngrid+1)
+    wlat=numpy.linspace(region[2],region[3],ngrid+1)
+    dx=numpy.linspace(-120.5,-116.5,ndem)
+    dy=numpy.linspace(35.5,32.5,ndem)
+    (gx,gy)=numpy.meshgrid(dx,dy)
+    h=(1500+1200*numpy.sin(3*gx)*numpy.cos(5*gy)+100*rng.randn(ndem,ndem)).astype(numpy.float32)
+    return (stnlon,stnlat,resH,resW,(wlon,wlat),Grid(dx,dy,h))
+
+def run(precision,case,block):
+    (stnlon,stnlat,resH,resW,grid,dem)=case
+    (wlon,wlat)=grid
+    set_precision(precision)
+    stages={}
+    for mode in ('triang','IDW'):
+        t0=time.time()
+        W=interp_operator(mode,stnlon,stnlat,wlon,wlat)
+        t1=time.time()
+        diffs=apply_operator(W,numpy.column_stack((resH,resW)))
+        stages[mode]=(time.time()-t1,diffs)
+    # sea-level combos: a weather-like background plus the triang residuals
+    (gx,gy)=numpy.meshgrid(wlon,wlat)
+    diffs=stages['triang'][1]
+    comboH=(2.3+0.01*numpy.cos(gy)).astype(work_dtype())+diffs[:,0].reshape(gx.shape)
+    comboW=(0.15+0.05*numpy.sin(gx)).astype(work_dtype())+diffs[:,1].reshape(gx.shape)
+    tsl=(295.-0.5*(gy-32)).astype(work_dtype())
+    (ix,tx)=axis_weights(wlon,dem.x)
+    (iy,ty)=axis_weights(wlat,dem.y)
+    out=[numpy.empty(dem.shape,dtype=work_dtype()) for p in PRODUCTS]
+    t0=time.time()
+    for i0 in range(0,dem.shape[0],block):
+        i1=min(i0+block,dem.shape[0])
+        H=sample_rows(comboH,iy[i0:i1],ty[i0:i1],ix,tx)
+        W=sample_rows(comboW,iy[i0:i1],ty[i0:i1],ix,tx)
+        h=dem.rows(i0,i1)
+        T=sample_rows(tsl,iy[i0:i1],ty[i0:i1],ix,tx)-LAPSE*h
+        layers=block_products(PRODUCTS,H,W,numpy.exp(-h/7400.),numpy.exp(-h/3000.),T)
+        for (o,layer) in zip(out,layers):
+            o[i0:i1]=layer
+    stages['topo']=(time.time()-t0,numpy.array(out))
+    return stages
+
+def precbench():
+    parser=argparse.ArgumentParser(description='Compare single and double working precision.')
+    parser.add_argument('-stations',metavar='n',type=int,help='number of stations',default=400)
+    parser.add_argument('-grid',metavar='n',type=int,help='intervals per axis of the working grid',default=400)
+    parser.add_argument('-dem',metavar='n',type=int,help='DEM nodes per axis',default=2000)
+    parser.add_argument('-block',metavar='n',type=int,help='DEM rows per block',default=256)
+    parser.add_argument('-seed',metavar='n',type=int,help='random seed',default=1)
+    clargs=vars(parser.parse_args())
+    case=synthetic(clargs['stations'],clargs['grid'],clargs['dem'],clargs['seed'])
+    double=run('double',case,clargs['block'])
+    single=run('single',case,clargs['block'])
+    print '%-8s %-6s %9s %9s %12s %12s' % ('stage','layer','sec(64)','sec(32)','MB(64/32)','max/rms(um)')
+    for (stage,names) in (('triang',('H','W')),('IDW',('H','W')),('topo',PRODUCTS)):
+        (t64,z64)=double[stage]
+        (t32,z32)=single[stage]
+        mb='%.1f/%.1f' % (z64.nbytes/1e6,z32.nbytes/1e6)
+        for (k,name) in enumerate(names):
+            if stage=='topo':
+                (a,b)=(z64[k],z32[k])
+            else:
+                (a,b)=(z64[:,k],z32[:,k])
+            d=(b.astype(numpy.float64)-a)[numpy.isfinite(a)]
+            print '%-8s %-6s %9.3f %9.3f %12s %7.3f/%7.3f' % (stage,name,t64,t32,mb,1e6*abs(d).max(),1e6*numpy.sqrt(numpy.mean(d**2)))
+    sys.exit(0)
+
+if __name__ == "__main__":
+    precbench()
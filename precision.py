@@ -0,0 +1,21 @@
+import numpy
+
+# Working precision of the gridded values: interpolated grids, resampled
+# and height-scaled blocks, and the arrays between them.  Single precision
+# (the default) halves memory and bandwidth and is far finer than the
+# delays warrant; grid files are float32 either way.  Coordinates, station
+# values and the kriging and variogram solves always stay double.
+
+PRECISIONS={'single':numpy.float32,'double':numpy.float64}
+
+_dtype=[numpy.float32]
+
+def set_precision(precision):
+    '''
+    Select 'single' or 'double' working precision for this process (and
+    the workers it forks).
+    '''
+    _dtype[0]=PRECISIONS[precision]
+
+def work_dtype():
+    return _dtype[0]
@@ -0,0 +1,180 @@
+import os, numpy
+from grdfunctions import *
+try:
+    from osgeo import gdal, osr
+except ImportError:
+    gdal=None
+
+# Output formats besides GMT netCDF, for consumers that want to map or
+# range-read the product with no conversion:
+#   raw    little-endian float32, north up, bands interleaved by line, with
+#          a ROI_PAC-style .rsc (X_FIRST/Y_FIRST are the outer corner of
+#          the first pixel, as in GeoTIFF)
+#   gtiff  tiled GeoTIFF with overviews laid out ahead of the data
+#          (cloud-optimized); needs the GDAL python bindings
+# Writers share GrdWriter's interface, so topo_ztd streams into any of them.
+
+FORMATS=('grd','raw','gtiff')
+EXTENSIONS={'grd':'.grd','raw':'.raw','gtiff':'.tif'}
+
+def node_steps(x,y):
+    return ((x[-1]-x[0])/(len(x)-1),(y[-1]-y[0])/(len(y)-1))
+
+def write_rsc(rscfn,x,y,names=('z',)):
+    '''
+    ROI_PAC resource file for a north-up raster with nodes x, y.
+    '''
+    (dx,dy)=node_steps(x,y)
+    dy=-abs(dy)
+    keys=[('WIDTH',len(x)),('FILE_LENGTH',len(y)),
+          ('X_FIRST','%.12f' % (x[0]-dx/2)),('Y_FIRST','%.12f' % (max(y[0],y[-1])-dy/2)),
+          ('X_STEP','%.12f' % dx),('Y_STEP','%.12f' % dy),
+          ('X_UNIT','degrees'),('Y_UNIT','degrees'),
+          ('Z_OFFSET',0),('Z_SCALE',1),('PROJECTION','LATLON'),
+          ('DATA_TYPE','FLOAT32'),('BYTE_ORDER','LITTLE_ENDIAN')]
+    if len(names)>1:
+        keys+=[('NUMBER_BANDS',len(names)),('BANDS',','.join(names))]
+    out=open(rscfn,'w')
+    for (key,value) in keys:
+        out.write('%-40s %s\n' % (key,value))
+    out.close()
+
+def read_rsc(rscfn):
+    rsc={}
+    for line in open(rscfn):
+        fields=line.split()
+        if len(fields)>=2:
+            rsc[fields[0]]=fields[1]
+    return rsc
+
+class RawWriter:
+    '''
+    GrdWriter-compatible writer of raw little-endian float32 with a .rsc.
+    The file is memory-mapped, so row blocks and bands may arrive in any
+    order.  chunk and complevel do not apply.
+    '''
+    def __init__(self,fn,x,y,title='',chunk=None,complevel=0,names=('z',)):
+        x=numpy.asarray(x,dtype=float)
+        y=numpy.asarray(y,dtype=float)
+        self.flip=y[0]<y[-1]
+        self.fn=fn
+        self.ny=len(y)
+        self.names=list(names)
+        self.out=numpy.memmap(fn,dtype='<f4',mode='w+',shape=(len(y),len(names),len(x)))
+        write_rsc(''.join([fn,'.rsc']),x,y,names)
+
+    def write_rows(self,i0,block,name='z'):
+        i1=i0+block.shape[0]
+        band=self.names.index(name)
+        if self.flip:
+            self.out[self.ny-i1:self.ny-i0,band,:]=block[::-1]
+        else:
+            self.out[i0:i1,band,:]=block
+
+    def close(self):
+        self.out.flush()
+        del self.out
+
+class TiffWriter:
+    '''
+    GrdWriter-compatible writer of a cloud-optimized GeoTIFF, one band per
+    name.  Blocks go to a tiled scratch GeoTIFF (chunk sets the tile size,
+    complevel the deflate level); close builds the overviews and copies it
+    to fn with the overviews ahead of the full-resolution tiles.
+    '''
+    def __init__(self,fn,x,y,title='',chunk=None,complevel=0,names=('z',)):
+        if gdal is None:
+            raise ImportError('GeoTIFF output needs the GDAL python bindings (osgeo)')
+        x=numpy.asarray(x,dtype=float)
+        y=numpy.asarray(y,dtype=float)
+        self.flip=y[0]<y[-1]
+        self.fn=fn
+        self.tmpfn='.'.join([fn,str(os.getpid()),'tif'])
+        (self.nx,self.ny)=(len(x),len(y))
+        self.names=list(names)
+        if chunk is None:
+            chunk=(256,256)
+        # GeoTIFF tiles are multiples of 16
+        self.tile=[max(16,int(n)//16*16) for n in chunk]
+        self.creation=['TILED=YES','BLOCKXSIZE=%d' % self.tile[0],'BLOCKYSIZE=%d' % self.tile[1],'BIGTIFF=IF_SAFER']
+        if complevel:
+            self.creation+=['COMPRESS=DEFLATE','ZLEVEL=%d' % complevel,'PREDICTOR=3']
+        ds=gdal.GetDriverByName('GTiff').Create(self.tmpfn,self.nx,self.ny,len(names),gdal.GDT_Float32,self.creation)
+        (dx,dy)=node_steps(x,y)
+        ds.SetGeoTransform((x[0]-dx/2,dx,0,max(y[0],y[-1])+abs(dy)/2,0,-abs(dy)))
+        srs=osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        ds.SetProjection(srs.ExportToWkt())
+        ds.SetMetadataItem('TIFFTAG_IMAGEDESCRIPTION',title)
+        for (k,name) in enumerate(names):
+            band=ds.GetRasterBand(k+1)
+            band.SetDescription(name)
+            band.SetNoDataValue(float('nan'))
+        self.ds=ds
+
+    def write_rows(self,i0,block,name='z'):
+        block=numpy.asarray(block,dtype=numpy.float32)
+        i1=i0+block.shape[0]
+        band=self.ds.GetRasterBand(self.names.index(name)+1)
+        if self.flip:
+            band.WriteArray(block[::-1],0,self.ny-i1)
+        else:
+            band.WriteArray(block,0,i0)
+
+    def close(self):
+        levels=[]
+        level=2
+        while max(self.nx,self.ny)>level*min(self.tile):
+            levels.append(level)
+            level*=2
+        if levels:
+            self.ds.BuildOverviews('AVERAGE',levels)
+        out=gdal.GetDriverByName('GTiff').CreateCopy(self.fn,self.ds,0,self.creation+['COPY_SRC_OVERVIEWS=YES'])
+        out=None
+        self.ds=None
+        os.remove(self.tmpfn)
+
+WRITERS={'grd':GrdWriter,'raw':RawWriter,'gtiff':TiffWriter}
+
+class TiffRows:
+#   row-indexable view of a GDAL band, read window by window
+    def __init__(self,band):
+        self.band=band
+        self.shape=(band.YSize,band.XSize)
+
+    def __getitem__(self,key):
+        if not isinstance(key,tuple):
+            key=(key,slice(None))
+        (y0,y1,ystep)=key[0].indices(self.shape[0])
+        (x0,x1,xstep)=key[1].indices(self.shape[1])
+        return self.band.ReadAsArray(x0,y0,x1-x0,y1-y0)[::ystep,::xstep]
+
+def open_raster(fn,name='z'):
+    '''
+    Open a product written in any of FORMATS as a Grid of node coordinates
+    and band name (z or a product variable), read on demand.
+    '''
+    rscfn=''.join([fn,'.rsc'])
+    if os.path.exists(rscfn):
+        rsc=read_rsc(rscfn)
+        (nx,ny)=(int(rsc['WIDTH']),int(rsc['FILE_LENGTH']))
+        names=rsc.get('BANDS','z').split(',')
+        (dx,dy)=(float(rsc['X_STEP']),float(rsc['Y_STEP']))
+        x=float(rsc['X_FIRST'])+dx*(numpy.arange(nx)+0.5)
+        y=float(rsc['Y_FIRST'])+dy*(numpy.arange(ny)+0.5)
+        z=numpy.memmap(fn,dtype='<f4',mode='r',shape=(ny,len(names),nx))[:,names.index(name),:]
+        return Grid(x,y,z)
+    if fn.endswith('.tif') or fn.endswith('.tiff'):
+        if gdal is None:
+            raise ImportError('reading GeoTIFF needs the GDAL python bindings (osgeo)')
+        ds=gdal.Open(fn)
+        names=[ds.GetRasterBand(k+1).GetDescription() for k in range(ds.RasterCount)]
+        (x0,dx,rx,y0,ry,dy)=ds.GetGeoTransform()
+        x=x0+dx*(numpy.arange(ds.RasterXSize)+0.5)
+        y=y0+dy*(numpy.arange(ds.RasterYSize)+0.5)
+        band=ds.GetRasterBand(names.index(name)+1 if name in names else 1)
+        grid=Grid(x,y,TiffRows(band))
+        # the band is only valid while its dataset is referenced
+        grid.ds=ds
+        return grid
+    return open_grd(fn,name)
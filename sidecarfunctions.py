@@ -0,0 +1,99 @@
+import os, sys, time, socket, json, numpy
+from statfunctions import *
+from demfunctions import read_isce_xml, isce_band
+
+# JSON sidecar written next to every correction (<correction>.json): node
+# geometry, how the values are stored (format, dtype, byte order and, for
+# raw files, the array shape and offset), statistics and provenance.  A
+# consumer can memory-map a raw correction from the sidecar alone, and as
+# it is named after its correction, runs sharing a directory do not
+# clobber each other's (unlike the old fixed tropwrap.pck).  A correction
+# in radar geometry (format rdr, an ISCE float32 image with its .xml) has
+# no node coordinates; its geometry is just its length and width.
+
+SIDECAR_VERSION=1
+PROVENANCE_KEYS=('gps','Wx','interp','coords','precision','resolution','ISCE_DEM',
+                 'lonmin','lonmax','latmin','latmax','grid_max','tiles')
+
+def sidecar_name(fn):
+    return ''.join([fn,'.json'])
+
+def provenance(clargs,keys=(),**extra):
+    '''
+    Where a correction came from: program, command line, time and host,
+    the clargs entries in PROVENANCE_KEYS and keys, and any extra items.
+    '''
+    p={'program':os.path.basename(sys.argv[0]),
+       'command':' '.join(sys.argv),
+       'created':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime()),
+       'host':socket.gethostname()}
+    for key in PROVENANCE_KEYS+tuple(keys):
+        if key in clargs:
+            p[key]=clargs[key]
+    p.update(extra)
+    return p
+
+def storage_layout(fn,fmt):
+#   how the values of fn (written by one of WRITERS) lie in the file
+    layout={'format':fmt,'dtype':'float32'}
+    if fmt=='rdr':
+        prop=read_isce_xml(''.join([fn,'.xml']))
+        layout.update({'byte_order':'little','offset':0,'interleave':'line','band':0,
+                       'shape':[int(prop['length']),int(prop.get('number_bands',1)),int(prop['width'])]})
+    elif fmt=='raw':
+        rsc=read_rsc(''.join([fn,'.rsc']))
+        bands=rsc.get('BANDS','z').split(',')
+        layout.update({'byte_order':'little','offset':0,'interleave':'line','bands':bands,
+                       'shape':[int(rsc['FILE_LENGTH']),len(bands),int(rsc['WIDTH'])]})
+    elif fmt=='grd':
+        layout.update({'byte_order':None,'variable':'z'})
+    else:
+        layout.update({'byte_order':None,'band':1})
+    return layout
+
+def jsonable(value):
+#   numpy scalars as plain numbers, NaN and inf as null
+    if isinstance(value,dict):
+        return dict((k,jsonable(v)) for (k,v) in value.items())
+    if isinstance(value,(list,tuple)):
+        return [jsonable(v) for v in value]
+    if isinstance(value,(float,numpy.floating)):
+        if not numpy.isfinite(value):
+            return None
+        return float(value)
+    if isinstance(value,numpy.integer):
+        return int(value)
+    return value
+
+def write_sidecar(fn,fmt,stats=None,prov=None):
+    '''
+    Write the sidecar of correction fn in format fmt (one of FORMATS, or
+    rdr).  stats is a GridStats of its values (gathered while writing, see
+    topo_ztd); without it the file is read once with grid_stats.
+    '''
+    if fmt=='rdr':
+        band=isce_band(fn)
+        if stats is None:
+            stats=grid_stats(band)
+        geometry={'kind':'radar','length':band.shape[0],'width':band.shape[1]}
+    else:
+        if stats is None:
+            stats=grid_stats(fn)
+        geometry=grid_geometry(fn)
+        geometry['kind']='geographic'
+        geometry['row_order']='north_first' if geometry.pop('north_up') else 'south_first'
+    sidecar={'version':SIDECAR_VERSION,
+             'file':os.path.basename(fn),
+             'units':'m',
+             'geometry':geometry,
+             'layout':storage_layout(fn,fmt),
+             'statistics':stats.summary(),
+             'provenance':prov or {}}
+    out=open(sidecar_name(fn),'w')
+    json.dump(jsonable(sidecar),out,indent=1,sort_keys=True)
+    out.write('\n')
+    out.close()
+    return sidecar_name(fn)
+
+def read_sidecar(fn):
+    return json.load(open(sidecar_name(fn)))
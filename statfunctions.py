@@ -0,0 +1,133 @@
+import numpy
+from rasterfunctions import *
+
+# One-pass statistics of grids too large to read twice.  Blocks of rows are
+# folded into a running count, mean and sum of squared deviations (the
+# pairwise update of Chan et al., in double), extrema and a count of NaN,
+# and a fixed-size uniform sample of the values gives approximate
+# percentiles.  Geometry comes from the file's own node coordinates, so
+# nothing is parsed from grdinfo text.
+
+class GridStats:
+    '''
+    Running statistics of the values passed to add().  NaN and inf are
+    counted in nan and left out of everything else.  Percentiles come from
+    a uniform sample of at most sample values (the values with the smallest
+    of one random key each, so the sample does not depend on how the values
+    were blocked); they are exact while count<=sample.  sample=0 keeps none.
+    '''
+    def __init__(self,sample=65536,seed=0):
+        self.count=0
+        self.nan=0
+        self.mean=0.
+        self.m2=0.
+        self.min=numpy.inf
+        self.max=-numpy.inf
+        self.sample=sample
+        self.rng=numpy.random.RandomState(seed)
+        self.keys=numpy.zeros(0)
+        self.values=numpy.zeros(0)
+
+    def add(self,block):
+        block=numpy.asarray(block).ravel()
+        v=block[numpy.isfinite(block)].astype(numpy.float64)
+        self.nan+=block.size-v.size
+        if v.size==0:
+            return
+        n=v.size
+        mean=v.mean()
+        total=self.count+n
+        delta=mean-self.mean
+        self.m2+=((v-mean)**2).sum()+delta*delta*self.count*n/total
+        self.mean+=delta*n/total
+        self.count=total
+        self.min=min(self.min,v.min())
+        self.max=max(self.max,v.max())
+        if self.sample:
+            keys=self.rng.random_sample(n)
+            if len(self.keys)==self.sample:
+                # only keys below the current cut can enter the sample
+                keep=keys<self.keys.max()
+                (keys,v)=(keys[keep],v[keep])
+            keys=numpy.concatenate((self.keys,keys))
+            v=numpy.concatenate((self.values,v))
+            if len(keys)>self.sample:
+                keep=numpy.argpartition(keys,self.sample)[:self.sample]
+                (keys,v)=(keys[keep],v[keep])
+            (self.keys,self.values)=(keys,v)
+
+    def std(self):
+        if self.count==0:
+            return numpy.nan
+        return numpy.sqrt(self.m2/self.count)
+
+    def percentile(self,q):
+        if len(self.values)==0:
+            return numpy.nan
+        return numpy.percentile(self.values,q)
+
+    def shift(self,offset):
+        '''
+        Make these the statistics of the same values less offset (e.g. once
+        their mean is removed): the spread is unchanged.
+        '''
+        if self.count:
+            self.mean-=offset
+            self.min-=offset
+            self.max-=offset
+        self.values=self.values-offset
+
+    def summary(self,percentiles=(5,50,95)):
+        '''
+        The statistics as a dict: count, nan, mean, std, min, max and p<q>
+        for each q in percentiles.
+        '''
+        s={'count':self.count,'nan':self.nan,'mean':self.mean,'std':self.std(),'min':self.min,'max':self.max}
+        if self.count==0:
+            s['mean']=s['min']=s['max']=numpy.nan
+        for q in percentiles:
+            s['p%g' % q]=self.percentile(q)
+        return s
+
+def grid_stats(src,block=256,name='z',sample=65536):
+    '''
+    GridStats of src, a file in any of FORMATS (band name), a Grid or an
+    array, read block rows at a time.
+    '''
+    grid=src
+    if isinstance(src,basestring):
+        grid=open_raster(src,name)
+    if isinstance(grid,Grid):
+        (rows,ny)=(grid.rows,grid.shape[0])
+    else:
+        z=numpy.asarray(src)
+        if z.ndim<2:
+            z=z.reshape(1,-1)
+        (rows,ny)=(lambda i0,i1: z[i0:i1],z.shape[0])
+    stats=GridStats(sample)
+    try:
+        for i0 in range(0,ny,block):
+            stats.add(rows(i0,min(i0+block,ny)))
+    finally:
+        if grid is not src:
+            grid.close()
+    return stats
+
+def grid_geometry(src,name='z'):
+    '''
+    Node geometry of src (a file in any of FORMATS, or a Grid) as a dict of
+    x_min, x_max, x_inc, nx, y_min, y_max, y_inc, ny, in the sense grdinfo
+    reports a gridline-registered grid, and north_up (first row northmost).
+    '''
+    grid=src
+    if isinstance(src,basestring):
+        grid=open_raster(src,name)
+    (x,y)=(grid.x,grid.y)
+    if grid is not src:
+        grid.close()
+    geometry={'x_min':x.min(),'x_max':x.max(),'nx':len(x),
+              'y_min':y.min(),'y_max':y.max(),'ny':len(y),
+              'north_up':bool(y[0]>y[-1])}
+    geometry['x_inc']=(geometry['x_max']-geometry['x_min'])/max(len(x)-1,1)
+    geometry['y_inc']=(geometry['y_max']-geometry['y_min'])/max(len(y)-1,1)
+    return geometry
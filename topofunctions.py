@@ -0,0 +1,248 @@
+import os, hashlib, numpy
+from grdfunctions import *
+from precision import work_dtype
+from wxfunctions import kappa
+from statfunctions import GridStats
+
+# Map the sea-level combination delays onto the DEM: ZTD at every DEM node
+# is H*exp(-h/Hscale)+W*exp(-h/Wscale), with H, W bilinear from the coarse
+# sea-level grids.  Everything is done in blocks of DEM rows.  The two
+# scale factor grids depend only on the DEM and can be cached on disk.
+# Besides the total delay, the hydrostatic and wet parts and precipitable
+# water (wet delay times kappa of the surface temperature) can be written
+# as bands of the same output.
+
+PRODUCTS=('ztd','zhd','zwd','pwv')
+LAPSE=0.0065
+
+def product_var(product):
+#   netCDF variable of a product band: the total delay stays GMT's default z
+    if product=='ztd':
+        return 'z'
+    return product
+
+def block_products(products,H,W,eH,eW,T=None):
+    '''
+    Layers of products for one block from sea-level combos H, W, scale
+    factors eH, eW and (for pwv) surface temperature T in K.  All delays
+    are in m, pwv is in m of water.
+    '''
+    zhd=H*eH
+    zwd=W*eW
+    layers=[]
+    for product in products:
+        if product=='ztd':
+            layers.append(zhd+zwd)
+        elif product=='zhd':
+            layers.append(zhd)
+        elif product=='zwd':
+            layers.append(zwd)
+        elif product=='pwv':
+            layers.append(zwd*kappa(T,0,0))
+        else:
+            raise ValueError(' '.join(['unknown product',product]))
+    return layers
+
+def axis_weights(xin,x):
+    '''
+    Indices i and fractions t such that values at x are (1-t)*v[i]+t*v[i+1]
+    for values v on the ascending nodes xin.  t is NaN outside xin, and in
+    the working precision so the blocks it weights stay there.
+    '''
+    xin=numpy.asarray(xin,dtype=float)
+    x=numpy.asarray(x,dtype=float)
+    i=numpy.clip(numpy.searchsorted(xin,x,side='right')-1,0,len(xin)-2)
+    t=(x-xin[i])/(xin[i+1]-xin[i])
+    eps=1e-9
+    t[(t<-eps)|(t>1+eps)]=numpy.nan
+    return (i,t.astype(work_dtype()))
+
+def sample_rows(z,iy,ty,ix,tx):
+    '''
+    Separable bilinear sample of z[y,x] at the rows (iy,ty) and columns
+    (ix,tx) from axis_weights.
+    '''
+    zy=(1-ty)[:,numpy.newaxis]*z[iy]+ty[:,numpy.newaxis]*z[iy+1]
+    return (1-tx)*zy[:,ix]+tx*zy[:,ix+1]
+
+def factor_key(dem,Hscale,Wscale,sources):
+    '''
+    Key of the scale factors of dem: the path, size and mtime of each of
+    the files it was made from (sources: an ISCE DEM, or SRTM tiles), its
+    nodes (region and resolution) and the scale heights.  No DEM values
+    are read.
+    '''
+    h=hashlib.sha1()
+    for fn in sorted(sources):
+        st=os.stat(fn)
+        h.update(repr((os.path.realpath(fn),st.st_size,st.st_mtime)))
+    h.update(numpy.round(dem.x,9).tostring())
+    h.update(numpy.round(dem.y,9).tostring())
+    h.update(repr((float(Hscale),float(Wscale))))
+    return h.hexdigest()
+
+def scale_factors(dem,Hscale,Wscale,cachedir,sources,block=256):
+    '''
+    exp(-h/Hscale) and exp(-h/Wscale) on the nodes of dem as a memory-mapped
+    float32 (2,ny,nx) array.  They are computed once per DEM source files,
+    node set and scale heights (factor_key) and kept in cachedir as
+    topo.<key>.npy; later calls do not read the DEM.
+    '''
+    fn=os.path.join(cachedir,'.'.join(['topo',factor_key(dem,Hscale,Wscale,sources),'npy']))
+    def build(tmpfn):
+        f=numpy.lib.format.open_memmap(tmpfn,mode='w+',dtype=numpy.float32,shape=(2,)+dem.shape)
+        for i0 in range(0,dem.shape[0],block):
+            i1=min(i0+block,dem.shape[0])
+            h=dem.rows(i0,i1)
+            f[0,i0:i1]=numpy.exp(-h/Hscale)
+            f[1,i0:i1]=numpy.exp(-h/Wscale)
+        f.flush()
+    if not os.path.exists(fn):
+        write_atomic(fn,build)
+    return numpy.load(fn,mmap_mode='r')
+
+def topo_blocks(grid,fields,dem,Hscale,Wscale,block=256,factors=None,heights=False,first=None):
+    '''
+    Yield (i0,i1,sampled,eH,eW,h) for successive blocks of block DEM rows
+    (the first of first rows, if given): the sea-level fields on grid
+    (lon,lat) resampled to the DEM nodes, the scale factors (from factors
+    when given) and the DEM heights, which are only read (else None) when
+    heights is set or there are no factors.
+    '''
+    (wlon,wlat)=grid
+    (ix,tx)=axis_weights(wlon,dem.x)
+    (iy,ty)=axis_weights(wlat,dem.y)
+    ny=dem.shape[0]
+    starts=range(0,ny,block)
+    if first:
+        starts=[0]+range(first,ny,block)
+    for (i0,i1) in zip(starts,starts[1:]+[ny]):
+        sampled=[sample_rows(z,iy[i0:i1],ty[i0:i1],ix,tx) for z in fields]
+        h=None
+        if factors is None or heights:
+            h=dem.rows(i0,i1)
+        if factors is None:
+            (eH,eW)=(numpy.exp(-h/Hscale),numpy.exp(-h/Wscale))
+        else:
+            (eH,eW)=(factors[0,i0:i1],factors[1,i0:i1])
+        yield (i0,i1,sampled,eH,eW,h)
+
+def topo_ztd(fn,grid,comboH,comboW,dem,Hscale,Wscale,block=256,title='',factors=None,chunk=None,complevel=0,products=('ztd',),tsl=None,writer=GrdWriter,offset=0.,stats=None):
+    '''
+    Write ZTD on the nodes of dem (a Grid) as a GMT grid fn, from the
+    sea-level hydrostatic and wet combinations comboH, comboW on grid
+    (lon,lat).  DEM rows are read, scaled and written block rows at a time,
+    so no full-resolution intermediate is held or written.  With factors
+    from scale_factors the DEM is not read at all.  chunk and complevel
+    are passed to GrdWriter; blocks then follow the chunk rows, also when
+    the writer flips the rows (the first block takes the remainder of ny
+    by the chunk rows, so no block straddles two chunks).  products
+    selects the bands written (see product_var); pwv needs the sea-level
+    temperature tsl on grid, brought to the DEM height with LAPSE.  writer
+    is GrdWriter or another class with its interface (rasterfunctions).
+    offset is subtracted from ztd (see topo_mean).  A GridStats stats is
+    fed the ztd written.
+    '''
+    if chunk is not None:
+        block=max(1,block//chunk[1])*chunk[1]
+    fields=[comboH,comboW]
+    if 'pwv' in products:
+        fields.append(tsl)
+    out=writer(fn,dem.x,dem.y,title,chunk,complevel,[product_var(p) for p in products])
+    first=None
+    if chunk is not None and getattr(out,'flip',False):
+        # file rows ny-i1:ny-i0 are on chunk boundaries once ny-i1 is
+        first=dem.shape[0]%chunk[1]
+    try:
+        for (i0,i1,sampled,eH,eW,h) in topo_blocks(grid,fields,dem,Hscale,Wscale,block,factors,'pwv' in products,first):
+            T=None
+            if 'pwv' in products:
+                T=sampled[2]-LAPSE*h
+            for (product,layer) in zip(products,block_products(products,sampled[0],sampled[1],eH,eW,T)):
+                if product=='ztd' and offset:
+                    layer=layer-offset
+                if product=='ztd' and stats is not None:
+                    stats.add(layer)
+                out.write_rows(i0,layer,product_var(product))
+    finally:
+        out.close()
+
+def topo_mean(grid,comboH,comboW,dem,Hscale,Wscale,block=256,factors=None):
+    '''
+    Mean ZTD over the DEM nodes where it is defined, accumulated block by
+    block in double (GridStats) without writing anything; topo_ztd can then
+    remove it as its offset.
+    '''
+    stats=GridStats(sample=0)
+    for (i0,i1,(H,W),eH,eW,h) in topo_blocks(grid,[comboH,comboW],dem,Hscale,Wscale,block,factors):
+        stats.add(H*eH+W*eW)
+    if stats.count==0:
+        return 0.
+    return stats.mean
+
+def sample_points(z,iy,ty,ix,tx):
+    '''
+    Bilinear sample of z[y,x] at scattered points with per-point row
+    (iy,ty) and column (ix,tx) weights from axis_weights.
+    '''
+    return ((1-ty)*((1-tx)*z[iy,ix]+tx*z[iy,ix+1])+
+            ty*((1-tx)*z[iy+1,ix]+tx*z[iy+1,ix+1]))
+
+def rdr_blocks(grid,fields,lat,lon,hgt,Hscale,Wscale,block=256,factors=None):
+    '''
+    Yield (i0,i1,sampled,eH,eW,h) for successive blocks of block radar
+    lines, as topo_blocks does for DEM rows: the fields on grid (lon,lat)
+    sampled at the pixels' lat and lon, the scale factors and the heights.
+    '''
+    (wlon,wlat)=grid
+    for i0 in range(0,lat.shape[0],block):
+        i1=min(i0+block,lat.shape[0])
+        (iy,ty)=axis_weights(wlat,lat[i0:i1].ravel())
+        (ix,tx)=axis_weights(wlon,lon[i0:i1].ravel())
+        sampled=[sample_points(z,iy,ty,ix,tx).reshape(i1-i0,-1) for z in fields]
+        h=numpy.asarray(hgt[i0:i1],dtype=work_dtype())
+        if factors is None:
+            (eH,eW)=(numpy.exp(-h/Hscale),numpy.exp(-h/Wscale))
+        else:
+            (eH,eW)=(factors[0,i0:i1],factors[1,i0:i1])
+        yield (i0,i1,sampled,eH,eW,h)
+
+def rdr_mean(grid,comboH,comboW,lat,lon,hgt,Hscale,Wscale,block=256,factors=None):
+    '''
+    Mean ZTD over the radar pixels where it is defined (see topo_mean), for
+    rdr_ztd to remove as its offset.
+    '''
+    stats=GridStats(sample=0)
+    for (i0,i1,(H,W),eH,eW,h) in rdr_blocks(grid,[comboH,comboW],lat,lon,hgt,Hscale,Wscale,block,factors):
+        stats.add(H*eH+W*eW)
+    if stats.count==0:
+        return 0.
+    return stats.mean
+
+def rdr_ztd(fn,grid,comboH,comboW,lat,lon,hgt,Hscale,Wscale,block=256,factors=None,products=('ztd',),tsl=None,offset=0.,stats=None):
+    '''
+    Write ZTD in radar geometry as little-endian float32 fn, one value per
+    pixel of the (length,width) lat, lon and height rasters (e.g. memory-
+    mapped lat.rdr, lon.rdr, z.rdr), streaming block rows at a time.
+    factors, from scale_factors on hgt, replace the exponentials.  Several
+    products are written band interleaved by line, in the order given.
+    offset and stats are as for topo_ztd.
+    '''
+    fields=[comboH,comboW]
+    if 'pwv' in products:
+        fields.append(tsl)
+    out=open(fn,'wb')
+    try:
+        for (i0,i1,sampled,eH,eW,h) in rdr_blocks(grid,fields,lat,lon,hgt,Hscale,Wscale,block,factors):
+            T=None
+            if 'pwv' in products:
+                T=sampled[2]-LAPSE*h
+            layers=block_products(products,sampled[0],sampled[1],eH,eW,T)
+            for (k,product) in enumerate(products):
+                if product=='ztd' and offset:
+                    layers[k]=layers[k]-offset
+                if product=='ztd' and stats is not None:
+                    stats.add(layers[k])
+            out.write(numpy.array(layers,dtype='<f4').transpose(1,0,2).tostring())
+    finally:
+        out.close()
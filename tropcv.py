@@ -0,0 +1,240 @@
+#!/usr/bin/python
+################################################################################
+# PROGRAM: tropcv.py
+################################################################################
+'''
+PROGRAM:
+    tropcv.py
+
+PURPOSE:
+    Leave-one-out cross-validation of the tropmap interpolation modes.
+
+DESCRIPTION:
+    For every epoch in the epoch list the GPS and weather delays are
+    gathered exactly as tropmap.py does, and the GPS-minus-weather
+    residuals at the stations are stacked into a (station x epoch)
+    matrix for the stations present at every epoch.  Each interpolation
+    mode then predicts every station from all the others with a single
+    sparse leave-one-out operator (no per-station refits), applied to all
+    epochs at once.  RMS prediction errors of the hydrostatic and wet
+    residuals are reported per mode with the time taken.
+
+USAGE:
+    tropcv.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -epochs <file> -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] [-modes triang,IDW,krige] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-grid_max n] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-local_xml_dir <dir>] [-pre_downloaded <dir>] [-verbose on|off]
+
+OPTIONS:
+    -latmin latmin
+        minimum latitude
+
+    -latmax latmax
+        maximum latitude
+
+    -lonmin lonmin
+        minimum longitude
+
+    -lonmax lonmax
+        maximum longitude
+
+    -epochs <file>
+        text file with one epoch per line: YYYY-MM-DD HH MM
+
+    -gps [gipsy|gamit]
+        which GPS estimates
+
+    -Wx [namanl,rucanl,gfsanl,off]
+        choose weather model, or none
+
+    -modes triang,IDW,krige (optional)
+        comma separated interpolation modes to validate.  Default = all
+
+    -coords [servlet|xml|llh]
+        choose method for getting site coordinates.  Default = xml
+
+    -llh_dir [dir] [optional]
+        location of NominalPosition.List.llh file if using -coords llh
+
+    -workdir dir  (optional)
+        set a directory to save in and attempt to read input files from
+        (default is to work under /tmp and then delete)
+
+    -grid_max n  (optional)
+        cap on the intervals per axis of the sea-level working grid on
+        which the weather model is sampled.  Default = 400
+
+    -local_gipsy_dir dir (optional)
+        local directory (above yearly directories) for gipsy .trop files
+
+    -local_gamit_dir dir (optional)
+        local directory (above regional/ and global/) for gamit ofiles
+
+    -local_xml_dir dir (optional)
+        local directory for xml file
+
+    -pre_downloaded dir (optional)
+        GPS and weather data has already been downloaded to this dir
+        with the tropmap.py -download_only flag
+
+    -verbose on (optional)
+        see diagnostic output
+
+EXAMPLE:
+    tropcv.py -latmin 32 -latmax 36 -lonmin -121 -lonmax -116 -epochs epochs.txt -gps gipsy -Wx namanl -modes triang,IDW,krige
+
+COPYRIGHT:
+    Copyright 2011, by the California Institute of Technology. ALL RIGHTS
+RESERVED. United States Government Sponsorship acknowledged. Any commercial use
+must be negotiated with the Office of Technology Transfer at the California
+Institute of Technology.
+
+EXPORT CLASIFICATION:
+    This software is subject to U.S. export control laws and regulations and
+has been classified as EAR99.  By accepting this software, the user agrees to
+comply with all applicable U.S. export laws and regulations.  User has the
+responsibility to obtain export licenses, or other export authority as may be
+required before exporting such information to foreign countries or providing
+access to foreign persons."
+
+AUTHORS:
+    Jet Propulsion Laboratory
+    California Institute of Technology
+    Pasadena, CA, USA
+'''
+
+from tropmap import *
+
+def read_epochs(epochfn):
+    epochs=[]
+    for line in open(epochfn):
+        line=line.split('#')[0].split()
+        if len(line)==0:
+            continue
+        if len(line)!=3:
+            print >>sys.stderr, ' '.join(['bad epoch line in',epochfn,':',' '.join(line)])
+            sys.exit(2)
+        epochs.append(tuple(line))
+    return epochs
+
+def station_residuals(clargs,tmpdir,fout,epochs):
+#   GPS-minus-weather sea-level residuals of the stations seen at every epoch:
+#   returns (sites,lon,lat,resH,resW) with res* shaped (station,epoch)
+    resH={}
+    resW={}
+    coords={}
+    for (date,hour,min) in epochs:
+        clargs['date']=date
+        clargs['hour']=hour
+        clargs['min']=min
+        wx=get_grib(clargs,tmpdir,fout)
+        (gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat)=get_gpstrop(clargs,tmpdir,fout)
+        if len(sites)==0:
+            print >>sys.stderr, ' '.join(['no GPS sites for',date,hour,min,'(skipped)'])
+            continue
+        grid=workgrid(clargs,gpslon,gpslat)
+        wxsl=grid_wx(clargs,wx,grid)
+        (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,grid,wxsl)
+        key=(date,hour,min)
+        resH[key]=dict(zip(sites,stnHdiff))
+        resW[key]=dict(zip(sites,stnWdiff))
+        for (site4,lon,lat) in zip(sites,gpslon,gpslat):
+            coords[site4]=(lon,lat)
+    keys=[e for e in epochs if e in resH]
+    if len(keys)==0:
+        return ([],numpy.zeros(0),numpy.zeros(0),numpy.zeros((0,0)),numpy.zeros((0,0)))
+    common=set(resH[keys[0]])
+    for key in keys[1:]:
+        common&=set(resH[key])
+    sites=sorted(common)
+    lon=numpy.array([coords[s][0] for s in sites])
+    lat=numpy.array([coords[s][1] for s in sites])
+    H=numpy.array([[resH[key][s] for key in keys] for s in sites],dtype=float).reshape(len(sites),len(keys))
+    W=numpy.array([[resW[key][s] for key in keys] for s in sites],dtype=float).reshape(len(sites),len(keys))
+    return (sites,lon,lat,H,W)
+
+def loo_errors(mode,lon,lat,res,**opts):
+    L=loo_operator(mode,lon,lat,**opts)
+    return res-apply_operator(L,res)
+
+def rms(err):
+    good=numpy.isfinite(err)
+    if not good.any():
+        return (numpy.nan,0)
+    return (numpy.sqrt(numpy.mean(err[good]**2)),good.sum())
+
+def tropcv(clargs):
+    tmpdir=setup_tmp(clargs)
+    if clargs['verbose']=='on':
+        fout=os.dup(1)
+    else:
+        fout=open(os.devnull,'w')
+    epochs=read_epochs(clargs['epochs'])
+    (sites,lon,lat,H,W)=station_residuals(clargs,tmpdir,fout,epochs)
+    cleanup(clargs,tmpdir)
+    if len(sites)<4:
+        print >>sys.stderr, ' '.join(['only',str(len(sites)),'stations common to all epochs; nothing to validate'])
+        sys.exit(2)
+    print ' '.join([str(len(sites)),'stations,',str(H.shape[1]),'epochs'])
+    print '%-8s %12s %12s %10s %8s' % ('mode','rmsZHD(mm)','rmsZWD(mm)','predicted','sec')
+    results={}
+    for mode in clargs['modes'].split(','):
+        t0=time.time()
+        if mode=='IDW':
+            errH=loo_errors(mode,lon,lat,H,k=10,dMax=200.)
+            errW=loo_errors(mode,lon,lat,W,k=10,dMax=200.)
+        elif mode=='krige':
+            # one variogram per residual field, pooled over all epochs
+            errH=loo_errors(mode,lon,lat,H,k=16,vario=fit_variogram(lon,lat,H))
+            errW=loo_errors(mode,lon,lat,W,k=16,vario=fit_variogram(lon,lat,W))
+        else:
+            errH=loo_errors(mode,lon,lat,H)
+            errW=loo_errors(mode,lon,lat,W)
+        dt=time.time()-t0
+        (rmsH,n)=rms(errH)
+        (rmsW,n)=rms(errW)
+        print '%-8s %12.2f %12.2f %10d %8.2f' % (mode,1000*rmsH,1000*rmsW,n,dt)
+        results[mode]=(rmsH,rmsW,n,dt)
+    return results
+
+################################################################################
+# FUNCTION: tropcvmain
+################################################################################
+def tropcvmain():
+    '''
+Main program that interprets user-specified arguments and executes the necessary methods.
+    '''
+    parser = argparse.ArgumentParser(description='Leave-one-out cross-validation of trop map interpolation modes.')
+    parser.add_argument('-latmin',metavar='latmin',type=float,help='minimum latitude',required=True)
+    parser.add_argument('-latmax',metavar='latmax',type=float,help='maximum latitude',required=True)
+    parser.add_argument('-lonmin',metavar='lonmin',type=float,help='minimum longitude',required=True)
+    parser.add_argument('-lonmax',metavar='lonmax',type=float,help='maximum longitude',required=True)
+    parser.add_argument('-epochs',metavar='file',type=str,help='file of epochs, one "YYYY-MM-DD HH MM" per line',required=True)
+    parser.add_argument('-gps',metavar='gipsy|gamit',type=str,help='gipsy or gamit gps estimates',required=True,choices=['gipsy','gamit'])
+    parser.add_argument('-Wx',metavar='namanl|narr-a|rucanl|gfsanl|off',type=str,help='choose weather model, or gps only',required=True,choices=['namanl','narr-a','rucanl','gfsanl','off'])
+    parser.add_argument('-modes',metavar='triang,IDW,krige',type=str,help='comma separated interpolation modes to validate',default='triang,IDW,krige')
+    parser.add_argument('-workdir',metavar='dir',type=str,help='directory to save intermediate files in and attempt to read files from (default is to use /tmp and delete)')
+    parser.add_argument('-grid_max',metavar='n',type=int,help='maximum number of intervals per axis of the sea-level working grid',default=400)
+    parser.add_argument('-coords',metavar='servlet|xml|llh',type=str,help='source for site coordinates',default='xml')
+    parser.add_argument('-llh_dir',metavar='dir',type=str,help='Directory containing NominalPosition.List.llh file when using -coords llh')
+    parser.add_argument('-local_gipsy_dir',metavar='dir',type=str,help='directory (above yearly directories) for gipsy .trop.tar files')
+    parser.add_argument('-local_gamit_dir',metavar='dir',type=str,help='directory (above global/ and regional/) for gamit ofiles')
+    parser.add_argument('-local_xml_dir',metavar='dir',type=str,help='directory for xml files')
+    parser.add_argument('-pre_downloaded',metavar='dir',type=str,help='needed input data has been downloaded to this dir with tropmap.py -download_only')
+    parser.add_argument('-verbose',metavar='on',type=str,help='more diagnostic messages',choices=['on'],default='off')
+    args=parser.parse_args()
+    clargs=vars(args)
+    for mode in clargs['modes'].split(','):
+        if mode not in ['triang','IDW','krige']:
+            print >>sys.stderr, ' '.join(['unknown interpolation mode',mode])
+            sys.exit(2)
+    # keys tropmap's gathering functions expect
+    clargs['download_only']=None
+    clargs['cache_dir']=None
+    clargs['interp']=None
+
+    tropcv(clargs)
+    sys.exit(0)
+
+################################################################################
+# Main program if running as stand alone program
+################################################################################
+if __name__ == "__main__":
+    tropcvmain()
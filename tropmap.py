@@ -14,7 +14,7 @@ DESCRIPTION:
     make a trop map.
 
 USAGE:
-    tropmap.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -resolution <xres>/<yres> -date YYYY-MM-DD -hour HH -min MM -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] -interp [triang|IDW] [-output_dir <dir>] [-output_file <file>] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-ISCE_DEM file] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-download_only <dir>] [-pre_downloaded <dir>] [-png on|off] [-verbose on|off]
+    tropmap.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -resolution <xres>/<yres> -date YYYY-MM-DD -hour HH -min MM -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] -interp [triang|IDW|krige] [-output_dir <dir>] [-output_file <file>] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-cache_dir <dir>] [-grid_max n] [-tiles nx/ny] [-nproc n] [-ISCE_DEM file] [-rdr_lat file -rdr_lon file -rdr_hgt file] [-chunk nx/ny] [-complevel n] [-products ztd,zhd,zwd,pwv] [-precision single|double] [-format grd|raw|gtiff] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-download_only <dir>] [-pre_downloaded <dir>] [-png on|off] [-verbose on|off]
 
 OPTIONS:
     -latmin latmin
@@ -47,8 +47,9 @@ OPTIONS:
     -Wx [namanl,rucanl,gfsanl,off]
         choose weather model, or none
 
-    -interp [triang|IDW]
-        choose triangulation or inverse distance weighting
+    -interp [triang|IDW|krige]
+        choose triangulation, inverse distance weighting, or local ordinary
+        kriging (variogram fitted per epoch; suited to dense networks)
 
     -coords [servlet|xml|llh] 
         choose method for getting site coordinates.  Default = servlet
@@ -67,9 +68,67 @@ OPTIONS:
         set a directory to save in and attempt to read input files from
         (default is to work under /tmp and then delete)
 
+    -cache_dir dir  (optional)
+        directory in which interpolation weights (keyed by station set and
+        grid) and the topographic scale factors of the DEM (keyed by DEM,
+        region, resolution and scale heights) are cached between runs
+        (default is workdir, if given)
+
+    -grid_max n  (optional)
+        cap on the intervals per axis of the intermediate sea-level grid,
+        whose spacing otherwise follows the station and weather model
+        spacing.  Default = 400
+
+    -tiles nx/ny  (optional)
+        split the sea-level grid into nx by ny tiles interpolated in
+        parallel worker processes, each from the stations and weather
+        points within a halo around its tile, and stitched into one grid.
+        For continental domains.  Default = 1/1 (no tiling)
+
+    -nproc n  (optional)
+        number of worker processes for -tiles.  Default = all cores
+
     -ISCE_DEM file (optional)
         specify an input DEM file from ISCE.  Output .grd file will match
-        this DEM in range and resolution.
+        this DEM in range and resolution.  The DEM is memory-mapped using
+        the geometry in file.xml; -resolution coarser than the DEM posting
+        decimates it.
+
+    -rdr_lat file -rdr_lon file -rdr_hgt file (optional)
+        ISCE radar-geometry latitude, longitude and height images (e.g.
+        lat.rdr, lon.rdr, z.rdr, each with its .xml).  The correction is
+        then evaluated on the radar grid and written as little-endian
+        float32 with an ISCE .xml, instead of a geographic .grd map; the
+        lat/lon bounds must cover the radar footprint and no DEM is used
+
+    -chunk nx/ny  (optional)
+        write the product as netCDF-4 (classic model) in nx by ny chunks,
+        streamed by row blocks; readers can then fetch windows cheaply.
+        Needs GMT built with netCDF-4 to be read by GMT tools
+
+    -complevel n  (optional)
+        deflate level 1-9 for the product (implies netCDF-4).  Default = 0
+
+    -products ztd,zhd,zwd,pwv  (optional)
+        comma separated layers to write, all computed in one pass over the
+        DEM: total (ztd), hydrostatic (zhd) and wet (zwd) zenith delay and
+        precipitable water vapour (pwv, from zwd and the weather model
+        surface temperature), all in m.  In a .grd ztd is variable z and
+        the others are named variables (file.grd?zwd for GMT); in radar
+        geometry they are bands in the order given.  Default = ztd
+
+    -precision single|double  (optional)
+        working precision of the grids and the arrays between processing
+        stages.  single halves memory and bandwidth and differs from
+        double by less than a micrometre of delay (see precbench.py);
+        files are float32 either way.  Default = single
+
+    -format grd|raw|gtiff  (optional)
+        format of the geographic product: GMT netCDF grid (grd), raw
+        little-endian float32 with a ROI_PAC .rsc (raw, bands interleaved
+        by line), or tiled, cloud-optimized GeoTIFF with overviews (gtiff,
+        needs the GDAL python bindings; -chunk sets the tile size and
+        -complevel the deflate level).  Default = grd
 
     -local_gipsy_dir dir (optional)
         local directory (above yearly directories) for gipsy .trop files
@@ -98,7 +157,7 @@ OPTIONS:
         see diagnostic output 
 
 EXAMPLE:
-    tropmap.py -latmin 30.5 -latmax 34.5 -lonmin -121.5 -lonmax -118.5 -resolution 3600+/2400+ 3600+/2400+ 3600+/2400+ -date 2010-01-01 -hour 06 -min 00 -gps gipsy -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_dir dir] [-output_file file] [-workdir dir] [-ISCE_DEM file] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
+    tropmap.py -latmin 30.5 -latmax 34.5 -lonmin -121.5 -lonmax -118.5 -resolution 3600+/2400+ 3600+/2400+ 3600+/2400+ -date 2010-01-01 -hour 06 -min 00 -gps gipsy -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_dir dir] [-output_file file] [-workdir dir] [-cache_dir dir] [-grid_max n] [-tiles nx/ny] [-nproc n] [-ISCE_DEM file] [-rdr_lat file -rdr_lon file -rdr_hgt file] [-chunk nx/ny] [-complevel n] [-products ztd,zhd,zwd,pwv] [-precision single|double] [-format grd|raw|gtiff] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
 
 COPYRIGHT:
     Copyright 2011, by the California Institute of Technology. ALL RIGHTS 
@@ -128,10 +187,19 @@ Wscale=3000
 
 import os, sys, pydoc, pdb, fnmatch, ftplib, gzip, types,calendar,time
 import argparse, subprocess, numpy, urllib2, math
-import datetime, tarfile, zipfile, tempfile, shutil, re
+import datetime, tarfile, zipfile, tempfile, shutil, re, multiprocessing
 from PyNIO import Nio
 from wxfunctions import *
 from spatialfunc import *
+from grdfunctions import *
+from demfunctions import *
+from interpfunctions import *
+from topofunctions import *
+from pngfunctions import *
+from precision import *
+from rasterfunctions import *
+from statfunctions import *
+from sidecarfunctions import *
 
 __author__ = 'Angelyn Moore'
 __date__    = '$Date: 2011-11-14 16:53:26 -0800 (Mon, 14 Nov 2011) $'[7:-21]
@@ -145,7 +213,7 @@ def usage():
 Generate a usage print statement.
     '''
     print '''
-    tropmap.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -date YYYY-MM-DD -hour HH -min 00 -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_file file] [-output_dir dir] [-workdir dir] [-ISCE_DEM file] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
+    tropmap.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -date YYYY-MM-DD -hour HH -min 00 -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_file file] [-output_dir dir] [-workdir dir] [-cache_dir dir] [-grid_max n] [-tiles nx/ny] [-nproc n] [-ISCE_DEM file] [-rdr_lat file -rdr_lon file -rdr_hgt file] [-chunk nx/ny] [-complevel n] [-products ztd,zhd,zwd,pwv] [-precision single|double] [-format grd|raw|gtiff] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
 '''
     sys.exit(2)
 
@@ -164,6 +232,19 @@ def setup_tmp(clargs):
           print >>sys.stderr, ' '.join(['could not create',clargs['workdir']])
           sys.exit(2)
 
+def cache_dir(clargs):
+#   where reusable products (interpolation weights, topographic scale
+#   factors) are kept across runs
+    if type(clargs['cache_dir']) is not types.NoneType:
+        cdir=clargs['cache_dir']
+    elif type(clargs['workdir']) is not types.NoneType:
+        cdir=clargs['workdir']
+    else:
+        return None
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir)
+    return cdir
+
 def cleanup(clargs,tmpdir):
     if type(clargs['workdir']) is types.NoneType:
       shutil.rmtree(tmpdir)
@@ -237,8 +318,10 @@ def get_grib(clargs,tmpdir,fout):
                     wxbasefn='_'.join([wxFilePrefix[clargs['Wx']],wxGrid[clargs['Wx']],yyyymmdd,hhmm,'000'])
                     url='/'.join(['http://nomads.ncdc.noaa.gov/data/',clargs['Wx'],yyyymm,yyyymmdd,''.join([wxbasefn,'.grb'])])
                     print >>sys.stderr, ''.join(['Trying to create inventory from ',url," (May take a few minutes)"])
-                    if not os.path.exists("/".join([wxdir,clargs['Wx'],yyyymm])):
+                    try:
                         os.mkdir("/".join([wxdir,clargs['Wx'],yyyymm]))
+                    except OSError:
+                        pass
                     response=urllib2.urlopen(url)
                     html=response.read()
                     out=open('/'.join([wxdir,clargs['Wx'],yyyymm,''.join([wxbasefn,'.grb'])]),'w')
@@ -268,9 +351,8 @@ def get_grib(clargs,tmpdir,fout):
                     cleanup(clargs,tmpdir)
                     sys.exit(2)
     
+#   sea-level weather delays at the model points, kept in memory for grid_wx
     if type(clargs['download_only']) is types.NoneType:
-        outHsl=open('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZHDm.sl.xy'])]),'w')
-        outWsl=open('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZWDm.sl.xy'])]),'w')
         if clargs['Wx'] != 'off':
             try:  
                 Wx=Nio.open_file("/".join([wxdir,clargs['Wx'],yyyymm,wxfn]),"r")
@@ -308,35 +390,44 @@ def get_grib(clargs,tmpdir,fout):
                Wxhgt=numpy.ravel(Wx.variables[''.join(['_'.join(['HGT',wxGrid[clargs['Wx']],'SFC']),suffix])])[(Wxlat_all<=latmax) & (Wxlat_all>=latmin) & (Wxlon_all<=lonmax) & (Wxlon_all>=lonmin)]/1000
     
             # now have ht(km) pressure(mbar) pwat(cm)
-            for i in range(len(Wxlat)-1):  
-                Wxzhd=zhdsaasta(Wxpres[i],Wxlat[i],Wxhgt[i]*1000)/100
-                Wxzwd=pw2zwd(Wxpw[i],Wxtemp[i])/100
-                Wxzwdm=movepw(pw2zwd(Wxpw[i],Wxtemp[i]),Wxhgt[i]*1000,0,Wscale)/100
-                Wxzhdm=movepres(zhdsaasta(Wxpres[i],Wxlat[i],Wxhgt[i]*1000),Wxhgt[i],0,Hscale)/100
-                # write out for GMT use
-                outHsl.write(' '.join([str(Wxlon[i]),str(Wxlat[i]),str(Wxzhdm),'\n']))
-                outWsl.write(' '.join([str(Wxlon[i]),str(Wxlat[i]),str(Wxzwdm),'\n']))
+            n=len(Wxlat)-1
+            Wxzhdm=numpy.empty(n)
+            Wxzwdm=numpy.empty(n)
+            for i in range(n):  
+                Wxzwdm[i]=movepw(pw2zwd(Wxpw[i],Wxtemp[i]),Wxhgt[i]*1000,0,Wscale)/100
+                Wxzhdm[i]=movepres(zhdsaasta(Wxpres[i],Wxlat[i],Wxhgt[i]*1000),Wxhgt[i],0,Hscale)/100
+            # surface temperature (K) brought to sea level, for -products pwv
+            Wxtsl=Wxtemp[:n]+LAPSE*Wxhgt[:n]*1000
+            return (Wxlon[:n],Wxlat[:n],Wxzhdm,Wxzwdm,Wxtsl)
         else:
-            # For gps only, force wx = 0
-            Wxzhdm=0.00
-            Wxzwdm=0.00
-            for lati in range(0,10):  
-                for loni in range(0,10):
-                    lat=latmin+lati*(latmax-latmin)/10
-                    lon=lonmin+loni*(lonmax-lonmin)/10
-                    outHsl.write(' '.join([str(lon),str(lat),str(Wxzhdm),'\n']))
-                    outWsl.write(' '.join([str(lon),str(lat),str(Wxzwdm),'\n']))
-        
-        outHsl.close()
-        outWsl.close()
-        endtuple=os.times()
-        end=endtuple[2]+endtuple[3]
-        
-        latgrid=(latmax-latmin)/100
-        longrid=(lonmax-lonmin)/100
-        
-        subprocess.call(['triangulate',''.join(['-R','/'.join([str(clargs['lonmin']-1.0),str(clargs['lonmax']+1.0),str(clargs['latmin']-1.0),str(clargs['latmax']+1.0)])]),''.join(['-I','/'.join([str(longrid),str(latgrid)])]),'-F','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZWDm.sl.xy'])]),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZWDm.sl.grd'])])])],stdout=fout)
-        subprocess.call(['triangulate',''.join(['-R','/'.join([str(clargs['lonmin']-1.0),str(clargs['lonmax']+1.0),str(clargs['latmin']-1.0),str(clargs['latmax']+1.0)])]),''.join(['-I','/'.join([str(longrid),str(latgrid)])]),'-F','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZHDm.sl.xy'])]),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZHDm.sl.grd'])])])],stdout=fout)
+            # For gps only, wx = 0 everywhere (see grid_wx)
+            return None
+
+def grid_wx(clargs,wx,grid):
+#   grid the sea-level weather delays from get_grib onto the working grid
+#   (linear on the Delaunay triangulation, as GMT triangulate did).  The
+#   model points are fixed per model, so the weights are cached.
+    (wlon,wlat)=grid
+    if wx is None:
+        zero=numpy.zeros((len(wlat),len(wlon)),dtype=work_dtype())
+        return (zero,zero.copy())
+    (Wxlon,Wxlat,Wxzhdm,Wxzwdm,Wxtsl)=wx
+    W=interp_operator('triang',Wxlon,Wxlat,wlon,wlat,cachedir=cache_dir(clargs))
+    wxsl=apply_operator(W,numpy.column_stack((Wxzhdm,Wxzwdm)))
+    return (wxsl[:,0].reshape(len(wlat),len(wlon)),wxsl[:,1].reshape(len(wlat),len(wlon)))
+
+def grid_temp(clargs,wx,tmpdir,grid):
+#   sea-level surface temperature on the working grid, for -products pwv,
+#   written to tempT.sl.grd beside the combos (same cached weights as
+#   grid_wx; the standard atmosphere's 288.15 K without a weather model)
+    (wlon,wlat)=grid
+    if wx is None:
+        tsl=numpy.zeros((len(wlat),len(wlon)),dtype=work_dtype())+288.15
+    else:
+        (Wxlon,Wxlat,Wxzhdm,Wxzwdm,Wxtsl)=wx
+        W=interp_operator('triang',Wxlon,Wxlat,wlon,wlat,cachedir=cache_dir(clargs))
+        tsl=apply_operator(W,Wxtsl).reshape(len(wlat),len(wlon))
+    write_grd('/'.join([tmpdir,'tempT.sl.grd']),wlon,wlat,tsl)
 
 def urlget_tdp(url, tdpdir, yyyy, doy):
     password_mgr=urllib2.HTTPPasswordMgrWithDefaultRealm()
@@ -353,11 +444,13 @@ def urlget_tdp(url, tdpdir, yyyy, doy):
         url='/'.join([url,trop_file])
         response=urllib2.urlopen(url)
         html=response.read()
-        if not os.path.exists('/'.join([tdpdir,yyyy])):
-          os.mkdir('/'.join([tdpdir,yyyy]))
         trop_dir='/'.join([tdpdir,yyyy,doy])
-        if not os.path.exists(trop_dir):
-          os.mkdir(trop_dir)
+        # another epoch may be making the same directories
+        for d in ('/'.join([tdpdir,yyyy]),trop_dir):
+          try:
+            os.mkdir(d)
+          except OSError:
+            pass
         trop_path = '/'.join([trop_dir,trop_file])
         out=open(trop_path,'w')
         out.write(html)
@@ -469,6 +562,9 @@ def acquire_gamit(clargs,tmpdir):
     tropfile={}
     try:
         os.mkdir('/'.join([gamdir,yyyy]))
+    except OSError:
+        pass
+    try:
         os.mkdir('/'.join([gamdir,yyyy,doy]))
     except OSError:
         pass
@@ -545,7 +641,93 @@ def acquire_xml(clargs,tmpdir):
         out.close()
         endtuple=os.times()
     
-def get_gpstrop(clargs,tmpdir,fout):
+def acquire_trop(clargs,tmpdir):
+#   GPS troposphere files of the epoch: (troplist,tropfile), troplist
+#   being a list of the sites and tropfile the ofile of each site for gamit
+#   and None for gipsy
+    if clargs['gps']=='gipsy':
+        return (acquire_tdp(clargs,tmpdir),None)
+    elif clargs['gps']=='gamit':
+        (troplist,tropfile)=acquire_gamit(clargs,tmpdir)
+        if type(troplist) is not types.NoneType:
+            # ofile_inventory strings the sites together
+            troplist=troplist.split()
+        return (troplist,tropfile)
+
+def site_coords(clargs,tmpdir,fout,troplist,fetch_xml=True):
+#   (site4,lon,lat,ht) strings of the sites in the bbox + 1 deg, from the
+#   coordinate source -coords (for xml, of the sites in troplist; the
+#   metadata XML is fetched into tmpdir unless fetch_xml is False)
+    sitesInBox=[]
+    if clargs['gps'] == 'gipsy':
+        source='jpl_ats'
+    elif clargs['gps'] == 'gamit':
+        source='sopac_ats'
+    minLonPos=str(clargs['lonmin']-1.0)
+    maxLonPos=str(clargs['lonmax']+1.0)
+    if clargs['coords'] == 'servlet':
+        response=urllib2.urlopen(''.join(['http://geoapp02.ucsd.edu:8080/gpseDB/coord?op=getXYZ&date=',clargs['date'],'&minLat=',str(clargs['latmin']-1.0),'&maxLat=',str(clargs['latmax']+1.0),'&minLon=',minLonPos,'&maxLon=',maxLonPos,'&source=',source]))
+        sitesInBox=response.read().split("\n")
+        # remove empty last line
+        sitesInBox=sitesInBox[:-1]
+        # remove header lines
+        sitesInBox=sitesInBox[2:]
+    elif clargs['coords'] == 'xml':
+        if fetch_xml:
+            acquire_xml(clargs,tmpdir)
+        tropliststr=' '.join(troplist)    
+
+        sitesInBox=subprocess.Popen(['xmlpos.oneday.pl','--date1',clargs['date'],'--lat1',str(clargs['latmin']-1.0),'--lat2',str(clargs['latmax']+1.0),'--lon1',minLonPos,'--lon2',maxLonPos,'-d',tmpdir,'-i','/'.join([tmpdir,'globalProcMetadataInput.xml']),'-s',tropliststr],stdout=subprocess.PIPE,stderr=fout).communicate()[0]
+        sitesInBox=sitesInBox.split("\n")
+        # remove empty last line
+        sitesInBox=sitesInBox[:-1]
+    else:
+        llh=open('/'.join([clargs['llh_dir'],'NominalPosition.List.llh']),'r')
+        for line in llh:
+            [site4,lat,lon,ht]=line.split(' ')
+            if (float(lat)>=clargs['latmin']-1.0) & (float(lat)<=clargs['latmax']+1.0) & (float(lon)>=clargs['lonmin']-1.0) & (float(lon)<=clargs['lonmax']+1.0): 
+                sitesInBox.append(line)
+        llh.close()
+
+    coords=[]
+    for line in sitesInBox:
+        if clargs['coords'] == 'servlet':
+            [site4,sitenm,decyr,x,y,z,xs,ys,zs,lat,lon,ht,lats,lons,hts,blank]=line.split(';')
+        elif clargs['coords'] == 'xml':
+            [site4,lon,lat,ht]=line.split(' ')
+            lon=str(float(lon)-360)
+        else:
+            [site4,lat,lon,ht]=line.split(' ')
+        coords.append((site4.upper(),lon,lat,ht))
+    return coords
+
+def epochs_site_coords(epochs,tmpdir,fout):
+#   site_coords shared by several epochs [(clargs,troplist),...]: looked up
+#   at the earliest date, then again at each later date for the sites of
+#   its epochs still without coordinates (stations installed since), and
+#   merged.  The llh list and the metadata XML do not depend on the date
+#   and are read and fetched once.
+    coords=[]
+    known=set()
+    dates=set()
+    fetched=False
+    for (clargs,troplist) in sorted(epochs,key=lambda e: (e[0]['date'],e[0]['hour'],e[0]['min'])):
+        missing=sorted(set(troplist)-known)
+        if len(missing)==0 or clargs['date'] in dates or (dates and clargs['coords']=='llh'):
+            continue
+        dates.add(clargs['date'])
+        if clargs['coords']=='xml' and not fetched:
+            acquire_xml(clargs,tmpdir)
+            fetched=True
+        for (site4,lon,lat,ht) in site_coords(clargs,tmpdir,fout,missing,fetch_xml=False):
+            if site4 not in known:
+                known.add(site4)
+                coords.append((site4,lon,lat,ht))
+    return coords
+
+def get_gpstrop(clargs,tmpdir,fout,trop=None,coords=None):
+#   GPS sea-level delays of the epoch.  trop (from acquire_trop) and coords
+#   (from site_coords) may be passed in when they are shared between epochs.
 
     yymmdd=clargs['date'][2:].replace('-','')
     ll={}
@@ -554,17 +736,15 @@ def get_gpstrop(clargs,tmpdir,fout):
     wetztrop={}
     gpszhd_sl=[]
     gpszwd_sl=[]
-    sitesInBox=[]
     lonlat=[]
     gpslon=[]
     gpslat=[]
     sites=[]
     # get tdp files in yymmdd subdir 
      
-    if clargs['gps']=='gipsy':
-        troplist=acquire_tdp(clargs,tmpdir)
-    elif clargs['gps']=='gamit':
-        (troplist,tropfile)=acquire_gamit(clargs,tmpdir)
+    if trop is None:
+        trop=acquire_trop(clargs,tmpdir)
+    (troplist,tropfile)=trop
     if type(clargs['download_only']) is not types.NoneType:
         return(None,None,None,None,None,None)
        
@@ -577,47 +757,10 @@ def get_gpstrop(clargs,tmpdir,fout):
         tdpHout=open('/'.join([tmpdir,'gpsH.sl.xy']),'w')
         tdpWout=open('/'.join([tmpdir,'gpsW.sl.xy']),'w')
     
-        
-        if clargs['gps'] == 'gipsy':
-            source='jpl_ats'
-        elif clargs['gps'] == 'gamit':
-            source='sopac_ats'
-        minLonPos=str(clargs['lonmin']-1.0)
-        maxLonPos=str(clargs['lonmax']+1.0)
-        if clargs['coords'] == 'servlet':
-            response=urllib2.urlopen(''.join(['http://geoapp02.ucsd.edu:8080/gpseDB/coord?op=getXYZ&date=',clargs['date'],'&minLat=',str(clargs['latmin']-1.0),'&maxLat=',str(clargs['latmax']+1.0),'&minLon=',minLonPos,'&maxLon=',maxLonPos,'&source=',source]))
-            sitesInBox=response.read().split("\n")
-            # remove empty last line
-            sitesInBox=sitesInBox[:-1]
-            # remove header lines
-            sitesInBox=sitesInBox[2:]
-        elif clargs['coords'] == 'xml':
-            acquire_xml(clargs,tmpdir)
-            tropliststr=' '.join(troplist)    
-
-            sitesInBox=subprocess.Popen(['xmlpos.oneday.pl','--date1',clargs['date'],'--lat1',str(clargs['latmin']-1.0),'--lat2',str(clargs['latmax']+1.0),'--lon1',minLonPos,'--lon2',maxLonPos,'-d',tmpdir,'-i','/'.join([tmpdir,'globalProcMetadataInput.xml']),'-s',tropliststr],stdout=subprocess.PIPE,stderr=fout).communicate()[0]
-            sitesInBox=sitesInBox.split("\n")
-            # remove empty last line
-            sitesInBox=sitesInBox[:-1]
-        else:
-            llh=open('/'.join([clargs['llh_dir'],'NominalPosition.List.llh']),'r')
-            for line in llh:
-                [site4,lat,lon,ht]=line.split(' ')
-                if (float(lat)>=clargs['latmin']-1.0) & (float(lat)<=clargs['latmax']+1.0) & (float(lon)>=clargs['lonmin']-1.0) & (float(lon)<=clargs['lonmax']+1.0): 
-                    sitesInBox.append(line)
-            llh.close()
-
+        if coords is None:
+            coords=site_coords(clargs,tmpdir,fout,troplist)
             
-        for line in sitesInBox:
-            if clargs['coords'] == 'servlet':
-                [site4,sitenm,decyr,x,y,z,xs,ys,zs,lat,lon,ht,lats,lons,hts,blank]=line.split(';')
-            elif clargs['coords'] == 'xml':
-                [site4,lon,lat,ht]=line.split(' ')
-                lon=str(float(lon)-360)
-            else:
-                [site4,lat,lon,ht]=line.split(' ')
-
-            site4=site4.upper()
+        for (site4,lon,lat,ht) in coords:
             if site4 in troplist:
                 try:
                     if clargs['gps']=='gipsy':
@@ -633,8 +776,8 @@ def get_gpstrop(clargs,tmpdir,fout):
                     gpszwd_sl.append(movepw(float(wetztrop[site4]),h[site4],0,Wscale))
                     sites.append(site4)
                     lonlat.append(ll[site4])
-                    gpslon.append(ll[site4].split()[0])
-                    gpslat.append(ll[site4].split()[1])
+                    gpslon.append(float(ll[site4].split()[0]))
+                    gpslat.append(float(ll[site4].split()[1]))
                     tdpHout.write(' '.join([ll[site4],str(dryztrop_sl),'\n']))
                     tdpWout.write(' '.join([ll[site4],str(wetztrop_sl),'\n']))
                 except KeyError:
@@ -716,24 +859,45 @@ def read_tdp(clargs,site4,tmpdir,yymmdd,sec):
     tdp.close()     
     return (dryztrop[site4],wetztrop[site4])
 
-def get_dem(clargs,tmpdir,fout):
+def dem_dir(clargs,tmpdir):
     if type(clargs['pre_downloaded']) is not types.NoneType:
-        demdir=clargs['pre_downloaded']
+        return clargs['pre_downloaded']
     elif type(clargs['download_only']) is not types.NoneType:
-        demdir=clargs['download_only']
-    else:
-        demdir=tmpdir
+        return clargs['download_only']
+    return tmpdir
+
+def srtm_tiles(clargs):
+#   (lat,lon,file name) of the 1 degree SRTM tiles over the bbox
+    tiles=[]
+    for lat in range(int(math.floor(clargs['latmin'])),int(math.ceil(clargs['latmax']))):
+        for lon in range(int(math.floor(clargs['lonmin'])),int(math.ceil(clargs['lonmax']))):
+            # expects positive W lat
+            tiles.append((lat,lon,''.join(['N',str(lat),'W',str(lon)[1:],'.hgt.zip'])))
+    return tiles
+
+def dem_sources(clargs,tmpdir):
+#   the files the map DEM is made from, which key its cached scale factors
+    if type(clargs['ISCE_DEM']) is not types.NoneType:
+        return [clargs['ISCE_DEM']]
+    if os.path.exists('DEM-mapres.grd'):
+        return ['DEM-mapres.grd']
+    demdir=dem_dir(clargs,tmpdir)
+    return [fn for fn in ['/'.join([demdir,'DEMfiles',t[2]]) for t in srtm_tiles(clargs)] if os.path.exists(fn)]
+
+def get_dem(clargs,tmpdir,fout):
+    demdir=dem_dir(clargs,tmpdir)
 
     try:
         os.mkdir('/'.join([demdir,'DEMfiles']))
     except OSError:
         pass
     if type(clargs['ISCE_DEM']) is not types.NoneType:
-       print "%s" % ' '.join(['xyz2grd',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I',clargs['resolution']]),'-Zh',clargs['ISCE_DEM'],'-N-10000',''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM-mapres.grd'])])])
-       try: 
-           subprocess.Popen(['xyz2grd',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I',clargs['resolution']]),'-Zh',clargs['ISCE_DEM'],'-N-10000',''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM-mapres.grd'])])])
-       except:
-           print >>sys.stderr, ' '.join(['could not run xyz2grd on',clargs['ISCE_DEM']])
+       # memory-map the ISCE DEM in place; gototopo reads the window directly
+       try:
+           dem=IsceDem(clargs['ISCE_DEM'])
+           return dem.window((clargs['lonmin'],clargs['lonmax'],clargs['latmin'],clargs['latmax']),clargs['resolution'])
+       except (IOError,KeyError,ValueError):
+           print >>sys.stderr, ' '.join(['could not map ISCE DEM',clargs['ISCE_DEM']])
            cleanup(clargs,tmpdir)
            sys.exit(2)
 
@@ -771,240 +935,375 @@ def get_dem(clargs,tmpdir,fout):
                 print >>sys.stderr, "Error: Range specified is not contained within an SRTM DEM region"
                 sys.exit(2)
         
-            if type(clargs['download_only']) is not types.NoneType:
-                try:
-                    os.mkdir('/'.join([demdir,'DEMfiles']))
-                except OSError:
-                    pass
-            else:
-                blend=open('/'.join([demdir,'DEMfiles','blend.job']),'w')
-            for lat in range (minintlat,maxintlat):
-                for lon in range (minintlon,maxintlon):
-                    # expects positive W lat
-                    fn=''.join(['N',str(lat),'W',str(lon)[1:],'.hgt.zip'])
-                    bn=fn[:-4]
-                    gn='.'.join([bn,'grd'])
-                    if not os.path.exists('/'.join([demdir,'DEMfiles',gn])):
+            tiles={}
+            for (lat,lon,fn) in srtm_tiles(clargs):
+                if not os.path.exists('/'.join([demdir,'DEMfiles',fn])):
     #                    print >>sys.stderr, "Getting DEM"
     #                    url='/'.join(['http://dds.cr.usgs.gov/srtm/version2_1/SRTM3','North_America',fn])
-                        url='/'.join(['http://dds.cr.usgs.gov/srtm/version2_1/SRTM1',region,fn])
-                        try:
-                            response=urllib2.urlopen(url)
-                        except urllib2.HTTPError:
-                            continue
-                        html=response.read()
-                        out=open('/'.join([demdir,'DEMfiles',fn]),'w')
-                        out.write(html)
-                        out.close()
-                   
-                        # unzip
-                        DEM=zipfile.ZipFile('/'.join([demdir,'DEMfiles',fn]))
-                        DEM.extractall('/'.join([demdir,'DEMfiles']))
-                        DEM.close()
-                       
-                        # gdal_translate to .grd
-                        subprocess.call(['gdal_translate','-of','GMT','/'.join([demdir,'DEMfiles',bn]),'/'.join([demdir,'DEMfiles',gn])],stdout=fout)
-    
-                    if type(clargs['download_only']) is types.NoneType:
-                        blend.write(' '.join(['/'.join([demdir,'DEMfiles',gn]),''.join(['-R','/'.join([str(lon),str(lon+1),str(lat),str(lat+1)])]),'1','\n']))
+                    url='/'.join(['http://dds.cr.usgs.gov/srtm/version2_1/SRTM1',region,fn])
+                    try:
+                        response=urllib2.urlopen(url)
+                    except urllib2.HTTPError:
+                        continue
+                    html=response.read()
+                    out=open('/'.join([demdir,'DEMfiles',fn]),'w')
+                    out.write(html)
+                    out.close()
+                tiles[(lat,lon)]='/'.join([demdir,'DEMfiles',fn])
     
             if type(clargs['download_only']) is types.NoneType:
-                blend.close()
-                # Check how this resolution is specified. Should be in arcsec?
-                blendjob=subprocess.call(['grdblend',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I','/'.join(['0.000277778','0.000277778'])]),'/'.join([tmpdir,'DEMfiles/blend.job']),''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM1.grd'])])],stdout=fout)
-    #            print "%s" % ' '.join(['grdblend',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I','/'.join(['0.000833333','0.000833333'])]),'/'.join([tmpdir,'DEMfiles/blend.job']),''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM1.grd'])])])
-    #            blendjob=subprocess.call(['grdblend',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I','/'.join(['3c','3c'])]),'/'.join([tmpdir,'DEMfiles/blend.job']),''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM1.grd'])])],stdout=fout)
-                subprocess.call(['grdmath','/'.join([tmpdir,'DEMfiles','DEM1.grd']),'-100','GT','0','NAN','=','/'.join([tmpdir,'DEMfiles','DEMmask.grd'])],stdout=fout)
-                subprocess.call(['grdmath','/'.join([tmpdir,'DEMfiles','DEM1.grd']),'/'.join([tmpdir,'DEMfiles','DEMmask.grd']),'MUL','=','/'.join([tmpdir,'DEMfiles','DEM.grd'])],stdout=fout)
+                # tiles are inflated in memory straight into the 1 arcsec mosaic
+                try:
+                    srtm_mosaic(tiles,(clargs['lonmin'],clargs['lonmax'],clargs['latmin'],clargs['latmax']),'/'.join([tmpdir,'DEMfiles','DEM.grd']))
+                except BadZipfile:
+                    print >>sys.stderr, "Error: could not read SRTM tiles"
+                    cleanup(clargs,tmpdir)
+                    sys.exit(2)
                 subprocess.call(['grdsample','/'.join([tmpdir,'DEMfiles','DEM.grd']),''.join(['-G','/'.join([tmpdir,'DEMfiles','DEM-mapres.grd'])]),''.join(['-I',str(clargs['resolution'])])])
              
-def gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir):
-    (yyyymmdd,hhmm)=findwxhr(clargs['date'],clargs['hour'])
-#    wx=netcdf('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZWDm.sl.grd'])]),"r")
-    wx=Nio.open_file('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZWDm.sl.grd'])]),"r",format='netcdf')
-    Wx100W=wx.variables['z'][::1].copy()
-    wx.close()
-#    wx=netcdf('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZHDm.sl.grd'])]),"r")
-    wx=Nio.open_file('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'WxZHDm.sl.grd'])]),"r",format='netcdf')
-    Wx100H=wx.variables['z'][::1].copy()
-    wx.close()
-
-    # Find the 100x100 grid point of each GPS station
-
-    lonDiff=(clargs['lonmax']-clargs['lonmin']+2*1.0)*numpy.ones((numpy.size(sites)))
-    latDiff=(clargs['latmax']-clargs['latmin']+2*1.0)*numpy.ones((numpy.size(sites)))
-    ind1=numpy.empty(numpy.size(sites),dtype=int)
-    ind2=numpy.empty(numpy.size(sites),dtype=int)
-    ((numpy.array(gpslon,dtype=float)-clargs['lonmin']+1.0)/lonDiff*(99)).round(out=ind1)
-    ((numpy.array(gpslat,dtype=float)-clargs['latmin']+1.0)/latDiff*(99)).round(out=ind2)
-    linInd=numpy.empty(numpy.size(gpslon))
-    linInd=ind1+ind2*numpy.shape(Wx100H)[0]
-
-    Wx100W_flat=Wx100W.flatten()[linInd]
-    Wx100H_flat=Wx100H.flatten()[linInd]
+def gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,grid,wxsl):
+    (Wx100H,Wx100W)=wxsl
+
+    # Sample the gridded weather at each GPS station (bilinear)
+    (wlon,wlat)=grid
+    (idx,w)=bilinear_weights(wlon,wlat,gpslon,gpslat)
+    Wx100H_flat=apply_weights(idx,w,Wx100H.ravel())
+    Wx100W_flat=apply_weights(idx,w,Wx100W.ravel())
    
-    stnHdiff=(gpszhd_sl-Wx100H_flat)
-    stnWdiff=(gpszwd_sl-Wx100W_flat)
+    stnHdiff=(numpy.asarray(gpszhd_sl)-Wx100H_flat)
+    stnWdiff=(numpy.asarray(gpszwd_sl)-Wx100W_flat)
 
     return(stnHdiff,stnWdiff,Wx100H,Wx100W)
 
-def triang(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,fout):
-    (wxdate,wxhr)=findwxhr(clargs['date'],clargs['hour'])
-    yyyymmdd=clargs['date'].replace('-','')
-    hhmm=''.join([clargs['hour'],clargs['min']])
-    (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir)
-    outHsl=open('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZHD.sl.xy'])]),'w')
-    outWsl=open('/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZWD.sl.xy'])]),'w')
-    for i in range(len(stnWdiff)):
-        [lonGPS,latGPS]=ll[i].split()
-        outHsl.write(' '.join([lonGPS,latGPS,str(stnHdiff[i]),'\n']))
-        outWsl.write(' '.join([lonGPS,latGPS,str(stnWdiff[i]),'\n']))
-    outHsl.close()
-    outWsl.close()
-
-    #triangulate diffs 
-    latgrid=(clargs['latmax']-clargs['latmin']+2*1.0)/100
-    longrid=(clargs['lonmax']-clargs['lonmin']+2*1.0)/100
-    subprocess.call(['triangulate',''.join(['-R','/'.join([str(clargs['lonmin']-1.0),str(clargs['lonmax']+1.0),str(clargs['latmin']-1.0),str(clargs['latmax']+1.0)])]),''.join(['-I','/'.join([str(longrid),str(latgrid)])]),'-F','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZHD.sl.xy'])]),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZHD.sl.grd'])])])],stdout=fout)
-    subprocess.call(['triangulate',''.join(['-R','/'.join([str(clargs['lonmin']-1.0),str(clargs['lonmax']+1.0),str(clargs['latmin']-1.0),str(clargs['latmax']+1.0)])]),''.join(['-I','/'.join([str(longrid),str(latgrid)])]),'-F','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZWD.sl.xy'])]),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZWD.sl.grd'])])])],stdout=fout)
-
-    # add diff surfaces to WxZHDm.sl.grd, WxZWDm.sl.grd
-
-    subprocess.call(['grdmath','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZHD.sl.grd'])]),'/'.join([tmpdir,'.'.join([wxdate,wxhr,'WxZHDm.sl.grd'])]),'ADD','=','/'.join([tmpdir,'comboH.sl.grd'])],stdout=fout)
-    subprocess.call(['grdmath','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'gpsZWD.sl.grd'])]),'/'.join([tmpdir,'.'.join([wxdate,wxhr,'WxZWDm.sl.grd'])]),'ADD','=','/'.join([tmpdir,'comboW.sl.grd'])],stdout=fout)
-
-
-def IDW(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,fout):
-    (wxdate,wxhr)=findwxhr(clargs['date'],clargs['hour'])
-    yyyymmdd=clargs['date'].replace('-','')
-    hhmm=''.join([clargs['hour'],clargs['min']])
-    dMax=200
-    dist=numpy.zeros(shape=(101,101,len(ll)))
-    f=numpy.zeros(shape=(101,101,len(ll)))
-    gpszhd_idw=numpy.zeros(shape=(101,101))
-    gpszwd_idw=numpy.zeros(shape=(101,101))
-
-    (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir)
-
-    for lati in range(0,100):
-      lat=clargs['latmin']-1.0+lati*(clargs['latmax']-clargs['latmin']+2*1.0)/100
-      for loni in range(0,100):
-        lon=clargs['lonmin']-1.0+loni*(clargs['lonmax']-clargs['lonmin']+2*1.0)/100
-        for i in range(len(ll)):
-          [lonGPS,latGPS]=ll[i].split()
-          dist[lati][loni][i]=latlondist(latGPS,lat,lonGPS,lon)
-          if (dist[lati][loni][i]<dMax):
-            f[lati,loni,i]=1/dist[lati][loni][i]**2
-#            f[lati,loni,i]=1/dist[lati][loni][i]
-          else:
-            f[lati,loni,i]=0.
-    
-    outH=open('/'.join([tmpdir,'comboH.txt']),'w')
-    outW=open('/'.join([tmpdir,'comboW.txt']),'w')
-    diffH=open('/'.join([tmpdir,'diffH.txt']),'w')
-    diffW=open('/'.join([tmpdir,'diffW.txt']),'w')
-    for lati in range(0,100):
-      lat=clargs['latmin']-1.0+lati*(clargs['latmax']-clargs['latmin']+2*1.0)/100
-      for loni in range(0,100):
-        lon=clargs['lonmin']-1.0+loni*(clargs['lonmax']-clargs['lonmin']+2*1.0)/100
-        dcopy=list(dist[lati,loni,:])
-        dcopy.sort()
-        nmax=dcopy[9]
-    
-        f[lati,loni,numpy.nonzero(dist[lati,loni,:]>nmax)]=0.
-        fsum=0
-        for i in range(len(ll)):
-          #if (d[lati,loni,i]<nmax):
-            #f[lati,loni,i]=0.
-            if (f[lati,loni,i]!=0.):
-              try:
-                gpszhd_idw[lati,loni]+=f[lati,loni,i]*float(stnHdiff[i])
-                gpszwd_idw[lati,loni]+=f[lati,loni,i]*float(stnWdiff[i])
-                fsum+=f[lati][loni][i]
-              except KeyError:
-                pass
-        diffH.write(' '.join([str(lon),str(lat),str(gpszhd_idw[lati][loni]),'\n']))
-        diffW.write(' '.join([str(lon),str(lat),str(gpszwd_idw[lati][loni]),'\n']))
-        gpszhd_idw[lati][loni]=gpszhd_idw[lati][loni]/fsum
-        gpszwd_idw[lati][loni]=gpszwd_idw[lati][loni]/fsum
-    
-
-        #add Wx to difference surface
-        zhd_idw_sl=gpszhd_idw[lati][loni]+Wx100H[lati][loni]
-        zwd_idw_sl=gpszwd_idw[lati][loni]+Wx100W[lati][loni]
-
-        outH.write(' '.join([str(lon),str(lat),str(zhd_idw_sl),'\n']))
-        outW.write(' '.join([str(lon),str(lat),str(zwd_idw_sl),'\n']))
-    outH.close()
-    outW.close()
-    diffH.close()
-    diffW.close()
+def workgrid(clargs,gpslon,gpslat):
+#   nodes of the sea-level working grid over bbox +/- 1 deg.  The spacing
+#   is half the finer of the median station spacing and the weather model
+#   spacing, with between 10 and grid_max intervals per axis.
+    wxSpacing={'namanl':12.,'narr-a':32.,'rucanl':20.,'gfsanl':111.}
+    lonmin=clargs['lonmin']-1.0
+    lonmax=clargs['lonmax']+1.0
+    latmin=clargs['latmin']-1.0
+    latmax=clargs['latmax']+1.0
+    spacing=[]
+    if len(gpslon)>1:
+        (idx,d)=knn(gpslon,gpslat,gpslon,gpslat,2)
+        d=d[:,1][d[:,1]>0]
+        if len(d):
+            spacing.append(numpy.median(d))
+    if clargs['Wx'] in wxSpacing:
+        spacing.append(wxSpacing[clargs['Wx']])
+    if spacing:
+        cell=0.5*min(spacing)/111.195
+        nlat=int(numpy.clip(numpy.ceil((latmax-latmin)/cell),10,clargs['grid_max']))
+        nlon=int(numpy.clip(numpy.ceil((lonmax-lonmin)*math.cos(math.radians(0.5*(latmin+latmax)))/cell),10,clargs['grid_max']))
+    else:
+        nlat=nlon=min(100,clargs['grid_max'])
+    lon=lonmin+numpy.arange(nlon+1)*(lonmax-lonmin)/nlon
+    lat=latmin+numpy.arange(nlat+1)*(latmax-latmin)/nlat
+    return (lon,lat)
 
-#   grd
-    subprocess.call(['xyz2grd',''.join(['-R','/'.join([tmpdir,'.'.join([wxdate,wxhr,'WxZHDm.sl.grd'])])]),'-F','/'.join([tmpdir,'comboH.txt']),''.join(['-G','/'.join([tmpdir,'comboH.sl.grd'])])],stdout=fout)
-    subprocess.call(['xyz2grd',''.join(['-R','/'.join([tmpdir,'.'.join([wxdate,wxhr,'WxZWDm.sl.grd'])])]),'-F','/'.join([tmpdir,'comboW.txt']),''.join(['-G','/'.join([tmpdir,'comboW.sl.grd'])])],stdout=fout)
+def triang(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout):
+    (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,grid,wxsl)
 
+    #triangulate diffs: one triangulation and one set of barycentric
+    #weights serve both ZHD and ZWD
+    (wlon,wlat)=grid
+    W=interp_operator('triang',gpslon,gpslat,wlon,wlat,cachedir=cache_dir(clargs))
+    diffs=apply_operator(W,numpy.column_stack((stnHdiff,stnWdiff)))
 
-def gotomapres(clargs,tmpdir,fout):
-#   resample to final resolution
-    yyyymmdd=clargs['date'].replace('-','')
-    hhmm=''.join([clargs['hour'],clargs['min']])
+    # add diff surfaces to Wx ZHD, ZWD
+    write_grd('/'.join([tmpdir,'comboH.sl.grd']),wlon,wlat,diffs[:,0].reshape(Wx100H.shape)+Wx100H)
+    write_grd('/'.join([tmpdir,'comboW.sl.grd']),wlon,wlat,diffs[:,1].reshape(Wx100W.shape)+Wx100W)
 
-    subprocess.call(['grdsample',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I',str(clargs['resolution'])]),'-F','/'.join([tmpdir,'comboH.sl.grd']),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'comboH.sl.mapres.grd'])])])],stdout=fout)
-    subprocess.call(['grdsample',''.join(['-R','/'.join([str(clargs['lonmin']),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])]),''.join(['-I',str(clargs['resolution'])]),'-F','/'.join([tmpdir,'comboW.sl.grd']),''.join(['-G','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'comboW.sl.mapres.grd'])])])],stdout=fout)
 
-def gototopo(clargs,tmpdir,fout): 
-#   goto topo
+def IDW(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout):
+    dMax=200
+    (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,grid,wxsl)
+
+    # 10 nearest stations within dMax of every node, 1/d**2 weights
+    (wlon,wlat)=grid
+    W=interp_operator('IDW',gpslon,gpslat,wlon,wlat,cachedir=cache_dir(clargs),k=10,dMax=dMax)
+    diffs=apply_operator(W,numpy.column_stack((stnHdiff,stnWdiff)))
+
+    #add Wx to difference surface
+    write_grd('/'.join([tmpdir,'comboH.sl.grd']),wlon,wlat,diffs[:,0].reshape(Wx100H.shape)+Wx100H)
+    write_grd('/'.join([tmpdir,'comboW.sl.grd']),wlon,wlat,diffs[:,1].reshape(Wx100W.shape)+Wx100W)
+
+
+def krige(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout):
+    (stnHdiff,stnWdiff,Wx100H,Wx100W)=gpsWxdiffs(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,grid,wxsl)
+
+    # variogram of each residual field fitted once per epoch, then ordinary
+    # kriging from the 16 nearest stations of every node.  Weights depend on
+    # the epoch's variogram, so they are not cached on disk.
+    (wlon,wlat)=grid
+    vario=fit_variogram(gpslon,gpslat,stnHdiff)
+    W=interp_operator('krige',gpslon,gpslat,wlon,wlat,k=16,vario=vario)
+    diffH=apply_operator(W,stnHdiff).reshape(Wx100H.shape)
+    vario=fit_variogram(gpslon,gpslat,stnWdiff)
+    W=interp_operator('krige',gpslon,gpslat,wlon,wlat,k=16,vario=vario)
+    diffW=apply_operator(W,stnWdiff).reshape(Wx100W.shape)
+
+    #add Wx to difference surface
+    write_grd('/'.join([tmpdir,'comboH.sl.grd']),wlon,wlat,diffH+Wx100H)
+    write_grd('/'.join([tmpdir,'comboW.sl.grd']),wlon,wlat,diffW+Wx100W)
+
+
+def wx_at_stations(wx,grid,gpslon,gpslat):
+#   weather at the stations as gpsWxdiffs samples it (bilinear between the
+#   working grid nodes around each station), gridding only those nodes
+    (wlon,wlat)=grid
+    (idx,w)=bilinear_weights(wlon,wlat,gpslon,gpslat)
+    if wx is None:
+        zero=numpy.zeros(len(gpslon))
+        return (zero,zero.copy())
+    (Wxlon,Wxlat,Wxzhdm,Wxzwdm,Wxtsl)=wx
+    nodes=numpy.unique(idx)
+    (tidx,tw)=triang_weights(Wxlon,Wxlat,wlon[nodes%len(wlon)],wlat[nodes//len(wlon)])
+    pos=numpy.searchsorted(nodes,idx)
+    return (apply_weights(pos,w,apply_weights(tidx,tw,Wxzhdm)),apply_weights(pos,w,apply_weights(tidx,tw,Wxzwdm)))
+
+def combo_tile(task):
+#   sea-level combination on one tile of the working grid, run in a worker
+    (clargs,grid,wx,gpslon,gpslat,stnHdiff,stnWdiff,varios)=task
+    (wlon,wlat)=grid
+    (Wx100H,Wx100W)=grid_wx(clargs,wx,grid)
+    if clargs['interp']=='krige':
+        W=interp_operator('krige',gpslon,gpslat,wlon,wlat,k=16,vario=varios[0])
+        diffH=apply_operator(W,stnHdiff)
+        W=interp_operator('krige',gpslon,gpslat,wlon,wlat,k=16,vario=varios[1])
+        diffW=apply_operator(W,stnWdiff)
+    else:
+        if clargs['interp']=='IDW':
+            W=interp_operator('IDW',gpslon,gpslat,wlon,wlat,cachedir=cache_dir(clargs),k=10,dMax=200)
+        else:
+            W=interp_operator('triang',gpslon,gpslat,wlon,wlat,cachedir=cache_dir(clargs))
+        diffs=apply_operator(W,numpy.column_stack((stnHdiff,stnWdiff)))
+        diffH=diffs[:,0]
+        diffW=diffs[:,1]
+    return (diffH.reshape(Wx100H.shape)+Wx100H,diffW.reshape(Wx100W.shape)+Wx100W)
+
+def tiled_combo(clargs,wx,gpszhd_sl,gpszwd_sl,gpslon,gpslat,tmpdir,grid):
+#   tiled version of grid_wx + triang/IDW/krige for large domains.  The
+#   working grid is cut into -tiles nx/ny blocks; each is interpolated in
+#   a worker process from the stations and weather points in a halo
+#   around it, and the tiles are stitched one row band at a time into
+#   comboH.sl.grd and comboW.sl.grd.  Station residuals and the kriging
+#   variograms are computed once for the whole domain, and each halo
+#   holds every point the full-domain weights could use (see hull_support
+#   and knn_support), so the stitched grids match the untiled ones.
+    (wlon,wlat)=grid
+    (nx,ny)=[int(n) for n in clargs['tiles'].split('/')]
+    gpslon=numpy.asarray(gpslon,dtype=float)
+    gpslat=numpy.asarray(gpslat,dtype=float)
+    (WxH,WxW)=wx_at_stations(wx,grid,gpslon,gpslat)
+    stnHdiff=numpy.asarray(gpszhd_sl)-WxH
+    stnWdiff=numpy.asarray(gpszwd_sl)-WxW
+    varios=None
+    if clargs['interp']=='krige':
+        varios=(fit_variogram(gpslon,gpslat,stnHdiff),fit_variogram(gpslon,gpslat,stnWdiff))
+    if clargs['interp']=='triang':
+        stntri=Delaunay(numpy.column_stack((gpslon,gpslat)))
+    if wx is not None:
+        wxtri=Delaunay(numpy.column_stack((wx[0],wx[1])))
+
+    tasks=[]
+    for rows in numpy.array_split(numpy.arange(len(wlat)),ny):
+        for cols in numpy.array_split(numpy.arange(len(wlon)),nx):
+            (tlon,tlat)=(wlon[cols],wlat[rows])
+            if clargs['interp']=='triang':
+                s=hull_support(stntri,tlon,tlat)
+            else:
+                s=knn_support(gpslon,gpslat,tlon,tlat,16 if clargs['interp']=='krige' else 10)
+            twx=None
+            if wx is not None:
+                m=hull_support(wxtri,tlon,tlat)
+                twx=tuple(a[m] for a in wx)
+            tasks.append((clargs,(tlon,tlat),twx,gpslon[s],gpslat[s],stnHdiff[s],stnWdiff[s],varios))
+
+    nproc=clargs['nproc'] or multiprocessing.cpu_count()
+    # one tile per worker process keeps each worker's memory to one tile
+    pool=multiprocessing.Pool(min(nproc,len(tasks)),maxtasksperchild=1)
+    outH=GrdWriter('/'.join([tmpdir,'comboH.sl.grd']),wlon,wlat)
+    outW=GrdWriter('/'.join([tmpdir,'comboW.sl.grd']),wlon,wlat)
+    try:
+        band=[]
+        row0=0
+        for (comboH,comboW) in pool.imap(combo_tile,tasks):
+            band.append((comboH,comboW))
+            if len(band)==nx:
+                outH.write_rows(row0,numpy.hstack([b[0] for b in band]))
+                outW.write_rows(row0,numpy.hstack([b[1] for b in band]))
+                row0+=band[0][0].shape[0]
+                band=[]
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        outH.close()
+        outW.close()
+
+def output_name(clargs):
     yyyymmdd=clargs['date'].replace('-','')
     hhmm=''.join([clargs['hour'],clargs['min']])
-
-    subprocess.call(['grdmath','/'.join([tmpdir,'DEMfiles','DEM-mapres.grd']),'-1','MUL',str(Hscale),'DIV','EXP','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'comboH.sl.mapres.grd'])]),'MUL','=','/'.join([tmpdir,'comboH.grd'])],stdout=fout)
-    subprocess.call(['grdmath','/'.join([tmpdir,'DEMfiles','DEM-mapres.grd']),'-1','MUL',str(Wscale),'DIV','EXP','/'.join([tmpdir,'.'.join([yyyymmdd,hhmm,'comboW.sl.mapres.grd'])]),'MUL','=','/'.join([tmpdir,'comboW.grd'])],stdout=fout)
-
-#   add for ZTD
-
     if type(clargs['output_file']) is types.NoneType:
         fn={}
         if clargs['Wx']!='off':
           fn['Wx']=clargs['Wx']
         else:
           fn['Wx']='gpsonly'
-        finalfn='/'.join([clargs['output_dir'],'.'.join([yyyymmdd,hhmm,clargs['gps'],fn['Wx'],clargs['interp'],'.grd'] )])
+        finalfn='/'.join([clargs['output_dir'],'.'.join([yyyymmdd,hhmm,clargs['gps'],fn['Wx'],clargs['interp'],EXTENSIONS[clargs['format']]] )])
     else:
         finalfn='/'.join([clargs['output_dir'],clargs['output_file']])
-    subprocess.call(['grdmath','/'.join([tmpdir,'comboH.grd']),'/'.join([tmpdir,'comboW.grd']),'ADD','=',finalfn],stdout=fout)
+    return finalfn
+
+def gototopo(clargs,tmpdir,fout,dem=None,demean=False,stats=None,combodir=None): 
+#   goto topo: resample the sea-level combos to the DEM nodes and scale by
+#   height in one pass over the DEM rows (ISCE window, or the SRTM mosaic
+#   resampled to map resolution by get_dem).  With demean the mean over
+#   the map is found in a first, write-free pass and removed from ztd.
+#   stats (a GridStats) collects the statistics of the ztd written.  The
+#   combos are read from combodir if given (the DEM is still tmpdir's).
+    finalfn=output_name(clargs)
+    if combodir is None:
+        combodir=tmpdir
+    (wlon,wlat,comboH)=read_grd('/'.join([combodir,'comboH.sl.grd']))
+    (wlon,wlat,comboW)=read_grd('/'.join([combodir,'comboW.sl.grd']))
+    (products,tsl)=read_products(clargs,combodir)
+    if dem is None:
+        grd=open_grd('/'.join([tmpdir,'DEMfiles','DEM-mapres.grd']))
+    else:
+        grd=dem
+    try:
+        factors=None
+        if cache_dir(clargs) is not None:
+            factors=scale_factors(grd,Hscale,Wscale,cache_dir(clargs),dem_sources(clargs,tmpdir))
+        chunk=None
+        if clargs['chunk'] is not None:
+            chunk=[int(n) for n in clargs['chunk'].split('/')]
+        offset=0.
+        if demean:
+            offset=topo_mean((wlon,wlat),comboH,comboW,grd,Hscale,Wscale,factors=factors)
+        topo_ztd(finalfn,(wlon,wlat),comboH,comboW,grd,Hscale,Wscale,factors=factors,chunk=chunk,complevel=clargs['complevel'],products=products,tsl=tsl,writer=WRITERS[clargs['format']],offset=offset,stats=stats)
+    finally:
+        if dem is None:
+            grd.close()
     if clargs['png']=='on':
        create_png(clargs,finalfn)
     return finalfn
 
+def gotordr(clargs,tmpdir,fout,demean=False,stats=None,combodir=None):
+#   correction straight in radar geometry: sample the sea-level combos at
+#   every pixel of lat.rdr/lon.rdr and scale by the radar-geometry heights,
+#   block rows at a time; no geographic map is made.  demean, stats and
+#   combodir are as for gototopo.
+    finalfn=output_name(clargs)
+    if combodir is None:
+        combodir=tmpdir
+    (wlon,wlat,comboH)=read_grd('/'.join([combodir,'comboH.sl.grd']))
+    (wlon,wlat,comboW)=read_grd('/'.join([combodir,'comboW.sl.grd']))
+    (products,tsl)=read_products(clargs,combodir)
+    try:
+        lat=isce_band(clargs['rdr_lat'])
+        lon=isce_band(clargs['rdr_lon'])
+        hgt=isce_band(clargs['rdr_hgt'])
+    except (IOError,KeyError,ValueError,TypeError):
+        print >>sys.stderr, ' '.join(['could not map radar geometry files',clargs['rdr_lat'],clargs['rdr_lon'],clargs['rdr_hgt']])
+        cleanup(clargs,tmpdir)
+        sys.exit(2)
+    if lat.shape!=lon.shape or lat.shape!=hgt.shape:
+        print >>sys.stderr, "Error: radar lat, lon and height files differ in size"
+        cleanup(clargs,tmpdir)
+        sys.exit(2)
+    (length,width)=hgt.shape
+    factors=None
+    if cache_dir(clargs) is not None:
+        factors=scale_factors(Grid(numpy.arange(width),numpy.arange(length),hgt),Hscale,Wscale,cache_dir(clargs),[clargs['rdr_hgt']])
+    offset=0.
+    if demean:
+        offset=rdr_mean((wlon,wlat),comboH,comboW,lat,lon,hgt,Hscale,Wscale,factors=factors)
+    rdr_ztd(finalfn,(wlon,wlat),comboH,comboW,lat,lon,hgt,Hscale,Wscale,factors=factors,products=products,tsl=tsl,offset=offset,stats=stats)
+    write_isce_xml(''.join([finalfn,'.xml']),width,length,bands=len(products))
+    if clargs['png']=='on':
+        # first band, first line at the top, no coastlines in radar geometry
+        fullpath=os.path.abspath(os.path.dirname(sys.argv[0]))
+        ztd=numpy.memmap(finalfn,dtype='<f4',mode='r',shape=(length,len(products),width))[:,0,:]
+        render_png('.'.join([finalfn,'png']),Grid(numpy.arange(width),numpy.arange(length,0,-1),ztd),'/'.join([fullpath,'tropmap.cpt']),coast=False,zrange=preview_range(products[0]))
+    return finalfn
+
+def read_products(clargs,tmpdir):
+#   requested product list, and the sea-level temperature grid if pwv is one
+    products=clargs['products'].split(',')
+    tsl=None
+    if 'pwv' in products:
+        (wlon,wlat,tsl)=read_grd('/'.join([tmpdir,'tempT.sl.grd']))
+    return (products,tsl)
+
+def preview_range(product):
+#   colour range of a product's preview: tropmap.cpt spans the 1.5-3 m of
+#   total delays; the components and pwv take theirs from the data
+    if product=='ztd':
+        return None
+    return 'data'
+
 def create_png(clargs,finalfnbase):
+#      preview rendered in-process: tropmap.cpt colours, coastlines and colour bar
+#      (of the first product)
        fullpath=os.path.abspath(os.path.dirname(sys.argv[0]))
-       bbox='/'.join([''.join(['-R',str(clargs['lonmin'])]),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])
-       proj=''.join(['-Jkf',str((clargs['lonmin']+clargs['lonmax'])/2),'/5'])
-       ps=open('.'.join([finalfnbase,'ps']),'w')
-       subprocess.call(['grdimage',proj,bbox,''.join(['-C',fullpath,'/tropmap.cpt']), finalfnbase,'-K'],stdout=ps)
-       subprocess.call(['pscoast',proj,bbox,'-Bg0/g0','-Di','-W','-O','-K'],stdout=ps)
-       subprocess.call(['psscale','-D5.5/2/2.5/0.1','-B:,m:',''.join(['-C',fullpath,'/tropmap.cpt']),'-B1','-E','-O'],stdout=ps)
-       ps.close
-       subprocess.call(['convert','-trim','-rotate','90','.'.join([finalfnbase,'ps']),'.'.join([finalfnbase,'png'])])
-
+       product=clargs['products'].split(',')[0]
+       grd=open_raster(finalfnbase,product_var(product))
+       try:
+           render_png('.'.join([finalfnbase,'png']),grd,'/'.join([fullpath,'tropmap.cpt']),zrange=preview_range(product))
+       finally:
+           grd.close()
+
+
+def gather(clargs,tmpdir,fout,trop=None,coords=None):
+#   epoch inputs: weather model points (get_grib) and GPS sea-level delays
+#   (get_gpstrop, with shared trop/coords if given), downloading into
+#   tmpdir as needed
+   wx=get_grib(clargs,tmpdir,fout)
+   gps=get_gpstrop(clargs,tmpdir,fout,trop,coords)
+   return (wx,gps)
+
+def sealevel_combo(clargs,wx,gps,tmpdir,grid,fout):
+#   combo stage: GPS-minus-weather residuals interpolated onto grid and
+#   added to the gridded weather model, written as comboH.sl.grd and
+#   comboW.sl.grd (and tempT.sl.grd for pwv) in tmpdir
+   (gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat)=gps
+   if clargs['tiles']!='1/1':
+       tiled_combo(clargs,wx,gpszhd_sl,gpszwd_sl,gpslon,gpslat,tmpdir,grid)
+   else:
+       wxsl=grid_wx(clargs,wx,grid)
+       if clargs['interp']=='triang':
+           triang(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout)
+       elif clargs['interp']=='IDW':
+           IDW(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout)
+       elif clargs['interp']=='krige':
+           krige(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,grid,wxsl,fout)
+   if 'pwv' in clargs['products'].split(','):
+       grid_temp(clargs,wx,tmpdir,grid)
 
 def tropmap(clargs):
+   set_precision(clargs['precision'])
    tmpdir=setup_tmp(clargs)
    if clargs['verbose']=='on':
        fout=os.dup(1)
    else:
        fout=open(os.devnull,'w')
-   get_grib(clargs,tmpdir,fout)
-   (gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat)=get_gpstrop(clargs,tmpdir,fout)
-   get_dem(clargs,tmpdir,fout)
+   (wx,gps)=gather(clargs,tmpdir,fout)
+   if type(clargs['rdr_lat']) is types.NoneType:
+       dem=get_dem(clargs,tmpdir,fout)
    if type(clargs['download_only']) is types.NoneType:
-       if clargs['interp']=='triang':
-           triang(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,fout)
-       elif clargs['interp']=='IDW':
-           IDW(clargs,gpszhd_sl,gpszwd_sl,ll,sites,gpslon,gpslat,tmpdir,fout)
-       gotomapres(clargs,tmpdir,fout)
-       finalfn=gototopo(clargs,tmpdir,fout)
+       grid=workgrid(clargs,gps[4],gps[5])
+       sealevel_combo(clargs,wx,gps,tmpdir,grid,fout)
+       # finish stage: the combos to the DEM or the radar grid
+       if type(clargs['rdr_lat']) is types.NoneType:
+           finalfn=gototopo(clargs,tmpdir,fout,dem)
+       else:
+           finalfn=gotordr(clargs,tmpdir,fout)
        cleanup(clargs,tmpdir)
        return finalfn
 #   ZTD()
@@ -1030,14 +1329,26 @@ Main program that interprets user-specified arguments and executes the necessary
     parser.add_argument('-min',metavar='MM',type=str,help='2-digit minutes',required=True)
     parser.add_argument('-gps',metavar='gipsy|gamit',type=str,help='gipsy or gamit gps estimates',required=True,choices=['gipsy','gamit'])
     parser.add_argument('-Wx',metavar='namanl|narr-a|rucanl|gfsanl|off',type=str,help='choose weather model, or gps only',required=True,choices=['namanl','narr-a','rucanl','gfsanl','off'])
-    parser.add_argument('-interp',metavar='triang|IDW',type=str,help='choose triangulation or inverse distance weighting',required=True,choices=['triang','IDW'])
+    parser.add_argument('-interp',metavar='triang|IDW|krige',type=str,help='choose triangulation, inverse distance weighting or local kriging',required=True,choices=['triang','IDW','krige'])
     parser.add_argument('-workdir',metavar='dir',type=str,help='directory to save intermediate files in and attempt to read files from (default is to use /tmp and delete)')
+    parser.add_argument('-cache_dir',metavar='dir',type=str,help='directory for reusable interpolation weights and topographic scale factors (default is workdir, if given)')
+    parser.add_argument('-grid_max',metavar='n',type=int,help='maximum number of intervals per axis of the sea-level working grid',default=400)
+    parser.add_argument('-tiles',metavar='nx/ny',type=str,help='interpolate the sea-level grid in nx by ny tiles in parallel',default='1/1')
+    parser.add_argument('-nproc',metavar='n',type=int,help='number of worker processes for -tiles (default is all cores)')
     parser.add_argument('-coords',metavar='servlet|xml|llh',type=str,help='source for site coordinates',default='xml')
     parser.add_argument('-llh_dir',metavar='dir',type=str,help='Directory containing NominalPosition.List.llh file when using -coords llh')
     parser.add_argument('-resolution',metavar='xres/yres',type=str,help='resolution of correction map, specfied as xres/yres (meters)',default='6c')
     parser.add_argument('-output_dir',metavar='dir',type=str,help='directory in which the result map will be placed',default='.')
     parser.add_argument('-output_file',metavar='file',type=str,help='output filename for the .grd product',default='output')
     parser.add_argument('-ISCE_DEM',metavar='file',type=str,help='ISCE DEM file specifying range and resolution for product file')
+    parser.add_argument('-rdr_lat',metavar='file',type=str,help='ISCE radar-geometry latitude image (lat.rdr); output is then in radar geometry')
+    parser.add_argument('-rdr_lon',metavar='file',type=str,help='ISCE radar-geometry longitude image (lon.rdr)')
+    parser.add_argument('-rdr_hgt',metavar='file',type=str,help='ISCE radar-geometry height image (z.rdr)')
+    parser.add_argument('-chunk',metavar='nx/ny',type=str,help='write the product as chunked netCDF-4 with nx by ny chunks')
+    parser.add_argument('-complevel',metavar='n',type=int,help='deflate level (1-9) for the product, implies netCDF-4',choices=range(0,10),default=0)
+    parser.add_argument('-format',metavar='grd|raw|gtiff',type=str,help='product format: GMT grid, raw float32 with .rsc, or cloud-optimized GeoTIFF',choices=list(FORMATS),default='grd')
+    parser.add_argument('-precision',metavar='single|double',type=str,help='working precision of grids and intermediate arrays',choices=['single','double'],default='single')
+    parser.add_argument('-products',metavar='ztd,zhd,zwd,pwv',type=str,help='comma separated layers to write in one pass',default='ztd')
     parser.add_argument('-local_gipsy_dir',metavar='dir',type=str,help='directory (above yearly directories) for gipsy .trop.tar files')
     parser.add_argument('-local_gamit_dir',metavar='dir',type=str,help='directory (above global/ and regional/) for gamit ofiles')
     parser.add_argument('-local_xml_dir',metavar='dir',type=str,help='directory for xml files')
@@ -1048,6 +1359,23 @@ Main program that interprets user-specified arguments and executes the necessary
     args=parser.parse_args()
     clargs=vars(args)
     # Add type checking, min<max, etc here
+    if not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['tiles']):
+        print >>sys.stderr, ' '.join(['-tiles must be nx/ny, not',clargs['tiles']])
+        sys.exit(2)
+    if clargs['chunk'] is not None and not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['chunk']):
+        print >>sys.stderr, ' '.join(['-chunk must be nx/ny, not',clargs['chunk']])
+        sys.exit(2)
+    if [clargs['rdr_lat'],clargs['rdr_lon'],clargs['rdr_hgt']].count(None) not in (0,3):
+        print >>sys.stderr, '-rdr_lat, -rdr_lon and -rdr_hgt must be given together'
+        sys.exit(2)
+    if clargs['format']=='gtiff' and gdal is None:
+        print >>sys.stderr, '-format gtiff needs the GDAL python bindings (osgeo)'
+        sys.exit(2)
+    products=clargs['products'].split(',')
+    for product in products:
+        if product not in PRODUCTS or products.count(product)>1:
+            print >>sys.stderr, ' '.join(['bad or repeated product',product,'in -products'])
+            sys.exit(2)
 
     retstatus=tropmap(clargs)
     sys.exit(0)
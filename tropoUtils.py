@@ -4,9 +4,9 @@ import isce
 import subprocess
 import sys
 import os
+import json
 import numpy as np
 from array import array
-from bilin import Bilinear2DInterpolator as BI
 
 
 def readImage(filename,dt,width):
@@ -53,11 +53,39 @@ def phaseToMeters(filein,fileout):
     print(command)
     subprocess.call(command,shell = True)
 
+# tropwrap.py -format and the extension of its correction (rdr: in radar
+# geometry, with -rdr_lat/-rdr_lon/-rdr_hgt)
+CORRECTION_EXTENSIONS = {'grd':'.grd','raw':'.raw','gtiff':'.tif','rdr':'.rdr'}
+
+# Name of the correction tropwrap.py writes for an interferogram
+#filein : the interferogram given to tropwrap.py -igram
+#outputDir : tropwrap.py -output_dir
+#fmt : tropwrap.py -format (grd, raw or gtiff), or rdr
+def correctionFile(filein,outputDir='.',fmt='grd'):
+    return os.path.join(outputDir,os.path.basename(filein) + '.correction' + CORRECTION_EXTENSIONS[fmt])
+
+# The correction of an interferogram in outputDir, in whichever format has
+# a JSON sidecar (every tropwrap.py correction has one)
+def findCorrection(filein,outputDir='.'):
+    for fmt in ('rdr','raw','grd','gtiff'):
+        correctionName = correctionFile(filein,outputDir,fmt)
+        if os.path.exists(correctionName + '.json'):
+            return correctionName
+    raise IOError('no tropwrap correction of ' + filein + ' (with a .json sidecar) in ' + outputDir)
+
 #filein : input interferogram (just used to create the name)
 #datetime1 : datetime instance of the first acquisition
 #datetime2 : datetime instance of the second acquisition
 #demxml : dem xml file adopted
-def tropoCorrection(filein,datetime1,datetime2,demxml):
+#outputDir : directory for the correction
+#fmt : format of the correction (grd, raw or gtiff)
+#fileLat, fileLon, fileHgt : latitude, longitude and height files from isce
+#                            (lat.rdr, lon.rdr, z.rdr); if given, the
+#                            correction is made in radar geometry (rdr) on
+#                            the interferogram's pixels and fmt is not used
+# Returns the correction file, outputDir/<filein>.correction.<ext>, whose
+# .json sidecar describes it.
+def tropoCorrection(filein,datetime1,datetime2,demxml,outputDir='.',fmt='grd',fileLat=None,fileLon=None,fileHgt=None):
     from iscesys.Parsers.FileParserFactory import createFileParser
     parser = createFileParser('xml')
     prop,fact,misc = parser.parse(demxml)
@@ -86,67 +114,185 @@ def tropoCorrection(filein,datetime1,datetime2,demxml):
     command = 'tropwrap.py -igram ' + filein + ' -resolution ' + str(width) + '+/' + str(length) + '+' +   ' -latmin ' + str(latmin) +' -latmax ' + str(latmax) + ' -lonmin ' + str(lonmin) \
               + ' -lonmax ' + str(lonmax) + ' -date1 ' + str(date1) + \
               ' -date2 ' + str(date2)  + ' -hour1 ' + str(hour1) + ' -min1 '+ str(min1) + ' -hour2 ' + \
-              str(hour2) + ' -min2 ' + str(min2) + ' -gps gipsy -Wx off -interp triang -png on -ISCE_DEM ' + dem
-    subprocess.call(command,shell = True)
+              str(hour2) + ' -min2 ' + str(min2) + ' -gps gipsy -Wx off -interp triang -png on -ISCE_DEM ' + dem + \
+              ' -output_dir ' + outputDir + ' -format ' + fmt
+    if fileLat is not None:
+        command += ' -rdr_lat ' + fileLat + ' -rdr_lon ' + fileLon + ' -rdr_hgt ' + fileHgt
+        fmt = 'rdr'
+    if subprocess.call(command,shell = True) != 0:
+        raise RuntimeError('failed: ' + command)
+    return correctionFile(filein,outputDir,fmt)
+
+# Windows z[y0:y1,x0:x1] of a correction read on demand through
+# read(y0,y1,x0,x1) from the open file handle, which it keeps
+class CorrectionWindows:
+    def __init__(self,read,shape,handle):
+        self.read = read
+        self.shape = shape
+        self.handle = handle
+
+    def __getitem__(self,index):
+        (ys,xs) = index
+        return self.read(ys.start,ys.stop,xs.start,xs.stop)
+
+# Open a tropmap/tropwrap correction as node longitudes, latitudes (in the
+# file's row order) and values indexable by windows [y0:y1,x0:x1], which
+# are read only when indexed.  A raw correction is memory-mapped with the
+# geometry and layout in its JSON sidecar (correctionName.json), or in its
+# ROI_PAC .rsc; a GeoTIFF is read window by window through GDAL, and a GMT
+# grid through PyNIO with its own node coordinates (no grd2xyz or grdinfo).
+# A correction in radar geometry has no nodes: it is memory-mapped as
+# (length,width) and returned with None for the longitudes and latitudes.
+# correctionName: the correction file
+def readCorrection(correctionName):
+    if os.path.exists(correctionName + '.json'):
+        sidecar = json.load(open(correctionName + '.json'))
+        geometry = sidecar['geometry']
+        layout = sidecar['layout']
+        if geometry.get('kind') == 'radar':
+            datain = np.memmap(correctionName,'<f4','r',offset=layout['offset'],shape=tuple(layout['shape']))
+            return (None,None,datain[:,layout['band'],:])
+        if layout['format'] == 'raw':
+            lon = geometry['x_min'] + geometry['x_inc']*np.arange(geometry['nx'])
+            if geometry['row_order'] == 'north_first':
+                lat = geometry['y_max'] - geometry['y_inc']*np.arange(geometry['ny'])
+            else:
+                lat = geometry['y_min'] + geometry['y_inc']*np.arange(geometry['ny'])
+            dt = np.dtype(layout['dtype']).newbyteorder({'little':'<','big':'>'}[layout['byte_order']])
+            datain = np.memmap(correctionName,dt,'r',offset=layout['offset'],shape=tuple(layout['shape']))
+            return (lon,lat,datain[:,layout['bands'].index('z'),:])
+    if os.path.exists(correctionName + '.rsc'):
+        rsc = {}
+        for line in open(correctionName + '.rsc'):
+            fields = line.split()
+            if len(fields) >= 2:
+                rsc[fields[0]] = fields[1]
+        lonN = int(rsc['WIDTH'])
+        latN = int(rsc['FILE_LENGTH'])
+        lonDelta = float(rsc['X_STEP'])
+        latDelta = -float(rsc['Y_STEP'])
+        # X_FIRST/Y_FIRST are the outer corner of the first pixel
+        lon = float(rsc['X_FIRST']) + lonDelta*(np.arange(lonN) + 0.5)
+        lat = float(rsc['Y_FIRST']) - latDelta*(np.arange(latN) + 0.5)
+        nBands = int(rsc.get('NUMBER_BANDS',1))
+        datain = np.memmap(correctionName,'<f4','r',shape=(latN,nBands,lonN))[:,0,:]
+        return (lon,lat,datain)
+    if correctionName.endswith('.tif') or correctionName.endswith('.tiff'):
+        from osgeo import gdal
+        ds = gdal.Open(correctionName)
+        (lonFirst,lonDelta,rx,latFirst,ry,latDelta) = ds.GetGeoTransform()
+        lon = lonFirst + lonDelta*(np.arange(ds.RasterXSize) + 0.5)
+        lat = latFirst + latDelta*(np.arange(ds.RasterYSize) + 0.5)
+        band = ds.GetRasterBand(1)
+        def readTif(y0,y1,x0,x1):
+            return band.ReadAsArray(x0,y0,x1 - x0,y1 - y0)
+        return (lon,lat,CorrectionWindows(readTif,(len(lat),len(lon)),ds))
+    from grdfunctions import open_grd
+    grd = open_grd(correctionName)
+    def readGrd(y0,y1,x0,x1):
+        return grd.z[y0:y1,x0:x1]
+    return (grd.x,grd.y,CorrectionWindows(readGrd,grd.shape,grd))
+
+# Most correction nodes sampleCorrection reads at once (64 MB of float32)
+MAX_WINDOW = 1 << 24
+
+# Bilinear interpolation, as bilin.Bilinear2DInterpolator, of the regular
+# grid of nodes xin, yin (ascending or descending) at the points x, y,
+# reading only the window of datain they fall in; NaN nodes count as 0 and
+# points outside the grid take the values at its edge.  Points whose window
+# is over maxWindow nodes (e.g. a block of radar lines across a long swath
+# at an angle to the grid) are sampled in halves of it.  Coordinates and
+# weights are float32, the working precision of the correction.
+def sampleCorrection(xin,yin,datain,x,y,maxWindow=MAX_WINDOW):
+    (nx,ny) = (len(xin),len(yin))
+    xcoords = np.clip(((nx - 1)*(x - xin[0])/(xin[-1] - xin[0])).astype(np.float32),0,nx - 1)
+    ycoords = np.clip(((ny - 1)*(y - yin[0])/(yin[-1] - yin[0])).astype(np.float32),0,ny - 1)
+    xint = xcoords.astype(np.int32)
+    yint = ycoords.astype(np.int32)
+    (x0,x1) = (xint.min(),min(xint.max() + 2,nx))
+    (y0,y1) = (yint.min(),min(yint.max() + 2,ny))
+    if (y1 - y0)*(x1 - x0) > maxWindow:
+        key = yint if y1 - y0 >= x1 - x0 else xint
+        low = key < (int(key.min()) + int(key.max()) + 1)//2
+        out = np.empty(np.shape(x),np.float32)
+        for part in (low,~low):
+            out[part] = sampleCorrection(xin,yin,datain,x[part],y[part],maxWindow)
+        return out
+    delx = xcoords - xint.astype(np.float32)
+    dely = ycoords - yint.astype(np.float32)
+    zin = np.array(datain[y0:y1,x0:x1],dtype=np.float32)
+    zin[np.isnan(zin)] = 0
+    xip1 = np.minimum(xint + 1,nx - 1) - x0
+    yip1 = np.minimum(yint + 1,ny - 1) - y0
+    xint -= x0
+    yint -= y0
+    return (1.-delx)*(1.-dely)*zin[yint,xint] + \
+           delx*dely*zin[yip1,xip1] + \
+           (1.-delx)*dely*zin[yip1,xint] + \
+           delx*(1.-dely)*zin[yint,xip1]
 
 #waveLength : radar wavelegth
 #ifgName : interferogram name
 #fileLat : latitude file from isce (lat.rdr)
 #fileLon : longitude file from isce (lon.rdr)
-#fileLos : line of sight file from isce 
+#fileLos : line of sight file from isce (los.rdr, two bands interleaved by
+#          line, the look angle first)
 #ifgCorrectedName : filename for the output corrected interferogram
-def wrapCorrection(waveLength,ifgName,fileLat,fileLon,fileLos,ifgCorrectedName):
-    import cPickle as cp
+#correctionName : the tropwrap correction (its .json sidecar describes it),
+#                 as returned by tropoCorrection; if None, ifgName's
+#                 correction in the current directory (see findCorrection)
+#block : radar lines per block
+#nthreads : blocks processed at once (default one per core)
+# The inputs and the correction are memory-mapped (or read by window) and
+# processed block lines at a time: the correction is interpolated at the
+# block's lat/lon from just the window of it they cover (or, in radar
+# geometry, taken as it is), projected on the line of sight, converted to
+# phase and applied to the interferogram in one step, and the phase
+# (uwcorr.unw) and corrected interferogram go straight to memory-mapped
+# outputs.  Memory use depends on block, width and
+# nthreads, not on the size of the scene or the correction.
+def wrapCorrection(waveLength,ifgName,fileLat,fileLon,fileLos,ifgCorrectedName,correctionName=None,block=256,nthreads=None):
+    from multiprocessing.pool import ThreadPool
     from iscesys.Parsers.FileParserFactory import createFileParser
     parser = createFileParser('xml')
     prop,fact,misc = parser.parse(ifgName +'.xml')
     width = prop['Coordinate1']['size']
-    fp = open('tropwrap.pck')
-    dataIn = cp.load(fp)
-    fp.close()
-    correctionName = dataIn[0]
-    grdinfo = dataIn[1]
-    correctionXyzName = correctionName[:-3] + 'xyz'
-    command = 'grd2xyz -Zf ' + correctionName + ' > ' + correctionXyzName
-    subprocess.call(command,shell=True)
-    # hate to do that but the grdinfo is a string and needs to be parsed
-    grdinfoSp = grdinfo.split(' ')
-    lonMin = float(grdinfoSp[grdinfoSp.index('x_min:') + 1])
-    lonDelta = float(grdinfoSp[grdinfoSp.index('x_inc:') + 1])
-    lonN = int(grdinfoSp[grdinfoSp.index('nx:') + 1].split()[0])
-    latMax = float(grdinfoSp[grdinfoSp.index('y_max:') + 1])
-    latDelta = float(grdinfoSp[grdinfoSp.index('y_inc:') + 1])
-    latN = int(grdinfoSp[grdinfoSp.index('ny:') + 1].split()[0])
-    lon = lonMin + lonDelta*np.arange(lonN) 
-    lat = latMax - latDelta*np.arange(latN)
-    datain = readImage(correctionXyzName,'<f',lonN)
-    indxBad = np.where(np.isnan(datain))
-    datain[indxBad[0],indxBad[1]] = 0
-    latOut = readImage(fileLat,'<f',width) 
-    lonOut = readImage(fileLon,'<f',width)
-    #read as same width as lanOut or lonOut, but then skip every other line when looping
-    losOut = readImage(fileLos,'<f',width)
-    bi = BI(lon,-lat,datain)
-    geoCorrection = np.zeros(latOut.shape)
-    for i in xrange(latOut.shape[0]):
-        geoCorrection[i,:] = -bi(lonOut[i,:],-latOut[i,:]) *(4*np.pi/waveLength)/np.cos(np.radians(losOut[i*2,:]))
-    #free memory
-    del latOut
-    del lonOut
-    ifg = readImage(ifgName,'<f',2*width) 
-    ifg = np.reshape(ifg,(ifg.shape[0],width,2))
-    dim = geoCorrection.shape
-    geoCorrection.astype(np.float32).tofile('uwcorr.unw')
-    #save('test.geo',np.reshape(geoCorrection,dim[0]*dim[1]),'f')
-    fp = open(ifgCorrectedName,'w')
-    line = np.zeros((width,2))
-    for i in xrange(ifg.shape[0]):
-        cpx = (ifg[i,:,0] + np.complex64(1.0j)*ifg[i,:,1])*(np.exp(np.complex64(1.0j)*geoCorrection[i,:]))
-        line[:,0] = np.real(cpx) 
-        line[:,1] = np.imag(cpx)
-        arrayOut = array('f',np.reshape(line,2*width))
-        arrayOut.tofile(fp)
-    fp.close()
+    if correctionName is None:
+        correctionName = findCorrection(ifgName)
+    (lon,lat,datain) = readCorrection(correctionName)
+    # complex64 is the interleaved float32 pairs of the ISCE interferogram
+    ifg = np.memmap(ifgName,'<c8','r')
+    length = ifg.shape[0]//width
+    ifg = ifg[:length*width].reshape(length,width)
+    latIn = np.memmap(fileLat,'<f4','r',shape=(length,width))
+    lonIn = np.memmap(fileLon,'<f4','r',shape=(length,width))
+    losIn = np.memmap(fileLos,'<f4','r',shape=(length,2,width))[:,0,:]
+    geoCorrection = np.memmap('uwcorr.unw','<f4','w+',shape=(length,width))
+    ifgCorrected = np.memmap(ifgCorrectedName,'<c8','w+',shape=(length,width))
+    if lon is None and datain.shape != (length,width):
+        raise ValueError(correctionName + ' is not in the radar geometry of ' + ifgName)
+    scale = np.float32(4*np.pi/waveLength)
+
+    def wrapBlock(i0):
+        i1 = min(i0 + block,length)
+        if lon is None:
+            correction = np.array(datain[i0:i1],dtype=np.float32)
+            correction[np.isnan(correction)] = 0
+        else:
+            correction = sampleCorrection(lon,lat,datain,lonIn[i0:i1],latIn[i0:i1])
+        phase = (-scale*correction/np.cos(np.radians(losIn[i0:i1]))).astype(np.float32)
+        geoCorrection[i0:i1] = phase
+        ifgCorrected[i0:i1] = ifg[i0:i1]*np.exp(np.complex64(1.0j)*phase)
+
+    pool = ThreadPool(nthreads)
+    try:
+        pool.map(wrapBlock,range(0,length,block))
+    finally:
+        pool.close()
+        pool.join()
+    geoCorrection.flush()
+    ifgCorrected.flush()
+
 def main(argv):
     
     #test extractPhase
@@ -167,6 +313,6 @@ def main(argv):
     #phaseToMeters(argv[0] + '.grd',argv[0] + '.grd.m')
     #tested wrapCorrections by creating synthetic corrections of constant wvl/(4pi) so the correction 
     # should be one. It works
-    wrapCorrection(0.0312283810417,'topophase.flat','lat.rdr','lon.rdr','los.rdr','testCorrections.out')
+    wrapCorrection(0.0312283810417,'topophase.flat','lat.rdr','lon.rdr','los.rdr','testCorrections.out',correctionFile('topophase.flat'))
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+################################################################################
+# PROGRAM: tropstack.py
+################################################################################
+'''
+PROGRAM:
+    tropstack.py
+
+PURPOSE:
+    Troposphere corrections for a small-baseline stack of interferograms.
+
+DESCRIPTION:
+    Driving tropwrap.py once per interferogram makes two epoch maps per
+    pair, so a stack of M pairs over N acquisition dates costs 2M epochs.
+    tropstack.py reads the pair list, gathers the inputs of each unique
+    epoch once, puts every epoch's sea-level combination on one working
+    grid (from the stations of all epochs) and caches it, then writes each
+    pair's mean-removed correction from the difference of its two cached
+    epochs in a single pass over the DEM, as tropwrap.py -differential on
+    does.  Epochs and pairs are each processed -nproc at a time in separate
+    processes, so the cost scales with the number of dates, not pairs.
+
+USAGE:
+    tropstack.py -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -resolution <xres>/<yres> -pairs <file> -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] -interp [triang|IDW|krige] [-output_dir <dir>] [-ISCE_DEM file] [-chunk nx/ny] [-complevel n] [-precision single|double] [-format grd|raw|gtiff] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-cache_dir <dir>] [-grid_max n] [-tiles nx/ny] [-nproc n] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-local_xml_dir <dir>] [-download_only <dir>] [-pre_downloaded <dir>] [-png on|off] [-verbose on|off]
+
+OPTIONS:
+    -latmin latmin
+        minimum latitude
+
+    -latmax latmax
+        maximum latitude
+
+    -lonmin lonmin
+        minimum longitude
+
+    -lonmax lonmax
+        maximum longitude
+
+    -resolution <xres>/<yres>
+        number of samples in the x/y direction of the DEM file
+
+    -pairs <file>
+        text file with one interferogram per line:
+            YYYY-MM-DD HH MM YYYY-MM-DD HH MM [igram]
+        the first and second acquisition and, optionally, the
+        interferogram file, whose name then names the correction
+        (igram.correction.grd); otherwise it is named after the two
+        epochs (YYYYMMDDTHHMM-YYYYMMDDTHHMM.correction.grd)
+
+    -gps [gipsy|gamit]
+        which GPS estimates
+
+    -Wx [namanl,rucanl,gfsanl,off]
+        choose weather model, or none
+
+    -interp [triang|IDW|krige]
+        choose triangulation, inverse distance weighting, or local ordinary
+        kriging
+
+    -coords [servlet|xml|llh]
+        choose method for getting site coordinates.  Default = xml
+
+    -llh_dir [dir] [optional]
+        location of NominalPosition.List.llh file if using -coords llh
+
+    -output_dir (optional)
+        set a directory for the corrections.  Default = cwd
+
+    -workdir dir  (optional)
+        set a directory to save in and attempt to read input files from
+        (default is to work under /tmp and then delete)
+
+    -cache_dir dir  (optional)
+        directory for interpolation weights, topographic scale factors and
+        the sea-level combinations of each epoch (under epochs/), which
+        are reused by later runs with the same stations, coordinate
+        source, precision, tiles and working grid, e.g. after dates are
+        added to the stack (default is workdir, if given)
+
+    -grid_max n  (optional)
+        cap on the intervals per axis of the sea-level working grid.
+        Default = 400
+
+    -tiles nx/ny  (optional)
+        interpolate each epoch's sea-level grid in nx by ny tiles (see
+        tropmap.py).  Default = 1/1
+
+    -nproc n  (optional)
+        number of epochs, and then of pairs, processed at once (and of
+        worker processes for -tiles).  Default = all cores
+
+    -ISCE_DEM file (optional)
+        specify an input DEM file from ISCE.  Corrections will match
+        this DEM in range and resolution.
+
+    -chunk nx/ny  (optional)
+        write the corrections as netCDF-4 in nx by ny chunks
+
+    -complevel n  (optional)
+        deflate level 1-9 for the corrections (implies netCDF-4).  Default = 0
+
+    -precision single|double  (optional)
+        working precision of the grids and intermediate arrays.
+        Default = single
+
+    -format grd|raw|gtiff  (optional)
+        format of the corrections (see tropwrap.py).  Default = grd
+
+    -local_gipsy_dir dir (optional)
+        local directory (above yearly directories) for gipsy .trop files
+
+    -local_gamit_dir dir (optional)
+        local directory (above regional/ and global/) for gamit ofiles
+
+    -local_xml_dir dir (optional)
+        local directory for xml file
+
+    -download_only dir (optional)
+        acquire the GPS and weather data of every epoch, and the DEM, to
+        this dir, then exit
+
+    -pre_downloaded dir (optional)
+        GPS, weather, and DEM data has already been downloaded to this dir
+        with the download_only flag
+
+    -png [on,off] (optional)
+        will create a png preview of each correction. default=off
+
+    -verbose on (optional)
+        see diagnostic output
+
+EXAMPLE:
+    tropstack.py -latmin 32 -latmax 36 -lonmin -121 -lonmax -116 -resolution 6c -pairs pairs.txt -gps gipsy -Wx namanl -interp triang -cache_dir stackcache -nproc 8
+
+COPYRIGHT:
+    Copyright 2011, by the California Institute of Technology. ALL RIGHTS
+RESERVED. United States Government Sponsorship acknowledged. Any commercial use
+must be negotiated with the Office of Technology Transfer at the California
+Institute of Technology.
+
+AUTHORS:
+    Jet Propulsion Laboratory
+    California Institute of Technology
+    Pasadena, CA, USA
+'''
+
+import hashlib, json
+from tropwrap import *
+
+def read_pairs(pairfn):
+    pairs=[]
+    for line in open(pairfn):
+        line=line.split('#')[0].split()
+        if len(line)==0:
+            continue
+        if len(line) not in (6,7) or line[:3]==line[3:6]:
+            print >>sys.stderr, ' '.join(['bad pair line in',pairfn,':',' '.join(line)])
+            sys.exit(2)
+        igram=None
+        if len(line)==7:
+            igram=line[6]
+        pairs.append((tuple(line[:3]),tuple(line[3:6]),igram))
+    return pairs
+
+def epoch_name(epoch):
+    (date,hour,min)=epoch
+    return 'T'.join([date.replace('-',''),''.join([hour,min])])
+
+def pair_name(pair):
+    (epoch1,epoch2,igram)=pair
+    if igram is not None:
+        return os.path.split(igram)[1]
+    return '-'.join([epoch_name(epoch1),epoch_name(epoch2)])
+
+def epoch_clargs(clargs,epoch):
+#   copy of clargs pointed at epoch (date,hour,min)
+    eclargs=dict(clargs)
+    (eclargs['date'],eclargs['hour'],eclargs['min'])=epoch
+    return eclargs
+
+def epoch_key(clargs,gps,grid):
+#   what an epoch's sea-level combos depend on besides its date, gps,
+#   Wx and interp (which name the stack directory): its stations with
+#   their positions and delays, the coordinate source, the precision, the
+#   tiling and the working grid
+    (zhd,zwd,lonlat,sites,lon,lat)=gps
+    stations=hashlib.sha1()
+    for station in sorted(zip(sites,lon,lat,zhd,zwd)):
+        stations.update('%s %.6f %.6f %.6f %.6f\n' % station)
+    nodes=hashlib.sha1()
+    for axis in grid:
+        nodes.update(numpy.round(numpy.asarray(axis,dtype=numpy.float64),9).tostring())
+    return {'stations':stations.hexdigest(),'nstations':len(sites),'coords':clargs['coords'],
+            'precision':clargs['precision'],'tiles':clargs['tiles'],'grid':nodes.hexdigest()}
+
+def cached_combo(epochdir,key):
+#   True if epochdir holds sea-level combos an earlier run made with key
+    for fn in ('comboH.sl.grd','comboW.sl.grd','key.json'):
+        if not os.path.exists('/'.join([epochdir,fn])):
+            return False
+    try:
+        return json.load(open('/'.join([epochdir,'key.json'])))==key
+    except ValueError:
+        return False
+
+def epoch_combo(clargs,wx,gps,epochdir,grid,fout):
+#   sea-level combos of one epoch and their key.json (see epoch_key), made
+#   in a scratch directory and moved into place, so an interrupted run
+#   never leaves a partial epoch cached
+    scratch='.'.join([epochdir,str(os.getpid())])
+    os.mkdir(scratch)
+    sealevel_combo(clargs,wx,gps,scratch,grid,fout)
+    out=open('/'.join([scratch,'key.json']),'w')
+    json.dump(epoch_key(clargs,gps,grid),out,indent=1,sort_keys=True)
+    out.close()
+    if os.path.isdir(epochdir):
+        shutil.rmtree(epochdir)
+    os.rename(scratch,epochdir)
+
+def pair_correction(clargs,pair,epochdirs,tmpdir,dem,fout):
+#   mean-removed correction of one pair: the difference of its two epochs'
+#   combos scaled to the DEM in one pass (as tropwrap -differential on)
+    name=pair_name(pair)
+    pairdir='/'.join([tmpdir,'pairs',name])
+    if os.path.isdir(pairdir):
+        shutil.rmtree(pairdir)
+    os.mkdir(pairdir)
+    combos=[]
+    for epochdir in epochdirs:
+        combos.append([read_grd('/'.join([epochdir,fn])) for fn in ('comboH.sl.grd','comboW.sl.grd')])
+    for (fn,k) in (('comboH.sl.grd',0),('comboW.sl.grd',1)):
+        (wlon,wlat,z1)=combos[0][k]
+        write_grd('/'.join([pairdir,fn]),wlon,wlat,combos[1][k][2]-z1)
+    clargs['output_file']=''.join(['.'.join([name,'correction']),EXTENSIONS[clargs['format']]])
+    png=clargs['png']
+    clargs['png']='off'
+    grd=dem
+    if dem is None:
+        grd=open_grd('/'.join([tmpdir,'DEMfiles','DEM-mapres.grd']))
+    stats=GridStats()
+    try:
+        correctionName=gototopo(clargs,pairdir,fout,grd,demean=True,stats=stats)
+    finally:
+        if dem is None:
+            grd.close()
+    shutil.rmtree(pairdir)
+    (epoch1,epoch2,igram)=pair
+    write_sidecar(correctionName,clargs['format'],stats,provenance(clargs,epoch1=list(epoch1),epoch2=list(epoch2),igram=igram))
+    if png=='on':
+        create_correctionpng(clargs,correctionName)
+    return correctionName
+
+def tropstack(clargs):
+    set_precision(clargs['precision'])
+    tmpdir=setup_tmp(clargs)
+    if clargs['verbose']=='on':
+        fout=os.dup(1)
+    else:
+        fout=open(os.devnull,'w')
+    nproc=clargs['nproc'] or multiprocessing.cpu_count()
+    pairs=read_pairs(clargs['pairs'])
+    epochs=sorted(set([p[0] for p in pairs]+[p[1] for p in pairs]))
+    print ' '.join([str(len(pairs)),'pairs,',str(len(epochs)),'epochs'])
+    dem=get_dem(clargs,tmpdir,fout)
+
+    # inputs of every epoch; coordinates once for all their sites
+    fetched=run_jobs([(fetch_epoch,epoch_clargs(clargs,e),(tmpdir,fout)) for e in epochs],nproc,'inputs')
+    coords=None
+    if type(clargs['download_only']) is types.NoneType:
+        coords=epochs_site_coords([(epoch_clargs(clargs,e),sites) for (e,((sites,tropfile),wx)) in zip(epochs,fetched)],tmpdir,fout)
+    gps=[get_gpstrop(epoch_clargs(clargs,e),tmpdir,fout,trop,coords) for (e,(trop,wx)) in zip(epochs,fetched)]
+    if type(clargs['download_only']) is not types.NoneType:
+        return []
+
+    # one working grid for the whole stack, so any two epochs difference
+    stations=numpy.unique(numpy.round(numpy.vstack([numpy.column_stack((g[4],g[5])) for g in gps]),6),axis=0)
+    grid=workgrid(clargs,stations[:,0],stations[:,1])
+    stackdir=cache_dir(clargs)
+    if stackdir is None:
+        stackdir=tmpdir
+    stackdir='/'.join([stackdir,'epochs','.'.join([clargs['gps'],clargs['Wx'],clargs['interp']])])
+    if not os.path.isdir(stackdir):
+        os.makedirs(stackdir)
+    epochdirs=dict((e,'/'.join([stackdir,epoch_name(e)])) for e in epochs)
+    jobs=[]
+    for (e,(trop,wx),g) in zip(epochs,fetched,gps):
+        if not cached_combo(epochdirs[e],epoch_key(clargs,g,grid)):
+            jobs.append((epoch_combo,epoch_clargs(clargs,e),(wx,g,epochdirs[e],grid,fout)))
+    print ' '.join([str(len(epochs)-len(jobs)),'of',str(len(epochs)),'epochs cached'])
+    if jobs:
+        run_jobs(jobs,nproc,'epochs')
+
+    # scale factors once, before the pairs would each build them
+    if cache_dir(clargs) is not None:
+        if dem is None:
+            grd=open_grd('/'.join([tmpdir,'DEMfiles','DEM-mapres.grd']))
+            scale_factors(grd,Hscale,Wscale,cache_dir(clargs),dem_sources(clargs,tmpdir))
+            grd.close()
+        else:
+            scale_factors(dem,Hscale,Wscale,cache_dir(clargs),dem_sources(clargs,tmpdir))
+    if not os.path.isdir('/'.join([tmpdir,'pairs'])):
+        os.mkdir('/'.join([tmpdir,'pairs']))
+    jobs=[(pair_correction,epoch_clargs(clargs,p[1]),(p,[epochdirs[p[0]],epochdirs[p[1]]],tmpdir,dem,fout)) for p in pairs]
+    corrections=run_jobs(jobs,nproc,'pairs')
+    cleanup(clargs,tmpdir)
+    for correctionName in corrections:
+        print correctionName
+    return corrections
+
+################################################################################
+# FUNCTION: tropstackmain
+################################################################################
+def tropstackmain():
+    '''
+Main program that interprets user-specified arguments and executes the necessary methods.
+    '''
+    parser = argparse.ArgumentParser(description='Create trop corrections for a stack of interferograms')
+    parser.add_argument('-latmin',metavar='latmin',type=float,help='minimum latitude',required=True)
+    parser.add_argument('-latmax',metavar='latmax',type=float,help='maximum latitude',required=True)
+    parser.add_argument('-lonmin',metavar='lonmin',type=float,help='minimum longitude',required=True)
+    parser.add_argument('-lonmax',metavar='lonmax',type=float,help='maximum longitude',required=True)
+    parser.add_argument('-pairs',metavar='file',type=str,help='file of pairs, one "YYYY-MM-DD HH MM YYYY-MM-DD HH MM [igram]" per line',required=True)
+    parser.add_argument('-gps',metavar='gipsy|gamit',type=str,help='gipsy or gamit gps estimates',required=True,choices=['gipsy','gamit'])
+    parser.add_argument('-Wx',metavar='namanl|rucanl|gfsanl|off',type=str,help='choose weather model, or gps only',required=True,choices=['namanl','rucanl','gfsanl','off'])
+    parser.add_argument('-interp',metavar='triang|IDW|krige',type=str,help='choose triangulation, inverse distance weighting or local kriging',required=True,choices=['triang','IDW','krige'])
+    parser.add_argument('-workdir',metavar='dir',type=str,help='directory to save intermediate files in and attempt to read files from (default is to use /tmp and delete)')
+    parser.add_argument('-cache_dir',metavar='dir',type=str,help='directory for reusable weights, scale factors and epoch combinations (default is workdir, if given)')
+    parser.add_argument('-grid_max',metavar='n',type=int,help='maximum number of intervals per axis of the sea-level working grid',default=400)
+    parser.add_argument('-tiles',metavar='nx/ny',type=str,help='interpolate the sea-level grid in nx by ny tiles in parallel',default='1/1')
+    parser.add_argument('-nproc',metavar='n',type=int,help='number of epochs or pairs processed at once (default is all cores)')
+    parser.add_argument('-coords',metavar='servlet|xml|llh',type=str,help='source for site coordinates',default='xml')
+    parser.add_argument('-llh_dir',metavar='dir',type=str,help='Directory containing NominalPosition.List.llh file when using -coords llh')
+    parser.add_argument('-resolution',metavar='xres/yres',type=str,help='resolution of correction maps, specfied as xres/yres (meters)',default='6c')
+    parser.add_argument('-output_dir',metavar='dir',type=str,help='directory in which the corrections will be placed',default='.')
+    parser.add_argument('-ISCE_DEM',metavar='file',type=str,help='ISCE DEM file specifying range and resolution for the corrections')
+    parser.add_argument('-chunk',metavar='nx/ny',type=str,help='write the corrections as chunked netCDF-4 with nx by ny chunks')
+    parser.add_argument('-complevel',metavar='n',type=int,help='deflate level (1-9) for the corrections, implies netCDF-4',choices=range(0,10),default=0)
+    parser.add_argument('-precision',metavar='single|double',type=str,help='working precision of grids and intermediate arrays',choices=['single','double'],default='single')
+    parser.add_argument('-format',metavar='grd|raw|gtiff',type=str,help='correction format',choices=list(FORMATS),default='grd')
+    parser.add_argument('-local_gipsy_dir',metavar='dir',type=str,help='directory (above yearly directories) for gipsy .trop.tar files')
+    parser.add_argument('-local_gamit_dir',metavar='dir',type=str,help='directory (above global/ and regional/) for gamit ofiles')
+    parser.add_argument('-local_xml_dir',metavar='dir',type=str,help='directory for xml files')
+    parser.add_argument('-download_only',metavar='dir',type=str,help='download needed input data to this dir, then exit')
+    parser.add_argument('-pre_downloaded',metavar='dir',type=str,help='needed input data has been downloaded to this dir with -download_only')
+    parser.add_argument('-png',metavar='on',type=str,help='create png previews',choices=['on'],default='off')
+    parser.add_argument('-verbose',metavar='on',type=str,help='more diagnostic messages',choices=['on'],default='off')
+    args=parser.parse_args()
+    clargs=vars(args)
+    if not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['tiles']):
+        print >>sys.stderr, ' '.join(['-tiles must be nx/ny, not',clargs['tiles']])
+        sys.exit(2)
+    if clargs['chunk'] is not None and not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['chunk']):
+        print >>sys.stderr, ' '.join(['-chunk must be nx/ny, not',clargs['chunk']])
+        sys.exit(2)
+    if clargs['format']=='gtiff' and gdal is None:
+        print >>sys.stderr, '-format gtiff needs the GDAL python bindings (osgeo)'
+        sys.exit(2)
+    # corrections are of total delay in map geometry
+    clargs['rdr_lat']=clargs['rdr_lon']=clargs['rdr_hgt']=None
+    clargs['products']='ztd'
+
+    tropstack(clargs)
+    sys.exit(0)
+
+################################################################################
+# Main program if running as stand alone program
+################################################################################
+if __name__ == "__main__":
+    tropstackmain()
@@ -8,7 +8,7 @@ from datetime import datetime
 def main():
     date1 = datetime(2010,1,15,6,11,42)
     date2 = datetime(2010,4,17,6,11,8)
-    tu.tropoCorrection('test.int',date1,date2,sys.argv[1])
+    print tu.tropoCorrection('test.int',date1,date2,sys.argv[1])
 
 if __name__ == '__main__':
     sys.exit(main())
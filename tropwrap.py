@@ -17,7 +17,7 @@ DESCRIPTION:
 
 USAGE:
     tropwrap.py -igram <file> -latmin latmin -latmax latmax -lonmin lonmin -lonmax lonmax -resolution <xres>/<yres>
--date1 YYYY-MM-DD -hour1 HH -min1 MM  -date2 YYYY-MM-DD -hour2 HH -min2 MM -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] -interp [triang|IDW] [-output_dir <dir>] [-ISCE_DEM file] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-download_only <dir>] [-pre_downloaded <dir>] [-png on|off] [-verbose on|off]
+-date1 YYYY-MM-DD -hour1 HH -min1 MM  -date2 YYYY-MM-DD -hour2 HH -min2 MM -gps [gipsy|gamit] -Wx [namanl|rucanl|gfsanl|off] -interp [triang|IDW|krige] [-output_dir <dir>] [-ISCE_DEM file] [-rdr_lat file -rdr_lon file -rdr_hgt file] [-chunk nx/ny] [-complevel n] [-precision single|double] [-format grd|raw|gtiff] [-differential on|off] [-coords servlet|xml|llh] [-llh_dir <dir>] [-workdir <dir>] [-cache_dir <dir>] [-grid_max n] [-tiles nx/ny] [-nproc n] [-local_gipsy_dir <dir>] [-local_gamit_dir <dir>] [-download_only <dir>] [-pre_downloaded <dir>] [-png on|off] [-verbose on|off]
 
 OPTIONS:
     -igram <file>
@@ -62,8 +62,9 @@ OPTIONS:
     -Wx [namanl,rucanl,gfsanl,off]
         choose weather model, or none
 
-    -interp [triang|IDW]
-        choose triangulation or inverse distance weighting
+    -interp [triang|IDW|krige]
+        choose triangulation, inverse distance weighting, or local ordinary
+        kriging (variogram fitted per epoch; suited to dense networks)
 
     -coords [servlet|xml|llh] 
         choose method for getting site coordinates.  Default = servlet
@@ -79,10 +80,65 @@ OPTIONS:
         set a directory to save in and attempt to read input files from
         (default is to work under /tmp and then delete)
 
+    -cache_dir dir  (optional)
+        directory in which interpolation weights (keyed by station set and
+        grid) and the topographic scale factors of the DEM (keyed by DEM,
+        region, resolution and scale heights) are cached between runs
+        (default is workdir, if given)
+
+    -grid_max n  (optional)
+        cap on the intervals per axis of the intermediate sea-level grid,
+        whose spacing otherwise follows the station and weather model
+        spacing.  Default = 400
+
+    -tiles nx/ny  (optional)
+        split the sea-level grid into nx by ny tiles interpolated in
+        parallel worker processes, each from the stations and weather
+        points within a halo around its tile, and stitched into one grid.
+        For continental domains.  Default = 1/1 (no tiling)
+
+    -nproc n  (optional)
+        number of worker processes for -tiles.  Default = all cores
+
     -ISCE_DEM file (optional)
         specify an input DEM file from ISCE.  Output .grd file will match
         this DEM in range and resolution.
     
+    -rdr_lat file -rdr_lon file -rdr_hgt file  (optional)
+        ISCE radar-geometry latitude, longitude and height images (lat.rdr,
+        lon.rdr, z.rdr).  The correction is then evaluated on the pixels of
+        the interferogram and written as <igram>.correction.rdr, little-
+        endian float32 with an ISCE .xml; -format is not used
+
+    -chunk nx/ny  (optional)
+        write the product as netCDF-4 (classic model) in nx by ny chunks,
+        streamed by row blocks; readers can then fetch windows cheaply.
+        Needs GMT built with netCDF-4 to be read by GMT tools
+
+    -complevel n  (optional)
+        deflate level 1-9 for the product (implies netCDF-4).  Default = 0
+
+    -precision single|double  (optional)
+        working precision of the grids and the arrays between processing
+        stages.  single halves memory and bandwidth and differs from
+        double by less than a micrometre of delay (see precbench.py);
+        files are float32 either way.  Default = single
+
+    -format grd|raw|gtiff  (optional)
+        format of the correction: GMT netCDF grid, raw little-endian
+        float32 with a ROI_PAC .rsc, or cloud-optimized GeoTIFF (needs
+        GDAL).  raw and gtiff need -differential on.  Default = grd
+
+    -differential on|off  (optional)
+        on: difference the two epochs on the coarse sea-level grid and
+        scale the difference to the topography once, removing its mean
+        on the fly; only the correction is written.  off: make both
+        epoch maps (<igram>_model_1, _2), each on the working grid of its
+        own stations as tropwrap did before -differential, and difference
+        them with grdmath (block by block in radar geometry).  The two
+        differ slightly where the epochs' station sets differ; use off to
+        reproduce earlier corrections.  Default = on
+
     -local_gipsy_dir dir (optional)
         local directory (above yearly directories) for gipsy .trop files
         (default is to ftp from SIO)
@@ -110,7 +166,7 @@ OPTIONS:
         see diagnostic output 
 
 EXAMPLE:
-    tropwrap.py -igram geo_120928-121014-sim_HDR_8rlks.m.grd -resolution xres/yres -date1 2012-09-28 -hour1 04 -min1 07 -date2 2012-10-14 -hour2 04 -min2 07 -gps gipsy -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_dir dir] [-workdir dir] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
+    tropwrap.py -igram geo_120928-121014-sim_HDR_8rlks.m.grd -resolution xres/yres -date1 2012-09-28 -hour1 04 -min1 07 -date2 2012-10-14 -hour2 04 -min2 07 -gps gipsy -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir]  [-output_dir dir] [-workdir dir] [-cache_dir dir] [-grid_max n] [-tiles nx/ny] [-nproc n] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
 
 COPYRIGHT:
     Copyright 2011, by the California Institute of Technology. ALL RIGHTS 
@@ -124,7 +180,7 @@ AUTHORS:
     Pasadena, CA, USA
 '''
 
-import os, sys, pydoc, numpy
+import os, sys, pydoc, numpy, Queue
 from tropmap import *
 
 __author__ = 'Angelyn Moore'
@@ -139,105 +195,297 @@ def usage():
 Generate a usage print statement.
     '''
     print '''
-    tropwrap.py -igram geo_120928-121014-sim_HDR_8rlks.m.grd -resolution xres/yres -date1 2012-09-28 -hour1 04 -min1 07 -date2 2012-10-14 -hour2 04 -min2 07 -Wx namanl -interp triang [-coords servlet|xml|llh] [-llh_dir dir] [-output_dir dir] [-workdir dir] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
+    tropwrap.py -igram geo_120928-121014-sim_HDR_8rlks.m.grd -resolution xres/yres -date1 2012-09-28 -hour1 04 -min1 07 -date2 2012-10-14 -hour2 04 -min2 07 -Wx namanl -interp triang [-format grd|raw|gtiff] [-differential on|off] [-coords servlet|xml|llh] [-llh_dir dir] [-output_dir dir] [-workdir dir] [-cache_dir dir] [-grid_max n] [-tiles nx/ny] [-nproc n] [-local_gipsy_dir dir] [-local_gamit_dir dir] [-local_xml_dir] [-download_only dir] [-pre_downloaded dir] [-png on] [-verbose on]
 '''
     sys.exit(2)
 
 def get_latlonrange(igram,fout):
    try:
-       grdinfo=subprocess.Popen(['grdinfo',igram],stdout=subprocess.PIPE,stderr=fout).communicate()[0]
+       geometry=grid_geometry(igram)
    except:
-       print >>sys.stderr, ' '.join(['could not run grdinfo on',igram])       
+       print >>sys.stderr, ' '.join(['could not read the grid geometry of',igram])
        sys.exit(2)
-       
-   grdinfo=grdinfo[:-1] # remove empty line
-   infolines=grdinfo.split("\n");
-   for line in infolines:
-       fields=line.split(' ')
-       if fields[1] == 'x_min:':
-           lonmin=fields[2]
-           lonmax=fields[4]
-           x_res=fields[6]
-       if fields[1] == 'y_min:':
-           latmin=fields[2]
-           latmax=fields[4] 
-           y_res=fields[6]
-   return (float(latmin),float(latmax),float(lonmin),float(lonmax),x_res,y_res)
+   return (geometry['y_min'],geometry['y_max'],geometry['x_min'],geometry['x_max'],geometry['x_inc'],geometry['y_inc'])
    
    
 
+def set_epoch(clargs,k):
+#   point clargs at epoch k (1 or 2)
+   clargs['date']=clargs['date%d' % k]
+   clargs['hour']=clargs['hour%d' % k]
+   clargs['min']=clargs['min%d' % k]
+
+def job_worker(func,clargs,args,k,queue):
+#   body of a job process: func(clargs,*args), timed; any failure
+#   (including sys.exit) is passed back rather than raised
+   start=time.time()
+   try:
+       result=func(clargs,*args)
+   except BaseException, e:
+       queue.put((k,None,start,time.time(),repr(e)))
+       return
+   queue.put((k,result,start,time.time(),None))
+
+def run_jobs(jobs,nproc,label):
+#   jobs [(func,clargs,args),...], each run as func(clargs,*args) in its own
+#   process (not a Pool: -tiles starts a Pool inside), at most nproc at a
+#   time.  Returns the results in order and reports the work, wall time
+#   and how much of the work overlapped; exits if any job failed.
+   queue=multiprocessing.Queue()
+   procs={}
+   done={}
+   t0=time.time()
+   def finish(message):
+       (j,result,start,end,error)=message
+       done[j]=(result,start,end,error)
+       procs[j].join()
+   k=0
+   try:
+       while len(done)<len(jobs):
+           while k<len(jobs) and len([j for j in procs if j not in done])<nproc:
+               (func,jclargs,args)=jobs[k]
+               procs[k]=multiprocessing.Process(target=job_worker,args=(func,jclargs,args,k,queue))
+               procs[k].start()
+               k+=1
+           try:
+               finish(queue.get(timeout=1))
+               continue
+           except Queue.Empty:
+               pass
+           # a job's message is queued before its process exits: drain the
+           # queue before taking an exited process without one as failed
+           dead=[j for j in procs if j not in done and procs[j].exitcode is not None]
+           if dead:
+               try:
+                   while True:
+                       finish(queue.get(timeout=0.1))
+               except Queue.Empty:
+                   pass
+               for j in dead:
+                   if j not in done:
+                       procs[j].join()
+                       done[j]=(None,t0,time.time(),' '.join(['exit status',str(procs[j].exitcode)]))
+   finally:
+       for j in procs:
+           procs[j].join()
+   failed=[j for j in range(len(jobs)) if done[j][3] is not None]
+   for j in failed:
+       print >>sys.stderr, ' '.join([label,'job',str(j+1),'failed:',done[j][3]])
+   if failed:
+       sys.exit(2)
+   wall=time.time()-t0
+   times=[done[j][2]-done[j][1] for j in range(len(jobs))]
+   print '%s: %s s, %.1f s of work in %.1f s wall, overlapped %.1f s' % (label,', '.join(['%.1f' % t for t in times[:8]]+['...']*(len(times)>8)),sum(times),wall,max(0.,sum(times)-wall))
+   return [done[j][0] for j in range(len(jobs))]
+
+def run_epochs(func,clargs,args,label):
+#   func(clargs,*args[k-1]) for epochs 1 and 2 at once (see run_jobs), each
+#   with its own copy of clargs pointed at the epoch.  Returns the two
+#   results.
+   jobs=[]
+   for k in (1,2):
+       eclargs=dict(clargs)
+       set_epoch(eclargs,k)
+       jobs.append((func,eclargs,args[k-1]))
+   return tuple(run_jobs(jobs,2,label))
+
+def fetch_epoch(clargs,tmpdir,fout):
+#   the per-epoch downloads: GPS troposphere files and the weather model
+   return (acquire_trop(clargs,tmpdir),get_grib(clargs,tmpdir,fout))
+
+def epoch_map(clargs,wx,gps,combodir,tmpdir,fout,dem,output_file):
+#   -differential off: one epoch's map as tropmap makes it (working grid
+#   from its own stations), its sea-level combos in combodir, over the DEM
+#   acquired once in tmpdir for both epochs or on the radar pixels
+   grid=workgrid(clargs,gps[4],gps[5])
+   sealevel_combo(clargs,wx,gps,combodir,grid,fout)
+   clargs['output_file']=output_file
+   if type(clargs['rdr_lat']) is not types.NoneType:
+       return gotordr(clargs,tmpdir,fout,combodir=combodir)
+   return gototopo(clargs,tmpdir,fout,dem,combodir=combodir)
+
+def correction_provenance(clargs):
+   return provenance(clargs,('igram','date1','hour1','min1','date2','hour2','min2','differential'),version=__version__)
+
+def difference_stats(map1fn,map2fn,block=256):
+#   GridStats of map2 minus map1 (grids on the same nodes), read block rows
+#   at a time
+   grd1=open_grd(map1fn)
+   grd2=open_grd(map2fn)
+   stats=GridStats()
+   try:
+       ny=grd1.shape[0]
+       for i0 in range(0,ny,block):
+           i1=min(i0+block,ny)
+           stats.add(grd2.rows(i0,i1)-grd1.rows(i0,i1))
+   finally:
+       grd1.close()
+       grd2.close()
+   return stats
+
+def epoch_dirs(tmpdir):
+#   tmpdir/epoch1 and tmpdir/epoch2, for the intermediates of each epoch
+   epochdirs=['/'.join([tmpdir,'epoch%d' % k]) for k in (1,2)]
+   for epochdir in epochdirs:
+       if not os.path.isdir(epochdir):
+           os.mkdir(epochdir)
+   return epochdirs
+
+def epoch_inputs(clargs,tmpdir,fout):
+#   weather and GPS sea-level inputs of both epochs, [(wx,gps),(wx,gps)].
+#   The DEM (see tropwrap) and the site metadata are static and acquired
+#   once, as are the station coordinates (see epochs_site_coords); only
+#   the GPS and weather inputs are per epoch, and those downloads run
+#   concurrently (run_epochs).  Returns None after -download_only.
+   fetched=run_epochs(fetch_epoch,clargs,[(tmpdir,fout)]*2,'inputs')
+   trops=[trop for (trop,wx) in fetched]
+   coords=None
+   if type(clargs['download_only']) is types.NoneType:
+       # coordinates of every site with troposphere estimates at either epoch
+       epochs=[]
+       for k in (1,2):
+           eclargs=dict(clargs)
+           set_epoch(eclargs,k)
+           epochs.append((eclargs,trops[k-1][0]))
+       coords=epochs_site_coords(epochs,tmpdir,fout)
+   inputs=[]
+   for k in (1,2):
+       set_epoch(clargs,k)
+       inputs.append((fetched[k-1][1],get_gpstrop(clargs,tmpdir,fout,trops[k-1],coords)))
+   if type(clargs['download_only']) is not types.NoneType:
+       return None
+   return inputs
+
+def difference_combos(clargs,tmpdir,fout,inputs):
+#   differential mode: the sea-level combos of both epochs (inputs, from
+#   epoch_inputs) on one working grid (from the union of their stations),
+#   differenced epoch 2 minus epoch 1 into comboH.sl.grd and comboW.sl.grd
+#   in tmpdir.  The height scaling is linear in the combos, so a single
+#   pass over the DEM then gives the difference of the two maps.  The two
+#   interpolations run concurrently (run_epochs).
+   # a station seen at both epochs counts once for the grid spacing
+   stations=numpy.unique(numpy.round(numpy.vstack([numpy.column_stack((gps[4],gps[5])) for (wx,gps) in inputs]),6),axis=0)
+   grid=workgrid(clargs,stations[:,0],stations[:,1])
+   epochdirs=epoch_dirs(tmpdir)
+   run_epochs(sealevel_combo,clargs,[(wx,gps,epochdir,grid,fout) for ((wx,gps),epochdir) in zip(inputs,epochdirs)],'combos')
+   combos=[]
+   for epochdir in epochdirs:
+       combos.append([read_grd('/'.join([epochdir,fn]))[2] for fn in ('comboH.sl.grd','comboW.sl.grd')])
+   (wlon,wlat)=grid
+   write_grd('/'.join([tmpdir,'comboH.sl.grd']),wlon,wlat,combos[1][0]-combos[0][0])
+   write_grd('/'.join([tmpdir,'comboW.sl.grd']),wlon,wlat,combos[1][1]-combos[0][1])
+
 def tropwrap(clargs):
+   set_precision(clargs['precision'])
    tmpdir=setup_tmp(clargs)
    if clargs['verbose']=='on':
        fout=os.dup(1)
    else:
        fout=open(os.devnull,'w')
+   igram_dir, igram_name = os.path.split(clargs['igram'])
+   # the DEM, site metadata and coordinates serve both epochs
+   dem=None
+   if type(clargs['rdr_lat']) is types.NoneType:
+       dem=get_dem(clargs,tmpdir,fout)
+   inputs=epoch_inputs(clargs,tmpdir,fout)
+   if inputs is None:
+       return None
+   if clargs['differential']=='on':
+       # one full-resolution pass: the mean-free correction straight from
+       # the differenced sea-level combos, on the DEM or the radar pixels
+       difference_combos(clargs,tmpdir,fout,inputs)
+       png=clargs['png']
+       clargs['png']='off'
+       stats=GridStats()
+       if type(clargs['rdr_lat']) is types.NoneType:
+           fmt=clargs['format']
+           clargs['output_file']=''.join(['.'.join([igram_name,'correction']),EXTENSIONS[fmt]])
+           correctionName=gototopo(clargs,tmpdir,fout,dem,demean=True,stats=stats)
+       else:
+           # on the interferogram's own pixels, as an ISCE image
+           fmt='rdr'
+           clargs['output_file']='.'.join([igram_name,'correction','rdr'])
+           correctionName=gotordr(clargs,tmpdir,fout,demean=True,stats=stats)
+       clargs['png']=png
+       cleanup(clargs,tmpdir)
+       # geometry, layout, statistics and provenance for wrapCorrection
+       write_sidecar(correctionName,fmt,stats,correction_provenance(clargs))
+       if clargs['png']=='on':
+           create_correctionpng(clargs,correctionName)
+       return correctionName
+
 #   clargs['output_dir']=tmpdir
    #(clargs['latmin'],clargs['latmax'],clargs['lonmin'],clargs['lonmax'],x_res,y_res)=get_latlonrange(clargs['igram'],fout)
-   clargs['date']=clargs['date1']
-   clargs['hour']=clargs['hour1']
-   clargs['min']=clargs['min1']
-   clargs['output_file']=os.path.split(clargs['igram'])[1] + '_model_1'
-
 #   clargs['output_dir']=tmpdir
    print(clargs)
-   map1fn=tropmap(clargs)
-   clargs['date']=clargs['date2']
-   clargs['hour']=clargs['hour2']
-   clargs['min']=clargs['min2']
-   clargs['output_file']=os.path.split(clargs['igram'])[1] + '_model_2'
-   
-   map2fn=tropmap(clargs)
-#  subtract to make diff, subtract mean
-   igram_dir, igram_name = os.path.split(clargs['igram'])
-   subprocess.Popen(['grdmath',map2fn,map1fn,'SUB','=','/'.join([tmpdir,'.'.join([igram_name,'correction.grd'])])]).wait()
-   grdinfo=subprocess.Popen(['grdinfo','-L2','/'.join([tmpdir,'.'.join([igram_name,'correction.grd'])])],stdout=subprocess.PIPE,stderr=fout).communicate()[0]
-   grdinfo=grdinfo[:-1] # remove empty line
-   infolines=grdinfo.split("\n");
-   for line in infolines:
-       fields=line.split(' ')
-       if fields[1] == 'mean:':
-           mean=fields[2]
+   # the two epoch maps are made at the same time, each on its own grid
+   epochdirs=epoch_dirs(tmpdir)
+   (map1fn,map2fn)=run_epochs(epoch_map,clargs,[(wx,gps,epochdir,tmpdir,fout,dem,igram_name + '_model_%d' % k) for (k,(wx,gps),epochdir) in zip((1,2),inputs,epochdirs)],'maps')
+#  subtract to make diff, subtract mean: the statistics of the difference
+#  in one pass over the two maps, then one grdmath pass
+   if type(clargs['rdr_lat']) is not types.NoneType:
+       correctionName = '/'.join([clargs['output_dir'],'.'.join([igram_name,'correction.rdr'])])
+       stats=difference_rdr(correctionName,map1fn,map2fn)
+       cleanup(clargs,tmpdir)
+       write_sidecar(correctionName,'rdr',stats,correction_provenance(clargs))
+       return correctionName
+   stats=difference_stats(map1fn,map2fn)
+   mean='%.9g' % stats.mean
    correctionName = '/'.join([clargs['output_dir'],'.'.join([igram_name,'correction.grd'])])
    subprocess.Popen(['grdmath',map2fn,map1fn,'SUB',mean,'SUB','=',correctionName]).wait()
-   import cPickle as cp
-   fp = open('tropwrap.pck','w')
-   cp.dump((correctionName,grdinfo),fp)
-   fp.close()
-
-   '''
-   subprocess.Popen(['grdmath',clargs['igram'],'/'.join([clargs['output_dir'],'.'.join([igram_name,'correction.grd'])]),'SUB','=','/'.join([tmpdir,'.'.join([igram_name,'corrected.grd'])])]).wait()
-   grdinfo=subprocess.Popen(['grdinfo','-L2','/'.join([tmpdir,'.'.join([igram_name,'corrected.grd'])])],stdout=subprocess.PIPE,stderr=fout).communicate()[0]
-   grdinfo=grdinfo[:-1] # remove empty line
-   infolines=grdinfo.split("\n");
-   for line in infolines:
-       fields=line.split(' ')
-       if fields[1] == 'mean:':
-           mean=fields[2]
-   subprocess.Popen(['grdmath',clargs['igram'],'/'.join([tmpdir,'.'.join([igram_name,'correction.grd'])]),'SUB',mean,'SUB','=','/'.join([clargs['output_dir'],'.'.join([igram_name,'corrected.grd'])])])
-
-   if clargs['png']=='on':
-       create_correxpng(clargs)
-    '''
+   stats.shift(float(mean))
+   cleanup(clargs,tmpdir)
+   write_sidecar(correctionName,'grd',stats,correction_provenance(clargs))
+   return correctionName
+
+def difference_rdr(correctionName,map1fn,map2fn,block=256):
+#  radar-geometry maps have no grdmath: difference them block lines at a
+#  time, once for the statistics (GridStats) and once to write it out
+#  with the mean removed.  Returns the statistics of what was written.
+   map1=isce_band(map1fn)
+   map2=isce_band(map2fn)
+   stats=GridStats()
+   for i0 in range(0,map1.shape[0],block):
+       stats.add(map2[i0:i0+block]-map1[i0:i0+block])
+   mean=0.
+   if stats.count:
+       mean=stats.mean
+   out=open(correctionName,'wb')
+   try:
+       for i0 in range(0,map1.shape[0],block):
+           diff=map2[i0:i0+block]-map1[i0:i0+block]-mean
+           out.write(diff.astype('<f4').tostring())
+   finally:
+       out.close()
+   write_isce_xml(''.join([correctionName,'.xml']),map1.shape[1],map1.shape[0])
+   stats.shift(mean)
+   return stats
+
+def create_correctionpng(clargs,correctionName):
+#  preview of the correction (diffmap.cpt)
+   fullpath=os.path.abspath(os.path.dirname(sys.argv[0]))
+   if type(clargs['rdr_lat']) is not types.NoneType:
+       # first line at the top, no coastlines in radar geometry
+       z=isce_band(correctionName)
+       (length,width)=z.shape
+       render_png('.'.join([correctionName,'png']),Grid(numpy.arange(width),numpy.arange(length,0,-1),z),'/'.join([fullpath,'diffmap.cpt']),coast=False)
+       return
+   grd=open_raster(correctionName)
+   try:
+       render_png('.'.join([correctionName,'png']),grd,'/'.join([fullpath,'diffmap.cpt']))
+   finally:
+       grd.close()
+
 def create_correxpng(clargs):
-#  plot diff map
+#  plot diff map and corrected map (in-process, diffmap.cpt)
    igram_dir, igram_name = os.path.split(clargs['igram'])
    fullpath=os.path.abspath(os.path.dirname(sys.argv[0]))
-   bbox='/'.join([''.join(['-R',str(clargs['lonmin'])]),str(clargs['lonmax']),str(clargs['latmin']),str(clargs['latmax'])])
-   proj=''.join(['-Jkf',str((clargs['lonmin']+clargs['lonmax'])/2),'/10'])
-   ps=open('/'.join([clargs['output_dir'],'.'.join([igram_name,'correction','ps'])]),'w') 
-   subprocess.call(['grdimage',proj,bbox,''.join(['-C','/'.join([fullpath,'diffmap.cpt'])]),'/'.join([clargs['output_dir'], '.'.join([igram_name,'correction','grd'])]),'-K'],stdout=ps)
-   subprocess.call(['pscoast',proj,bbox,'-Bg0/g0','-Di','-W','-O','-K'],stdout=ps)
-   subprocess.call(['psscale','-D5.5/2/2.5/0.1','-B:,m:',''.join(['-C','/'.join([fullpath,'/diffmap.cpt'])]),'-B0.1','-E','-O'],stdout=ps)
-   ps.close
-   subprocess.call(['convert','-trim','-rotate','90','/'.join([clargs['output_dir'],'.'.join([igram_name,'correction','ps'])]),'/'.join([clargs['output_dir'],'.'.join([igram_name,'correction','png'])])])
-#  plot corrected map
-   ps=open('/'.join([clargs['output_dir'],'.'.join([igram_name,'corrected','ps'])]),'w') 
-   subprocess.call(['grdimage',proj,bbox,''.join(['-C','/'.join([fullpath,'diffmap.cpt'])]), '/'.join([clargs['output_dir'],'.'.join([igram_name,'corrected','grd'])]),'-K'],stdout=ps)
-   subprocess.call(['pscoast',proj,bbox,'-Bg0/g0','-Di','-W','-O','-K'],stdout=ps)
-   subprocess.call(['psscale','-D5.5/2/2.5/0.1','-B:,m:',''.join(['-C','/'.join([fullpath,'/diffmap.cpt'])]),'-B0.1','-E','-O'],stdout=ps)
-   ps.close
-   subprocess.call(['convert','-trim','-rotate','90','/'.join([clargs['output_dir'],'.'.join([igram_name,'corrected','ps'])]),'/'.join([clargs['output_dir'],'.'.join([igram_name,'corrected','png'])])])
+   for product in ['correction','corrected']:
+       grd=open_grd('/'.join([clargs['output_dir'],'.'.join([igram_name,product,'grd'])]))
+       try:
+           render_png('/'.join([clargs['output_dir'],'.'.join([igram_name,product,'png'])]),grd,'/'.join([fullpath,'diffmap.cpt']))
+       finally:
+           grd.close()
 
 
 ################################################################################
@@ -269,13 +517,25 @@ Main program that interprets user-specified arguments and executes the necessary
 #    parser.add_argument('-Wx',metavar='namanl|narr-a|rucanl|off',type=str,help='choose weather model, or gps only',required=True,choices=['namanl','narr-a','rucanl','off'])
 #    parser.add_argument('-interp',metavar='triang|IDW',type=str,help='choose triangulation or inverse distance weighting',required=True,choices=['triang','IDW'])
     parser.add_argument('-Wx',metavar='namanl|rucanl|gfsanl|off',type=str,help='choose weather model, or gps only',required=True,choices=['namanl','rucanl','gfsanl','off'])
-    parser.add_argument('-interp',metavar='triang|IDW',type=str,help='choose triangulation or inverse distance weighting',required=True,choices=['triang','IDW'])
+    parser.add_argument('-interp',metavar='triang|IDW|krige',type=str,help='choose triangulation, inverse distance weighting or local kriging',required=True,choices=['triang','IDW','krige'])
     parser.add_argument('-workdir',metavar='dir',type=str,help='directory to save intermediate files in and attempt to read files from (default is to use /tmp and delete)')
+    parser.add_argument('-cache_dir',metavar='dir',type=str,help='directory for reusable interpolation weights and topographic scale factors (default is workdir, if given)')
+    parser.add_argument('-grid_max',metavar='n',type=int,help='maximum number of intervals per axis of the sea-level working grid',default=400)
+    parser.add_argument('-tiles',metavar='nx/ny',type=str,help='interpolate the sea-level grid in nx by ny tiles in parallel',default='1/1')
+    parser.add_argument('-nproc',metavar='n',type=int,help='number of worker processes for -tiles (default is all cores)')
     parser.add_argument('-coords',metavar='servlet|xml|llh',type=str,help='source for site coordinates',default='xml')
     parser.add_argument('-llh_dir',metavar='dir',type=str,help='Directory containing NominalPosition.List.llh file when using -coords llh')
     parser.add_argument('-resolution',metavar='xres/yres',type=str,help='resolution of correction map, specfied as xres/yres (meters)',default='6c')
     parser.add_argument('-output_dir',metavar='dir',type=str,help='directory in which the result map will be placed',default='.')
     parser.add_argument('-ISCE_DEM',metavar='file',type=str,help='ISCE DEM file specifying range and resolution for product file')
+    parser.add_argument('-rdr_lat',metavar='file',type=str,help='ISCE radar-geometry latitude image (lat.rdr); the correction is then in radar geometry')
+    parser.add_argument('-rdr_lon',metavar='file',type=str,help='ISCE radar-geometry longitude image (lon.rdr)')
+    parser.add_argument('-rdr_hgt',metavar='file',type=str,help='ISCE radar-geometry height image (z.rdr)')
+    parser.add_argument('-chunk',metavar='nx/ny',type=str,help='write the product as chunked netCDF-4 with nx by ny chunks')
+    parser.add_argument('-complevel',metavar='n',type=int,help='deflate level (1-9) for the product, implies netCDF-4',choices=range(0,10),default=0)
+    parser.add_argument('-precision',metavar='single|double',type=str,help='working precision of grids and intermediate arrays',choices=['single','double'],default='single')
+    parser.add_argument('-format',metavar='grd|raw|gtiff',type=str,help='correction format (raw and gtiff need -differential on)',choices=list(FORMATS),default='grd')
+    parser.add_argument('-differential',metavar='on|off',type=str,help='difference the epochs before topographic scaling (default on; off makes and differences both epoch maps)',choices=['on','off'],default='on')
     parser.add_argument('-local_gipsy_dir',metavar='dir',type=str,help='directory (above yearly directories) for gipsy .trop.tar files')
     parser.add_argument('-local_gamit_dir',metavar='dir',type=str,help='directory (above global/ and regional/) for gamit ofiles')
     parser.add_argument('-local_xml_dir',metavar='dir',type=str,help='directory for xml files')
@@ -286,6 +546,23 @@ Main program that interprets user-specified arguments and executes the necessary
     args=parser.parse_args()
     clargs=vars(args)
     # Add type checking, min<max, etc here
+    if not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['tiles']):
+        print >>sys.stderr, ' '.join(['-tiles must be nx/ny, not',clargs['tiles']])
+        sys.exit(2)
+    if clargs['chunk'] is not None and not re.match('^[1-9][0-9]*/[1-9][0-9]*$',clargs['chunk']):
+        print >>sys.stderr, ' '.join(['-chunk must be nx/ny, not',clargs['chunk']])
+        sys.exit(2)
+    if clargs['format']=='gtiff' and gdal is None:
+        print >>sys.stderr, '-format gtiff needs the GDAL python bindings (osgeo)'
+        sys.exit(2)
+    if [clargs['rdr_lat'],clargs['rdr_lon'],clargs['rdr_hgt']].count(None) not in (0,3):
+        print >>sys.stderr, '-rdr_lat, -rdr_lon and -rdr_hgt must be given together'
+        sys.exit(2)
+    # the difference is of total delay only; epoch maps are GMT grids for grdmath
+    clargs['products']='ztd'
+    if clargs['differential']=='off' and clargs['format']!='grd':
+        print >>sys.stderr, ' '.join(['-format',clargs['format'],'needs -differential on (the epoch maps are differenced with grdmath)'])
+        sys.exit(2)
 
     retstatus=tropwrap(clargs)
     sys.exit(0)